@@ -0,0 +1,132 @@
+"""
+Atom 渲染基准测试，对比 pydantic 模型（Text / Image / Video / AtomEntry / AtomFeed）与轻量渲染路径
+（html 构造函数 + LiteAtomEntry + iter_feed）的吞吐与每个 feed 的内存分配峰值，并校验两者输出逐字节一致。
+
+usage: python bench/bench_render.py [--feeds 200] [--entries 20] [--lines 300]
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rss_model import (  # noqa: E402
+    Text, Image, Video, AtomEntry, AtomFeed, LiteAtomEntry,
+    text_html, image_html, video_html, iter_feed, latest_updated,
+)
+
+
+def dynamic_item(i: int) -> dict:
+    # The fields the dynamic extractor renders, a video or a picture post.
+    return {
+        'id': str(900000000 + i),
+        'updated': f'2024-12-{i % 28 + 1:02d}T12:00:00+08:00',
+        'title': f'投稿了视频：视频 {i} & <co>',
+        'desc': f'简介 {i} ' * 20,
+        'cover': f'https://i0.hdslb.com/bfs/archive/{i}.jpg',
+        'pics': [f'https://i0.hdslb.com/bfs/new_dyn/{i}_{n}.jpg' for n in range(i % 4)],
+    }
+
+
+def novel_item(i: int, lines: int) -> dict:
+    return {
+        'id': str(20000000 + i),
+        'updated': f'2024-12-{i % 28 + 1:02d}T01:17:58+09:00',
+        'title': f'小说 {i}',
+        'cover': f'/rss/pixiv/img_proxy/https---i.pximg.net/c/{i}.jpg',
+        'tags': ['原创', '恋爱', f'tag{i}'],
+        'lines': [f'第 {n} 行，这是小说正文的一行文字。' * 3 for n in range(lines)],
+    }
+
+
+def dynamic_pydantic(items: list[dict]) -> str:
+    entry_list = []
+    for e in items:
+        media_list = [Video(aid=e['id'], bid=e['id'], cover=e['cover'], desc=e['desc'], duration='1:00', jump_url='', title=e['title'])]
+        media_list.extend(Image(src=src) for src in e['pics'])
+        entry_list.append(AtomEntry(
+            title=e['title'], link=f"https://t.bilibili.com/{e['id']}", eid=e['id'], updated=e['updated'],
+            summary=e['title'], content=''.join([m.html() for m in media_list])
+        ))
+    return AtomFeed(title='up的动态', link='/bilibili/dynamic/1', updated=latest_updated(entry_list), authors=['up'],
+                    fid='brss/bilibili/dynamic/1', entry_list=entry_list).xml()
+
+
+def dynamic_lite(items: list[dict]) -> str:
+    entry_list = []
+    for e in items:
+        media_list = [video_html(e['title'], e['desc'], e['cover'])]
+        media_list.extend(image_html(src) for src in e['pics'])
+        entry_list.append(LiteAtomEntry(
+            title=e['title'], link=f"https://t.bilibili.com/{e['id']}", eid=e['id'], updated=e['updated'],
+            summary=e['title'], content=''.join(media_list)
+        ))
+    return ''.join(iter_feed('up的动态', '/bilibili/dynamic/1', latest_updated(entry_list), ['up'],
+                             'brss/bilibili/dynamic/1', (e.xml() for e in entry_list)))
+
+
+def novel_pydantic(items: list[dict]) -> str:
+    entry_list = []
+    for e in items:
+        media_list = [Image(src=e['cover']), Text(text='Tags: ' + ' '.join(e['tags']))]
+        media_list.extend([Text(text=line) for line in e['lines']])
+        entry_list.append(AtomEntry(
+            title=f"作者 更新了小说: {e['title']}", link=f"/rss/pixiv/novel_redirect/{e['id']}", eid=e['id'],
+            updated=e['updated'], summary='', content=''.join([m.html() for m in media_list])
+        ))
+    return AtomFeed(title='作者的 Pixiv 小说列表', link='/rss/pixiv/user_novels/1', updated=latest_updated(entry_list),
+                    authors=['作者'], fid='brss/pixiv/user_novels/1', entry_list=entry_list).xml()
+
+
+def novel_lite(items: list[dict]) -> str:
+    entry_list = []
+    for e in items:
+        media_list = [image_html(e['cover']), text_html('Tags: ' + ' '.join(e['tags']))]
+        media_list.extend([text_html(line) for line in e['lines']])
+        entry_list.append(LiteAtomEntry(
+            title=f"作者 更新了小说: {e['title']}", link=f"/rss/pixiv/novel_redirect/{e['id']}", eid=e['id'],
+            updated=e['updated'], summary='', content=''.join(media_list)
+        ))
+    return ''.join(iter_feed('作者的 Pixiv 小说列表', '/rss/pixiv/user_novels/1', latest_updated(entry_list), ['作者'],
+                             'brss/pixiv/user_novels/1', (e.xml() for e in entry_list)))
+
+
+def measure(render, items: list[dict], feeds: int) -> tuple[float, float]:
+    """
+    :return: entries per second, allocation peak per feed in KB
+    """
+    st = time.perf_counter()
+    for _ in range(feeds):
+        render(items)
+    cost = time.perf_counter() - st
+
+    tracemalloc.start()
+    render(items)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return feeds * len(items) / cost, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--feeds', type=int, default=200)
+    parser.add_argument('--entries', type=int, default=20)
+    parser.add_argument('--lines', type=int, default=300, help='lines per novel')
+    args = parser.parse_args()
+
+    suites = (
+        ('dynamic', [dynamic_item(i) for i in range(args.entries)], dynamic_pydantic, dynamic_lite, args.feeds),
+        # A novel entry is ~100x the work of a dynamic one.
+        ('novel', [novel_item(i, args.lines) for i in range(args.entries)], novel_pydantic, novel_lite, max(1, args.feeds // 20)),
+    )
+    for suite, items, pydantic_render, lite_render, feeds in suites:
+        assert pydantic_render(items) == lite_render(items), f'{suite}: outputs differ'
+        for name, render in (('pydantic', pydantic_render), ('lite', lite_render)):
+            rate, peak_kb = measure(render, items, feeds)
+            print(f'{suite:<8} {name:<9} {rate:10.0f} entries/s  {peak_kb:9.1f} KB peak/feed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+feed/space 响应解码基准测试：对比 resp.json()（标准库 json，保留完整 JSON 树）与 decode_space（orjson + 只保留提取器用到字段的
+SpaceItem / SpacePage）的 解析 + 提取 吞吐，以及一页数据解码后常驻的内存。
+
+默认使用按真实响应结构构造的页面，也可以用 --payload 传入录制的响应文件（可多次指定）。
+
+usage: python bench/bench_space_decode.py [--pages 2000] [--items 12] [--payload recorded.json ...]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from routes.bilibili.collect_api import space_model  # noqa: E402
+from routes.bilibili.collect_api.space_model import SpacePage, decode_space  # noqa: E402
+from routes.bilibili.convert_api.dynamic import extract_new_entries  # noqa: E402
+
+
+def author(i: int) -> dict:
+    return {
+        'avatar': {'container_size': {'height': 1.35, 'width': 1.35}, 'fallback_layers': {'is_critical_group': True, 'layers': [
+            {'general_spec': {'pos_spec': {'axis_x': 0.675, 'axis_y': 0.675, 'coordinate_pos': 2}, 'render_spec': {'opacity': 1}, 'size_spec': {'height': 1, 'width': 1}},
+             'layer_config': {'is_critical': True, 'tags': {'AVATAR_LAYER': {}, 'GENERAL_CFG': {'config_type': 1, 'general_config': {'web_css_style': {'borderRadius': '50%'}}}}},
+             'resource': {'res_image': {'image_src': {'placeholder': 6, 'remote': {'bfs_style': 'widget-layer-avatar', 'url': 'https://i0.hdslb.com/bfs/face/x.jpg'}, 'src_type': 1}}, 'res_type': 3},
+             'visible': True}]}, 'mid': '32708462'},
+        'face': 'https://i0.hdslb.com/bfs/face/x.jpg', 'face_nft': False, 'following': None, 'jump_url': '//space.bilibili.com/32708462/dynamic',
+        'label': '', 'mid': 32708462, 'name': 'up主', 'official_verify': {'desc': '', 'type': -1},
+        'pendant': {'expire': 0, 'image': '', 'image_enhance': '', 'image_enhance_frame': '', 'n_pid': 0, 'name': '', 'pid': 0},
+        'pub_action': '投稿了视频', 'pub_location_text': '', 'pub_time': '2024-12-01', 'pub_ts': 1733000000 + i, 'type': 'AUTHOR_TYPE_NORMAL',
+        'vip': {'avatar_subscript': 1, 'avatar_subscript_url': '', 'due_date': 1764000000000, 'label': {'bg_color': '#FB7299', 'bg_style': 1, 'border_color': '',
+                'img_label_uri_hans': '', 'img_label_uri_hans_static': 'https://i0.hdslb.com/bfs/vip/x.png', 'label_theme': 'annual_vip', 'path': '',
+                'text': '年度大会员', 'text_color': '#FFFFFF', 'use_img_label': True}, 'nickname_color': '#FB7299', 'status': 1, 'theme_type': 0, 'type': 2},
+    }
+
+
+def item(i: int) -> dict:
+    if i % 2:
+        major = {'type': 'MAJOR_TYPE_ARCHIVE', 'archive': {
+            'aid': str(1000 + i), 'badge': {'bg_color': '#FB7299', 'color': '#FFFFFF', 'icon_url': None, 'text': '投稿视频'}, 'bvid': f'BV1xx411c7{i:02d}',
+            'cover': f'http://i0.hdslb.com/bfs/archive/{i}.jpg', 'desc': '视频简介 ' * 30, 'disable_preview': 0, 'duration_text': '12:34',
+            'jump_url': f'//www.bilibili.com/video/BV1xx411c7{i:02d}/', 'stat': {'danmaku': '1234', 'play': '5.6万'}, 'title': f'视频标题 {i}', 'type': 1}}
+        desc = None
+    else:
+        major = {'type': 'MAJOR_TYPE_OPUS', 'opus': {
+            'fold_action': ['展开', '收起'], 'jump_url': f'//www.bilibili.com/opus/{i}',
+            'pics': [{'height': 1080, 'live_url': None, 'size': 512.3, 'url': f'http://i0.hdslb.com/bfs/new_dyn/{i}_{n}.jpg', 'width': 1920} for n in range(3)],
+            'summary': {'rich_text_nodes': [{'orig_text': '图文正文 ' * 40, 'text': '图文正文 ' * 40, 'type': 'RICH_TEXT_NODE_TYPE_TEXT'}], 'text': '图文正文 ' * 40},
+            'title': None}}
+        desc = {'rich_text_nodes': [{'orig_text': f'动态文字 {i}', 'text': f'动态文字 {i}', 'type': 'RICH_TEXT_NODE_TYPE_TEXT'}], 'text': f'动态文字 {i}'}
+    return {
+        'basic': {'comment_id_str': str(1000 + i), 'comment_type': 1, 'like_icon': {'action_url': 'https://i0.hdslb.com/bfs/garb/x.bin', 'end_url': '', 'id': 1, 'start_url': ''},
+                  'rid_str': str(1000 + i)},
+        'id_str': str(900000000000000000 + i),
+        'modules': {
+            'module_author': author(i),
+            'module_dynamic': {'additional': None, 'desc': desc, 'major': major, 'topic': None},
+            'module_more': {'three_point_items': [{'label': '取消关注', 'type': 'THREE_POINT_FOLLOWING'}, {'label': '举报', 'type': 'THREE_POINT_REPORT'}]},
+            'module_stat': {'comment': {'count': 123, 'forbidden': False}, 'forward': {'count': 45, 'forbidden': False},
+                            'like': {'count': 6789, 'forbidden': False, 'status': False}},
+        },
+        'type': 'DYNAMIC_TYPE_AV' if i % 2 else 'DYNAMIC_TYPE_DRAW',
+        'visible': True,
+    }
+
+
+def synthetic_page(items: int) -> bytes:
+    data = {'has_more': True, 'items': [item(i) for i in range(items)], 'offset': '900000000000000000', 'update_baseline': '', 'update_num': 0}
+    return json.dumps({'code': 0, 'message': '0', 'ttl': 1, 'data': data}, ensure_ascii=False).encode('utf-8')
+
+
+def legacy(body: bytes) -> tuple[object, int]:
+    # resp.json(): the whole tree is parsed by the standard library and kept while the page is processed.
+    json_data = json.loads(body)
+    page = SpacePage.decode(json_data['data'])
+    return json_data, len(extract_new_entries(page.items, dict()))
+
+
+def typed(body: bytes) -> tuple[object, int]:
+    _, _, page = decode_space(body)
+    return page, len(extract_new_entries(page.items, dict()))
+
+
+def retained_kb(decode, body: bytes) -> float:
+    tracemalloc.start()
+    kept, _ = decode(body)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=12, help='items per synthetic page')
+    parser.add_argument('--payload', action='append', default=[], help='recorded feed/space response body')
+    args = parser.parse_args()
+
+    bodies = []
+    for path in args.payload:
+        with open(path, 'rb') as f:
+            bodies.append(f.read())
+    if not bodies:
+        bodies.append(synthetic_page(args.items))
+
+    print(f'json backend: {space_model.loads.__module__}, {len(bodies)} payload(s), {sum(map(len, bodies)) / len(bodies) / 1024:.1f} KB avg')
+    for name, decode in (('resp.json', legacy), ('decode_space', typed)):
+        st = time.perf_counter()
+        for i in range(args.pages):
+            decode(bodies[i % len(bodies)])
+        cost = time.perf_counter() - st
+        kept = sum(retained_kb(decode, body) for body in bodies) / len(bodies)
+        print(f'{name:<13} {args.pages / cost:8.0f} pages/s  {cost / args.pages * 1e3:6.3f} ms/page  {kept:8.1f} KB retained/page')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+SQLiteCacheProxy 命中延迟基准测试，验证表规模从 1k 增长到 1M 行时单次 get 的耗时保持平稳。
+
+usage: python bench/bench_sqlite_cache.py [--sizes 1000 10000 100000 1000000] [--reads 20000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sqlalchemy import text  # noqa: E402
+from cache_proxy import CacheLib, SQLiteCacheProxy  # noqa: E402
+
+
+def fill(proxy: SQLiteCacheProxy, start: int, stop: int):
+    now = int(time.time())
+    batch_size = 10000
+    with proxy.engine.begin() as conn:
+        for i in range(start, stop, batch_size):
+            conn.execute(
+                text('INSERT OR REPLACE INTO runtime_cache (key, value, set_time, exp_time) VALUES (:name, :value, :set_time, :exp_time)'),
+                [{'name': f'key-{j}', 'value': b'x' * 256, 'set_time': now, 'exp_time': now + 3600} for j in range(i, min(i + batch_size, stop))]
+            )
+
+
+def measure(proxy: SQLiteCacheProxy, size: int, reads: int) -> float:
+    keys = [f'key-{random.randrange(size)}' for _ in range(reads)]
+    st = time.perf_counter()
+    for k in keys:
+        assert proxy.get(k, lib=CacheLib.RUNTIME) is not None
+    return (time.perf_counter() - st) / reads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--reads', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        proxy = SQLiteCacheProxy(db_path=os.path.join(tmp, 'bench.db'))
+        try:
+            filled = 0
+            for size in sorted(args.sizes):
+                fill(proxy, filled, size)
+                filled = size
+                per_get = measure(proxy, size, args.reads)
+                print(f'rows={size:>9}  get hit: {per_get * 1e6:8.2f} us/op')
+        finally:
+            proxy.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+上游请求未命中延迟基准测试，对比每次新建 httpx.AsyncClient 与共享连接池客户端。
+
+本地桩服务器在每个新连接建立时等待 --handshake-ms 毫秒，模拟到 api.bilibili.com 的 TCP + TLS 握手开销。
+两种客户端都经过同一个限流器，只有连接复用不同；给出 --rate / --max-concurrency 时按应用里的 HostPolicy 限流，
+此时吞吐量的上限是限流器而不是连接池。--http2 使用明文 HTTP/2 (h2c prior knowledge) 的桩服务器，需要安装 h2。
+
+usage: python bench/bench_upstream_client.py [--requests 200] [--concurrency 1 8] [--handshake-ms 30]
+                                             [--http2] [--rate 2] [--max-concurrency 4]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import httpx  # noqa: E402
+from rate_limiter import RateLimiter, HostPolicy  # noqa: E402
+from routes.bilibili.collect_api.client import (  # noqa: E402
+    KEEPALIVE_EXPIRY_S, RateLimitedTransport, new_client,
+)
+
+
+PAYLOAD = json.dumps({'code': 0, 'data': {'items': [{'id_str': str(i)} for i in range(50)]}}).encode()
+
+
+def start_stub(handshake_s: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            time.sleep(handshake_s)
+            super().setup()
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(PAYLOAD)))
+            self.end_headers()
+            self.wfile.write(PAYLOAD)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def start_h2c_stub(handshake_s: float) -> asyncio.Server:
+    import h2.config
+    import h2.events
+    import h2.connection
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await asyncio.sleep(handshake_s)
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+        while data := await reader.read(65536):
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    conn.send_headers(event.stream_id, [
+                        (':status', '200'), ('content-type', 'application/json'), ('content-length', str(len(PAYLOAD))),
+                    ])
+                    conn.send_data(event.stream_id, PAYLOAD, end_stream=True)
+            writer.write(conn.data_to_send())
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+def make_client(limiter: RateLimiter, http2: bool) -> httpx.AsyncClient:
+    if not http2:
+        # The stub speaks HTTP/1.1 only, http2 is negotiated through TLS ALPN.
+        return new_client(limiter, http2=False)
+    # Same client as new_client, but speaking HTTP/2 without TLS.
+    transport = httpx.AsyncHTTPTransport(
+        http1=False,
+        http2=True,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32, keepalive_expiry=KEEPALIVE_EXPIRY_S),
+    )
+    return httpx.AsyncClient(transport=RateLimitedTransport(transport, limiter))
+
+
+async def run(url: str, requests: int, concurrency: int, limiter: RateLimiter, http2: bool, shared: bool) -> list[float]:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    client = make_client(limiter, http2) if shared else None
+
+    async def one():
+        async with semaphore:
+            st = time.perf_counter()
+            if client is None:
+                async with make_client(limiter, http2) as own:
+                    (await own.get(url)).json()
+            else:
+                (await client.get(url)).json()
+            latencies.append(time.perf_counter() - st)
+
+    try:
+        await asyncio.gather(*[one() for _ in range(requests)])
+    finally:
+        if client is not None:
+            await client.aclose()
+    return latencies
+
+
+def report(name: str, latencies: list[float], total: float):
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1e3
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e3
+    print(f'{name:<16} p50 {p50:7.2f} ms  p99 {p99:7.2f} ms  {len(latencies) / total:8.1f} req/s')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--handshake-ms', type=float, default=30)
+    parser.add_argument('--http2', action='store_true')
+    parser.add_argument('--rate', type=float, help='requests per second of the HostPolicy, no limit when omitted')
+    parser.add_argument('--max-concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.http2:
+        server = await start_h2c_stub(args.handshake_ms / 1000)
+        port = server.sockets[0].getsockname()[1]
+    else:
+        server = start_stub(args.handshake_ms / 1000)
+        port = server.server_address[1]
+    url = f'http://127.0.0.1:{port}/x/polymer/web-dynamic/v1/feed/space'
+    try:
+        for concurrency in args.concurrency:
+            print(f'concurrency={concurrency}')
+            for name, shared in (('new client', False), ('shared client', True)):
+                limiter = RateLimiter()
+                if args.rate is not None:
+                    # Never rejects, every request of the run is measured.
+                    limiter.configure('127.0.0.1', HostPolicy(
+                        rate=args.rate, burst=4, max_concurrency=args.max_concurrency, max_wait_s=float('inf'),
+                    ))
+                st = time.perf_counter()
+                latencies = await run(url, args.requests, concurrency, limiter, args.http2, shared)
+                report(f'  {name}', latencies, time.perf_counter() - st)
+    finally:
+        if args.http2:
+            server.close()
+        else:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+import os
+import time
+import hashlib
+import tempfile
+from threading import Lock
+from dataclasses import dataclass
+
+from sqlalchemy import create_engine, event, text
+
+from cache_proxy import LockWrapper, set_sqlite_pragmas
+
+
+@dataclass(frozen=True)
+class BlobInfo:
+    path: str
+    media_type: str
+    size: int
+
+
+class BlobStore:
+    """
+    On-disk store for binary media (proxied images).
+
+    Files are named by the sha256 of their content under <root>/objects/ab/cd/, so identical
+    images fetched through different URLs are kept once. A small SQLite index maps cache keys
+    to digests and tracks last access, the least recently used keys are evicted once the total
+    size exceeds max_bytes.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    TOUCH_INTERVAL_S = 60  # last_access is only rewritten when older than this
+
+    def __init__(self, root: str = './data/blobs', max_bytes: int = 512 * 1024 * 1024):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+
+        self.engine = create_engine(
+            f"sqlite:///{os.path.join(self.root, 'index.db')}",
+            connect_args={"check_same_thread": False},
+        )
+        event.listen(self.engine, 'connect', set_sqlite_pragmas)
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE if not exists blob_index(key TEXT PRIMARY KEY, digest TEXT, size INTEGER, media_type TEXT, last_access INTEGER)"))
+            conn.execute(text("CREATE INDEX if not exists blob_index_last_access ON blob_index(last_access)"))
+            conn.execute(text("CREATE INDEX if not exists blob_index_digest ON blob_index(digest)"))
+            self.total_size = conn.execute(text(
+                "SELECT COALESCE(SUM(size), 0) FROM (SELECT digest, MAX(size) AS size FROM blob_index GROUP BY digest)"
+            )).scalar()
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:4], digest)
+
+    def new_temp_file(self):
+        """
+        Open a temporary file next to the objects, so put_file can move it into place without copying.
+        """
+        return tempfile.NamedTemporaryFile(dir=self.tmp_dir, delete=False)
+
+    @LockWrapper
+    def get(self, key: str) -> BlobInfo | None:
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                text("SELECT digest, size, media_type, last_access FROM blob_index WHERE key = :key"), {'key': key}
+            ).first()
+            if row is None:
+                return None
+            digest, size, media_type, last_access = row
+            path = self._object_path(digest)
+            if not os.path.exists(path):
+                # Removed behind the store's back, forget the key and the bytes it was counted for.
+                conn.execute(text("DELETE FROM blob_index WHERE key = :key"), {'key': key})
+                self._drop_unreferenced(conn, digest, size)
+                return None
+            now = int(time.time())
+            if now - last_access >= self.TOUCH_INTERVAL_S:
+                conn.execute(text("UPDATE blob_index SET last_access = :now WHERE key = :key"), {'key': key, 'now': now})
+        return BlobInfo(path=path, media_type=media_type, size=size)
+
+    def put(self, key: str, data: bytes, media_type: str) -> BlobInfo:
+        with self.new_temp_file() as fn:
+            fn.write(data)
+        return self.put_file(key, fn.name, media_type)
+
+    def put_file(self, key: str, src_path: str, media_type: str) -> BlobInfo:
+        """
+        Move a finished file into the store under key. src_path must be on the same filesystem, see new_temp_file.
+        """
+        sha = hashlib.sha256()
+        size = 0
+        with open(src_path, 'rb') as fn:
+            while chunk := fn.read(self.CHUNK_SIZE):
+                sha.update(chunk)
+                size += len(chunk)
+        digest = sha.hexdigest()
+        path = self._object_path(digest)
+        return self._commit(key, digest, size, media_type, src_path, path)
+
+    @LockWrapper
+    def _commit(self, key: str, digest: str, size: int, media_type: str, src_path: str, path: str) -> BlobInfo:
+        if os.path.exists(path):
+            os.remove(src_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(src_path, path)
+
+        with self.engine.begin() as conn:
+            # total_size follows the index, a digest is counted once however many keys point to it.
+            counted = conn.execute(text("SELECT 1 FROM blob_index WHERE digest = :digest LIMIT 1"), {'digest': digest}).first()
+            if counted is None:
+                self.total_size += size
+            old = conn.execute(text("SELECT digest, size FROM blob_index WHERE key = :key"), {'key': key}).first()
+            conn.execute(
+                text("INSERT OR REPLACE INTO blob_index (key, digest, size, media_type, last_access) VALUES (:key, :digest, :size, :media_type, :now)"),
+                {'key': key, 'digest': digest, 'size': size, 'media_type': media_type, 'now': int(time.time())}
+            )
+            if old is not None and old.digest != digest:
+                self._drop_unreferenced(conn, old.digest, old.size)
+            self._evict(conn, keep_key=key)
+        return BlobInfo(path=path, media_type=media_type, size=size)
+
+    def _drop_unreferenced(self, conn, digest: str, size: int):
+        still_used = conn.execute(text("SELECT 1 FROM blob_index WHERE digest = :digest LIMIT 1"), {'digest': digest}).first()
+        if still_used is not None:
+            return
+        # The indexed size, total_size was counted from it, whether or not the file is still there.
+        self.total_size -= size
+        try:
+            os.remove(self._object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, conn, keep_key: str):
+        while self.total_size > self.max_bytes:
+            rows = conn.execute(
+                text("SELECT key, digest, size FROM blob_index WHERE key != :keep ORDER BY last_access LIMIT 64"), {'keep': keep_key}
+            ).all()
+            if not rows:
+                break
+            for key, digest, size in rows:
+                conn.execute(text("DELETE FROM blob_index WHERE key = :key"), {'key': key})
+                self._drop_unreferenced(conn, digest, size)
+                if self.total_size <= self.max_bytes:
+                    break
+
+    def stats(self) -> dict[str, int]:
+        with self.engine.connect() as conn:
+            count = conn.execute(text("SELECT COUNT(*) FROM blob_index")).scalar()
+        return {'keys': count, 'bytes': self.total_size, 'max_bytes': self.max_bytes}
+
+    def close(self):
+        self.engine.dispose()
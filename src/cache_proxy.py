@@ -1,13 +1,20 @@
 import os
 import time
+import heapq
+import asyncio
+import functools
 from enum import Enum
+from collections import OrderedDict
 from abc import ABC, abstractmethod
 from datetime import datetime
 from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 
 import redis
+import redis.asyncio as aioredis
 from redis_conf import *
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, event, text
+from sqlalchemy.sql.elements import TextClause
 
 
 class CacheLib(Enum):
@@ -21,10 +28,58 @@ class AbsCacheProxy(ABC):
     def set(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
         raise NotImplementedError
 
+    @abstractmethod
+    def add(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG) -> bool:
+        """
+        Set only when name holds no live value, atomically.
+        :return: whether the value was set
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def get(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> bytes | None:
         raise NotImplementedError
 
+    @abstractmethod
+    def get_with_expire_at(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> tuple[bytes | None, int | None]:
+        """
+        Same as get, also returns the unix timestamp the value expires at, None if it never expires.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_many(self, mapping: dict[str, str | bytes], ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        """
+        Set several values in one atomic write, readers see either none or all of them.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_many_with_expire_at(self, names: list[str], lib: CacheLib = CacheLib.CONFIG) -> list[tuple[bytes | None, int | None]]:
+        """
+        get_with_expire_at for several names in one round-trip, results are in the order of names.
+        """
+        raise NotImplementedError
+
+    def get_many(self, names: list[str], lib: CacheLib = CacheLib.CONFIG) -> list[bytes | None]:
+        return [value for value, _ in self.get_many_with_expire_at(names, lib=lib)]
+
+    @abstractmethod
+    def delete(self, names: list[str], lib: CacheLib = CacheLib.CONFIG):
+        """
+        Remove several values in one round-trip, names holding nothing are skipped.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str, lib: CacheLib = CacheLib.CONFIG) -> int:
+        """
+        Remove every value whose name starts with prefix, for clearing out data of an old layout.
+        An empty prefix raises ValueError, clearing a whole lib is never what a caller of this wants.
+        :return: removed values
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def list_all(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str]]:
         raise NotImplementedError
@@ -33,6 +88,13 @@ class AbsCacheProxy(ABC):
     def list_all_2(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str, str, str]]:
         raise NotImplementedError
 
+    def clear_expired_data(self) -> tuple[int, int]:
+        """
+        Drop expired entries eagerly. Backends that expire keys on their own have nothing to do.
+        :return: removed rows, removed value bytes
+        """
+        return 0, 0
+
     @staticmethod
     def int_to_str(value: int | None) -> str:
         if value is None:
@@ -40,6 +102,11 @@ class AbsCacheProxy(ABC):
         return datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S')
 
 
+def check_prefix(prefix: str):
+    if not prefix:
+        raise ValueError('delete_prefix needs a non-empty prefix')
+
+
 def LockWrapper(func):
     def inner(self, *args, **kwargs):
         lock = self.lock
@@ -52,77 +119,228 @@ def LockWrapper(func):
     return inner
 
 
-class MemoryCacheProxy(AbsCacheProxy):
-    def __init__(self):
-        self.config_cache: dict[str, bytes] = dict()
-        self.config_ex: dict[str, (int, int)] = dict()
+class MemoryStore:
+    """
+    Entries of one lib: LRU order in an OrderedDict, expire times in a min-heap so expired entries
+    can be dropped without being read. Heap items are not removed on overwrite, a popped item only
+    counts when it still matches the entry's current expire time.
+    """
 
-        self.runtime_cache: dict[str, bytes] = dict()
-        self.runtime_ex: dict[str, (int, int)] = dict()
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, tuple[bytes, int, int | None]] = OrderedDict()
+        self.deadlines: list[tuple[int, str]] = []
+        self.size = 0
 
+    def set(self, name: str, value: bytes, ex: int | None):
+        self.pop(name)
+        if len(value) > self.max_bytes:
+            return
+        now = int(time.time())
+        expire_at = now + ex if ex else None
+        self.entries[name] = value, now, expire_at
+        self.size += len(value)
+        if expire_at is not None:
+            heapq.heappush(self.deadlines, (expire_at, name))
+        self.sweep(now)
+        while self.size > self.max_bytes:
+            _, (evicted, _, _) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def get(self, name: str) -> tuple[bytes | None, int | None]:
+        entry = self.entries.get(name)
+        if entry is None:
+            return None, None
+        value, _, expire_at = entry
+        if expire_at is not None and int(time.time()) >= expire_at:
+            self.pop(name)
+            return None, None
+        self.entries.move_to_end(name)
+        return value, expire_at
+
+    def pop(self, name: str):
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def sweep(self, now: int) -> tuple[int, int]:
+        removed, removed_bytes = 0, 0
+        deadlines = self.deadlines
+        while deadlines and deadlines[0][0] <= now:
+            expire_at, name = heapq.heappop(deadlines)
+            entry = self.entries.get(name)
+            if entry is not None and entry[2] == expire_at:
+                self.pop(name)
+                removed += 1
+                removed_bytes += len(entry[0])
+        # Overwritten keys leave stale heap items behind, rebuild before they dominate the heap.
+        if len(deadlines) > 2 * len(self.entries) + 1024:
+            self.deadlines = [(e[2], k) for k, e in self.entries.items() if e[2] is not None]
+            heapq.heapify(self.deadlines)
+        return removed, removed_bytes
+
+    def items(self, now: int) -> list[tuple[str, bytes, int, int | None]]:
+        return [(k, v, st, et) for k, (v, st, et) in self.entries.items() if et is None or et > now]
+
+
+class MemoryCacheProxy(AbsCacheProxy):
+    def __init__(self, config_max_bytes: int = 16 * 1024 * 1024, runtime_max_bytes: int = 64 * 1024 * 1024):
+        self.stores: dict[CacheLib, MemoryStore] = {
+            CacheLib.CONFIG: MemoryStore(config_max_bytes),
+            CacheLib.RUNTIME: MemoryStore(runtime_max_bytes),
+        }
         self.lock = Lock()
 
     @LockWrapper
     def set(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
-        cache = self.config_cache if lib == CacheLib.CONFIG else self.runtime_cache
-        dex = self.config_ex if lib == CacheLib.CONFIG else self.runtime_ex
-
         if type(value) is str:
-            cache[name] = value.encode('utf-8')
+            value = value.encode('utf-8')
         elif type(value) is bytes:
-            cache[name] = value
+            pass
         else:
             raise TypeError(f'Value type not str or bytes.')
+        self.stores[lib].set(name, value, ex)
 
-        if ex:
-            dex[name] = int(time.time()), ex
+    @LockWrapper
+    def add(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG) -> bool:
+        store = self.stores[lib]
+        if store.get(name)[0] is not None:
+            return False
+        store.set(name, encode_value(value), ex)
+        return True
 
     @LockWrapper
     def get(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> bytes | None:
-        cache = self.config_cache if lib == CacheLib.CONFIG else self.runtime_cache
-        dex = self.config_ex if lib == CacheLib.CONFIG else self.runtime_ex
-
-        if name not in cache:
-            return None
-        if name not in dex:
-            return cache[name]
-        st, ex = dex[name]
-        now = int(time.time())
-        if now - st >= ex:
-            del cache[name]
-            del dex[name]
-            return None
-        else:
-            return cache[name]
+        return self.stores[lib].get(name)[0]
+
+    @LockWrapper
+    def get_with_expire_at(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> tuple[bytes | None, int | None]:
+        return self.stores[lib].get(name)
+
+    @LockWrapper
+    def set_many(self, mapping: dict[str, str | bytes], ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        encoded = {name: encode_value(value) for name, value in mapping.items()}
+        store = self.stores[lib]
+        for name, value in encoded.items():
+            store.set(name, value, ex)
+
+    @LockWrapper
+    def get_many_with_expire_at(self, names: list[str], lib: CacheLib = CacheLib.CONFIG) -> list[tuple[bytes | None, int | None]]:
+        store = self.stores[lib]
+        return [store.get(name) for name in names]
+
+    @LockWrapper
+    def delete(self, names: list[str], lib: CacheLib = CacheLib.CONFIG):
+        store = self.stores[lib]
+        for name in names:
+            store.pop(name)
+
+    @LockWrapper
+    def delete_prefix(self, prefix: str, lib: CacheLib = CacheLib.CONFIG) -> int:
+        check_prefix(prefix)
+        store = self.stores[lib]
+        names = [name for name in store.entries if name.startswith(prefix)]
+        for name in names:
+            store.pop(name)
+        return len(names)
 
     @LockWrapper
     def list_all(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str]]:
-        cache = self.config_cache if lib == CacheLib.CONFIG else self.runtime_cache
-        return [(k, v.decode()) for k, v in cache.items()]
+        return [(k, v.decode()) for k, v, _, _ in self.stores[lib].items(int(time.time()))]
 
     @LockWrapper
     def list_all_2(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str, str, str]]:
-        cache = self.config_cache if lib == CacheLib.CONFIG else self.runtime_cache
-        dex = self.config_ex if lib == CacheLib.CONFIG else self.runtime_ex
-        ret = []
-        for k, v in cache.items():
-            update_time, expired_time = dex[k] if k in dex else (None, None)
-            ret.append((k, v.decode(), self.int_to_str(update_time), self.int_to_str(expired_time)))
-        return ret
+        return [
+            (k, v.decode(), self.int_to_str(st), self.int_to_str(et))
+            for k, v, st, et in self.stores[lib].items(int(time.time()))
+        ]
+
+    @LockWrapper
+    def clear_expired_data(self) -> tuple[int, int]:
+        now = int(time.time())
+        removed, removed_bytes = 0, 0
+        for store in self.stores.values():
+            rows, size = store.sweep(now)
+            removed += rows
+            removed_bytes += size
+        return removed, removed_bytes
+
+    @LockWrapper
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            lib.value: {'entries': len(store.entries), 'bytes': store.size, 'max_bytes': store.max_bytes}
+            for lib, store in self.stores.items()
+        }
+
+
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',  # 16 MiB page cache per connection
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA busy_timeout=5000',
+)
+
+
+def set_sqlite_pragmas(dbapi_conn, _conn_record):
+    """
+    sqlalchemy "connect" event listener, applies SQLITE_PRAGMAS to every new pooled connection.
+    """
+    cursor = dbapi_conn.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
 
 
 class SQLiteCacheProxy(AbsCacheProxy):
-    def __init__(self):
-        # self.engine = create_engine("sqlite:///SQLite3CacheDb.db", connect_args={"check_same_thread": False})
-        os.makedirs('./data', exist_ok=True)
-        self.engine = create_engine("sqlite:///./data/SQLite3CacheDb.db")
-        with self.engine.connect() as conn:
-            conn.execute(text("CREATE TABLE if not exists config_cache(key TEXT PRIMARY KEY, value BLOB, set_time INTEGER, exp_time INTEGER)"))
-            conn.execute(text("CREATE TABLE if not exists runtime_cache(key TEXT PRIMARY KEY, value BLOB, set_time INTEGER, exp_time INTEGER)"))
+    def __init__(self, db_path: str = './data/SQLite3CacheDb.db', pool_size: int = 5):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # One engine (and its connection pool) lives as long as the proxy, connections are
+        # shared between the event loop and scheduler threads, so the same-thread check is disabled.
+        self.engine = create_engine(
+            f"sqlite:///{db_path}",
+            connect_args={"check_same_thread": False},
+            pool_size=pool_size,
+            max_overflow=pool_size,
+        )
+        event.listen(self.engine, 'connect', set_sqlite_pragmas)
+        self.incremental_vacuum = False  # auto_vacuum=INCREMENTAL is in effect, see clear_expired_data
+        with self.engine.begin() as conn:
+            for table_name in ('config_cache', 'runtime_cache'):
+                conn.execute(text(f"CREATE TABLE if not exists {table_name}(key TEXT PRIMARY KEY, value BLOB, set_time INTEGER, exp_time INTEGER)"))
+                conn.execute(text(f"CREATE INDEX if not exists {table_name}_exp_time ON {table_name}(exp_time) WHERE exp_time > 0"))
 
-    def set(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
-        table_name = 'config_cache' if lib == CacheLib.CONFIG else 'runtime_cache'
+        # Statements are built once, sqlalchemy caches their compiled form and sqlite3 caches the prepared ones.
+        self._sql: dict[CacheLib, dict[str, TextClause]] = {
+            lib: {
+                'set': text(f'INSERT OR REPLACE INTO {table_name} (key, value, set_time, exp_time) VALUES (:name, :value, :set_time, :exp_time)'),
+                'add_clear': text(f'DELETE FROM {table_name} WHERE key = :name AND exp_time > 0 AND exp_time <= :set_time'),
+                'add': text(f'INSERT OR IGNORE INTO {table_name} (key, value, set_time, exp_time) VALUES (:name, :value, :set_time, :exp_time)'),
+                'get': text(f'SELECT value FROM {table_name} WHERE key = :name AND (exp_time = 0 OR exp_time > :now)'),
+                'get_ex': text(f'SELECT value, exp_time FROM {table_name} WHERE key = :name AND (exp_time = 0 OR exp_time > :now)'),
+                'get_many': text(
+                    f'SELECT key, value, exp_time FROM {table_name} WHERE key IN :names AND (exp_time = 0 OR exp_time > :now)'
+                ).bindparams(bindparam('names', expanding=True)),
+                'delete': text(f'DELETE FROM {table_name} WHERE key IN :names').bindparams(bindparam('names', expanding=True)),
+                # A key range instead of LIKE, it is answered from the primary key index.
+                'delete_range': text(
+                    f'DELETE FROM {table_name} WHERE rowid IN '
+                    f'(SELECT rowid FROM {table_name} WHERE key >= :lo AND key < :hi LIMIT :batch_size)'
+                ),
+                'list': text(f'SELECT key, value, set_time, exp_time FROM {table_name} WHERE exp_time = 0 OR exp_time > :now'),
+                'purge': text(
+                    f'DELETE FROM {table_name} WHERE rowid IN '
+                    f'(SELECT rowid FROM {table_name} WHERE exp_time > 0 AND exp_time <= :now LIMIT :batch_size) '
+                    f'RETURNING length(value)'
+                ),
+            }
+            for lib, table_name in ((CacheLib.CONFIG, 'config_cache'), (CacheLib.RUNTIME, 'runtime_cache'))
+        }
 
+    def set(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
         if type(value) is str:
             value = value.encode('utf-8')
         elif type(value) is bytes:
@@ -136,108 +354,720 @@ class SQLiteCacheProxy(AbsCacheProxy):
         else:
             ext = 0
 
-        with self.engine.connect() as conn:
-            sql = f'INSERT OR REPLACE INTO {table_name} (key, value, set_time, exp_time) VALUES (:name, :value, :set_time, :exp_time);'
-            conn.execute(text(sql), [{'name': name, 'value': value, 'set_time': now, 'exp_time': ext}])
-            conn.commit()
+        with self.engine.begin() as conn:
+            conn.execute(self._sql[lib]['set'], {'name': name, 'value': value, 'set_time': now, 'exp_time': ext})
+
+    def add(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG) -> bool:
+        now = int(time.time())
+        params = {'name': name, 'value': encode_value(value), 'set_time': now, 'exp_time': now + ex if ex else 0}
+        with self.engine.begin() as conn:
+            conn.execute(self._sql[lib]['add_clear'], params)
+            return conn.execute(self._sql[lib]['add'], params).rowcount == 1
 
     def get(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> bytes | None:
-        table_name = 'config_cache' if lib == CacheLib.CONFIG else 'runtime_cache'
+        with self.engine.connect() as conn:
+            return conn.execute(self._sql[lib]['get'], {'name': name, 'now': int(time.time())}).scalar()
 
+    def get_with_expire_at(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> tuple[bytes | None, int | None]:
         with self.engine.connect() as conn:
-            fetch_result = conn.execute(text(f'select key from {table_name}'))
-            keys = [row[0] for row in fetch_result.all()]
-            if name not in keys:
-                return None
-            fetch_result = conn.execute(text(f'select * from {table_name} where key = :name'), [{'name': name}])
-            key, value, _, ext = fetch_result.all()[0]
-            if ext == 0:
-                return value
-            else:
-                now = int(time.time())
-                if now >= ext:
-                    return None
-                else:
-                    return value
+            row = conn.execute(self._sql[lib]['get_ex'], {'name': name, 'now': int(time.time())}).first()
+        if row is None:
+            return None, None
+        value, ext = row
+        return value, None if ext == 0 else ext
 
-    def list_all(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str]]:
-        table_name = 'config_cache' if lib == CacheLib.CONFIG else 'runtime_cache'
+    def set_many(self, mapping: dict[str, str | bytes], ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        now = int(time.time())
+        ext = now + ex if ex else 0
+        params = [{'name': name, 'value': encode_value(value), 'set_time': now, 'exp_time': ext} for name, value in mapping.items()]
+        if not params:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(self._sql[lib]['set'], params)
 
+    def get_many_with_expire_at(self, names: list[str], lib: CacheLib = CacheLib.CONFIG) -> list[tuple[bytes | None, int | None]]:
+        if not names:
+            return []
         with self.engine.connect() as conn:
-            fetch_result = conn.execute(text(f'select * from {table_name}'))
-            rows = fetch_result.all()
-            ret = []
-            now = int(time.time())
-            for key, value, _, ext in rows:
-                if ext == 0:
-                    ret.append((key, value))
-                else:
-                    if now >= ext:
-                        pass
-                    else:
-                        ret.append((key, value))
-        return ret
+            rows = conn.execute(self._sql[lib]['get_many'], {'names': list(names), 'now': int(time.time())}).all()
+        found = {key: (value, None if ext == 0 else ext) for key, value, ext in rows}
+        return [found.get(name, (None, None)) for name in names]
 
-    def list_all_2(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str, str, str]]:
-        table_name = 'config_cache' if lib == CacheLib.CONFIG else 'runtime_cache'
+    def delete(self, names: list[str], lib: CacheLib = CacheLib.CONFIG):
+        if not names:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(self._sql[lib]['delete'], {'names': list(names)})
 
+    def delete_prefix(self, prefix: str, lib: CacheLib = CacheLib.CONFIG, batch_size: int = 1000) -> int:
+        check_prefix(prefix)
+        params = {'lo': prefix, 'hi': prefix[:-1] + chr(ord(prefix[-1]) + 1), 'batch_size': batch_size}
+        removed = 0
+        while True:
+            # batch_size rows per transaction, like the expiry purge, writers are never blocked for long.
+            with self.engine.begin() as conn:
+                rows = conn.execute(self._sql[lib]['delete_range'], params).rowcount
+            removed += rows
+            if rows < batch_size:
+                return removed
+
+    def list_all(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str]]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(self._sql[lib]['list'], {'now': int(time.time())}).all()
+        return [(key, value) for key, value, _, _ in rows]
+
+    def list_all_2(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str, str, str]]:
         with self.engine.connect() as conn:
-            fetch_result = conn.execute(text(f'select * from {table_name}'))
-            rows = fetch_result.all()
-            ret = []
-            now = int(time.time())
-            for key, value, update_time, ext in rows:
-                ut = None if update_time == 0 else update_time
-                et = None if ext == 0 else ext
-
-                if ext == 0:
-                    ret.append((key, value, self.int_to_str(ut), self.int_to_str(et)))
-                else:
-                    if now >= ext:
-                        pass
-                    else:
-                        ret.append((key, value, self.int_to_str(ut), self.int_to_str(et)))
+            rows = conn.execute(self._sql[lib]['list'], {'now': int(time.time())}).all()
+        ret = []
+        for key, value, update_time, ext in rows:
+            ut = None if update_time == 0 else update_time
+            et = None if ext == 0 else ext
+            ret.append((key, value, self.int_to_str(ut), self.int_to_str(et)))
         return ret
 
     def close(self):
         self.engine.dispose()
 
-    def clear_expired_data(self) -> None:
-        with self.engine.connect() as conn:
-            fetch_result = conn.execute(text('select * from runtime_cache'))
-            rows = fetch_result.all()
-            expired = []
-            now = int(time.time())
-            for key, value, _, ext in rows:
-                if ext == 0:
-                    pass
-                else:
-                    if now >= ext:
-                        expired.append(key)
-                    else:
-                        pass
-
-            batch_size = 1000
-            for i in range(0, len(expired), batch_size):
-                batch = [{'key': key} for key in expired[i:i + batch_size]]
-                conn.execute(text("delete from runtime_cache where key = :key;"), batch)
-            conn.commit()
+    def clear_expired_data(self, batch_size: int = 1000, max_batches: int = 100, vacuum_pages: int = 2000) -> tuple[int, int]:
+        """
+        Delete expired rows of both libs through the exp_time index, batch_size rows per transaction so
+        writers are never blocked for long, at most max_batches per call (the rest waits for the next run).
+        Then return up to vacuum_pages free pages to the OS.
+        :return: removed rows, removed value bytes
+        """
+        # Incremental auto vacuum lets this job hand free pages back a few at a time. Switching an existing
+        # file to it needs one full VACUUM, run here instead of at startup: by now the startup migrations
+        # (the legacy image purge) have deleted their rows, and the VACUUM compacts their pages too.
+        vacuumed = self._enable_incremental_vacuum()
+        removed, removed_bytes = 0, 0
+        now = int(time.time())
+        for lib in (CacheLib.CONFIG, CacheLib.RUNTIME):
+            for _ in range(max_batches):
+                with self.engine.begin() as conn:
+                    sizes = conn.execute(self._sql[lib]['purge'], {'now': now, 'batch_size': batch_size}).scalars().all()
+                removed += len(sizes)
+                removed_bytes += sum(e or 0 for e in sizes)
+                if len(sizes) < batch_size:
+                    break
+        if removed and not vacuumed:
+            # sqlite3's execute steps a statement only once and incremental_vacuum frees one page per step,
+            # executescript runs it to completion.
+            raw_conn = self.engine.raw_connection()
+            try:
+                raw_conn.driver_connection.executescript(f'PRAGMA incremental_vacuum({int(vacuum_pages)});')
+            finally:
+                raw_conn.close()
+        return removed, removed_bytes
+
+    def _enable_incremental_vacuum(self) -> bool:
+        """
+        :return: whether the file was switched (and fully vacuumed) now
+        """
+        if self.incremental_vacuum:
+            return False
+        raw_conn = self.engine.raw_connection()
+        try:
+            driver_conn = raw_conn.driver_connection
+            if driver_conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                self.incremental_vacuum = True
+                return False
+            # VACUUM must run outside a transaction, executescript commits first.
+            driver_conn.executescript('PRAGMA auto_vacuum=INCREMENTAL; VACUUM;')
+            self.incremental_vacuum = True
+            return True
+        finally:
+            raw_conn.close()
+
+
+def redis_key(name: str, lib: CacheLib) -> str:
+    return f'{REDIS_KEY_PREFIX}:{lib.value}:{name}'
+
+
+def redis_pattern(lib: CacheLib, name_prefix: str = '') -> str:
+    # Escape glob characters so a prefix containing them still only matches its own keys.
+    prefix = ''.join(f'\\{c}' if c in '*?[]\\' else c for c in redis_key(name_prefix, lib))
+    return f'{prefix}*'
 
 
 class RedisCacheProxy(AbsCacheProxy):
+    """
+    Keys live under "<REDIS_KEY_PREFIX>:<lib>:" so config and runtime data, and several app
+    instances with different prefixes, can share one Redis database.
+    """
 
-    def __init__(self):
+    SCAN_BATCH_SIZE = 500
+
+    def __init__(self, pool: redis.ConnectionPool | None = None):
         super().__init__()
-        self.redis_conn = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+        if pool is None:
+            pool = redis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, max_connections=REDIS_MAX_CONNECTIONS)
+        self.redis_conn = redis.Redis(connection_pool=pool)
+
+    def set(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        self.redis_conn.set(redis_key(name, lib), value, ex=ex)
+
+    def set_many(self, mapping: dict[str, str | bytes], ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        pipe = self.redis_conn.pipeline(transaction=True)
+        for name, value in mapping.items():
+            pipe.set(redis_key(name, lib), value, ex=ex)
+        pipe.execute()
+
+    def add(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG) -> bool:
+        return bool(self.redis_conn.set(redis_key(name, lib), value, ex=ex, nx=True))
+
+    def get(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> bytes | None:
+        return self.redis_conn.get(redis_key(name, lib))
+
+    def get_with_expire_at(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> tuple[bytes | None, int | None]:
+        key = redis_key(name, lib)
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.ttl(key)
+        value, ttl = pipe.execute()
+        return value, int(time.time()) + ttl if value is not None and ttl >= 0 else None
+
+    def get_many_with_expire_at(self, names: list[str], lib: CacheLib = CacheLib.CONFIG) -> list[tuple[bytes | None, int | None]]:
+        if not names:
+            return []
+        keys = [redis_key(name, lib) for name in names]
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.mget(keys)
+        for key in keys:
+            pipe.ttl(key)
+        values, *ttls = pipe.execute()
+        now = int(time.time())
+        return [(v, now + ttl if v is not None and ttl >= 0 else None) for v, ttl in zip(values, ttls)]
+
+    def delete(self, names: list[str], lib: CacheLib = CacheLib.CONFIG):
+        if names:
+            self.redis_conn.delete(*[redis_key(name, lib) for name in names])
+
+    def delete_prefix(self, prefix: str, lib: CacheLib = CacheLib.CONFIG) -> int:
+        check_prefix(prefix)
+        removed = 0
+        batch: list[bytes] = []
+        for key in self.redis_conn.scan_iter(match=redis_pattern(lib, prefix), count=self.SCAN_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= self.SCAN_BATCH_SIZE:
+                removed += self.redis_conn.delete(*batch)
+                batch.clear()
+        if batch:
+            removed += self.redis_conn.delete(*batch)
+        return removed
+
+    def _scan(self, lib: CacheLib, with_ttl: bool) -> list[tuple[str, bytes, int | None]]:
+        prefix_len = len(redis_key('', lib))
+        now = int(time.time())
+        ret = []
+        batch: list[bytes] = []
+
+        def flush():
+            pipe = self.redis_conn.pipeline(transaction=False)
+            pipe.mget(batch)
+            if with_ttl:
+                for k in batch:
+                    pipe.ttl(k)
+            values, *ttls = pipe.execute()
+            for i, (k, v) in enumerate(zip(batch, values)):
+                if v is None:  # expired or deleted between SCAN and MGET
+                    continue
+                ttl = ttls[i] if with_ttl else -1
+                ret.append((k[prefix_len:].decode(), v, now + ttl if ttl >= 0 else None))
+            batch.clear()
+
+        for key in self.redis_conn.scan_iter(match=redis_pattern(lib), count=self.SCAN_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= self.SCAN_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+        return ret
+
+    def list_all(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str]]:
+        return [(k, v.decode()) for k, v, _ in self._scan(lib, with_ttl=False)]
+
+    def list_all_2(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str, str, str]]:
+        # Redis keeps no write time, only the expiry is reported.
+        return [(k, v.decode(), self.int_to_str(None), self.int_to_str(et)) for k, v, et in self._scan(lib, with_ttl=True)]
+
+    def close(self):
+        self.redis_conn.close()
+        self.redis_conn.connection_pool.disconnect()
+
+
+class LRUTier:
+    """
+    Size bounded in-process LRU used as the first tier of TieredCacheProxy / AsyncTieredCacheProxy.
+    Entries keep the backend's expire time, max_ttl additionally bounds how long a value may be served
+    without asking the backend, which limits staleness when several processes share one backend.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_item_bytes: int = 1024 * 1024, max_ttl: int = 60):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.max_ttl = max_ttl
+        self.entries: OrderedDict[tuple[CacheLib, str], tuple[bytes, float, int | None]] = OrderedDict()
+        self.size = 0
+        # Bumped by every write, a fill read from the backend before a write must not land after it.
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    @LockWrapper
+    def get(self, name: str, lib: CacheLib) -> tuple[bytes | None, int | None]:
+        key = (lib, name)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, None
+        value, deadline, expire_at = entry
+        if time.time() >= deadline:
+            self._pop(key)
+            self.misses += 1
+            return None, None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value, expire_at
+
+    @LockWrapper
+    def put(self, name: str, value: bytes, expire_at: int | None, lib: CacheLib):
+        self.generation += 1
+        self._put((lib, name), value, expire_at)
+
+    @LockWrapper
+    def fill(self, name: str, value: bytes, expire_at: int | None, lib: CacheLib, generation: int):
+        if generation == self.generation:
+            self._put((lib, name), value, expire_at)
+
+    @LockWrapper
+    def invalidate(self, name: str, lib: CacheLib):
+        self.generation += 1
+        self._pop((lib, name))
+
+    @LockWrapper
+    def invalidate_prefix(self, prefix: str, lib: CacheLib):
+        self.generation += 1
+        for key in [k for k in self.entries if k[0] == lib and k[1].startswith(prefix)]:
+            self._pop(key)
+
+    def _put(self, key: tuple[CacheLib, str], value: bytes, expire_at: int | None):
+        self._pop(key)
+        if len(value) > self.max_item_bytes:
+            return
+        deadline = time.time() + self.max_ttl
+        if expire_at is not None:
+            deadline = min(deadline, expire_at)
+        self.entries[key] = value, deadline, expire_at
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, (evicted, _, _) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def _pop(self, key: tuple[CacheLib, str]):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    @LockWrapper
+    def stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'bytes': self.size}
+
+
+def encode_value(value: str | bytes) -> bytes:
+    if type(value) is str:
+        return value.encode('utf-8')
+    elif type(value) is bytes:
+        return value
+    else:
+        raise TypeError(f'Value type not str or bytes.')
+
+
+class TieredCacheProxy(AbsCacheProxy):
+    """
+    LRUTier in front of a persistent backend. Writes go through to the backend first, then refresh the memory tier.
+    """
+
+    def __init__(self, backend: AbsCacheProxy, tier: LRUTier):
+        self.backend = backend
+        self.tier = tier
+        self.backend_hits = 0
+        self.backend_misses = 0
 
     def set(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
-        self.redis_conn.set(name, value, ex=ex)
+        value = encode_value(value)
+        self.tier.invalidate(name, lib)
+        self.backend.set(name, value, ex=ex, lib=lib)
+        self.tier.put(name, value, int(time.time()) + ex if ex else None, lib)
+
+    def add(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG) -> bool:
+        # The backend decides, the memory tier may not see values written by other processes.
+        self.tier.invalidate(name, lib)
+        return self.backend.add(name, value, ex=ex, lib=lib)
 
     def get(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> bytes | None:
-        return self.redis_conn.get(name)
+        return self.get_with_expire_at(name, lib=lib)[0]
+
+    def get_with_expire_at(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> tuple[bytes | None, int | None]:
+        value, expire_at = self.tier.get(name, lib)
+        if value is not None:
+            return value, expire_at
+        generation = self.tier.generation
+        value, expire_at = self.backend.get_with_expire_at(name, lib=lib)
+        if value is None:
+            self.backend_misses += 1
+        else:
+            self.backend_hits += 1
+            self.tier.fill(name, value, expire_at, lib, generation)
+        return value, expire_at
+
+    def set_many(self, mapping: dict[str, str | bytes], ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        encoded = {name: encode_value(value) for name, value in mapping.items()}
+        for name in encoded:
+            self.tier.invalidate(name, lib)
+        self.backend.set_many(encoded, ex=ex, lib=lib)
+        expire_at = int(time.time()) + ex if ex else None
+        for name, value in encoded.items():
+            self.tier.put(name, value, expire_at, lib)
+
+    def get_many_with_expire_at(self, names: list[str], lib: CacheLib = CacheLib.CONFIG) -> list[tuple[bytes | None, int | None]]:
+        ret = [self.tier.get(name, lib) for name in names]
+        missing = [i for i, (value, _) in enumerate(ret) if value is None]
+        if not missing:
+            return ret
+        generation = self.tier.generation
+        fetched = self.backend.get_many_with_expire_at([names[i] for i in missing], lib=lib)
+        for i, (value, expire_at) in zip(missing, fetched):
+            ret[i] = value, expire_at
+            if value is None:
+                self.backend_misses += 1
+            else:
+                self.backend_hits += 1
+                self.tier.fill(names[i], value, expire_at, lib, generation)
+        return ret
+
+    def delete(self, names: list[str], lib: CacheLib = CacheLib.CONFIG):
+        for name in names:
+            self.tier.invalidate(name, lib)
+        self.backend.delete(names, lib=lib)
+
+    def delete_prefix(self, prefix: str, lib: CacheLib = CacheLib.CONFIG) -> int:
+        check_prefix(prefix)
+        self.tier.invalidate_prefix(prefix, lib)
+        return self.backend.delete_prefix(prefix, lib=lib)
 
     def list_all(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str]]:
-        return [(k, self.redis_conn.get(k).decode()) for k in self.redis_conn.keys()]  # maybe have better command ?
+        return self.backend.list_all(lib=lib)
 
     def list_all_2(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str, str, str]]:
-        return [(k, self.redis_conn.get(k).decode(), self.int_to_str(None), self.int_to_str(None)) for k in self.redis_conn.keys()]  # maybe have better command ?
+        return self.backend.list_all_2(lib=lib)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            'memory': self.tier.stats(),
+            'backend': {'hits': self.backend_hits, 'misses': self.backend_misses},
+        }
+
+
+class AbsAsyncCacheProxy(ABC):
+
+    @abstractmethod
+    async def set(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> bytes | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_with_expire_at(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> tuple[bytes | None, int | None]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_many(self, mapping: dict[str, str | bytes], ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_many_with_expire_at(self, names: list[str], lib: CacheLib = CacheLib.CONFIG) -> list[tuple[bytes | None, int | None]]:
+        raise NotImplementedError
+
+    async def get_many(self, names: list[str], lib: CacheLib = CacheLib.CONFIG) -> list[bytes | None]:
+        return [value for value, _ in await self.get_many_with_expire_at(names, lib=lib)]
+
+    @abstractmethod
+    async def delete(self, names: list[str], lib: CacheLib = CacheLib.CONFIG):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def list_all(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def list_all_2(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str, str, str]]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class AsyncMemoryCacheProxy(AbsAsyncCacheProxy):
+    """
+    Memory operations never wait on I/O, so they are called inline on the event loop.
+    """
+
+    def __init__(self, sync_proxy: MemoryCacheProxy | None = None):
+        self.sync_proxy = MemoryCacheProxy() if sync_proxy is None else sync_proxy
+
+    async def set(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        self.sync_proxy.set(name, value, ex=ex, lib=lib)
+
+    async def add(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG) -> bool:
+        return self.sync_proxy.add(name, value, ex=ex, lib=lib)
+
+    async def get(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> bytes | None:
+        return self.sync_proxy.get(name, lib=lib)
+
+    async def get_with_expire_at(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> tuple[bytes | None, int | None]:
+        return self.sync_proxy.get_with_expire_at(name, lib=lib)
+
+    async def set_many(self, mapping: dict[str, str | bytes], ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        self.sync_proxy.set_many(mapping, ex=ex, lib=lib)
+
+    async def get_many_with_expire_at(self, names: list[str], lib: CacheLib = CacheLib.CONFIG) -> list[tuple[bytes | None, int | None]]:
+        return self.sync_proxy.get_many_with_expire_at(names, lib=lib)
+
+    async def delete(self, names: list[str], lib: CacheLib = CacheLib.CONFIG):
+        self.sync_proxy.delete(names, lib=lib)
+
+    async def list_all(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str]]:
+        return self.sync_proxy.list_all(lib=lib)
+
+    async def list_all_2(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str, str, str]]:
+        return self.sync_proxy.list_all_2(lib=lib)
+
+
+class AsyncSQLiteCacheProxy(AbsAsyncCacheProxy):
+    """
+    sqlite3 has no non-blocking API, every statement runs on a dedicated thread pool sized to the
+    engine's connection pool. With WAL, readers keep going on their own connection while a commit is in progress.
+    """
+
+    def __init__(self, sync_proxy: SQLiteCacheProxy | None = None, max_workers: int = 5):
+        self.sync_proxy = SQLiteCacheProxy(pool_size=max_workers) if sync_proxy is None else sync_proxy
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='SQLiteCache')
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def set(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        await self._run(self.sync_proxy.set, name, value, ex=ex, lib=lib)
+
+    async def add(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG) -> bool:
+        return await self._run(self.sync_proxy.add, name, value, ex=ex, lib=lib)
+
+    async def get(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> bytes | None:
+        return await self._run(self.sync_proxy.get, name, lib=lib)
+
+    async def get_with_expire_at(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> tuple[bytes | None, int | None]:
+        return await self._run(self.sync_proxy.get_with_expire_at, name, lib=lib)
+
+    async def set_many(self, mapping: dict[str, str | bytes], ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        await self._run(self.sync_proxy.set_many, mapping, ex=ex, lib=lib)
+
+    async def get_many_with_expire_at(self, names: list[str], lib: CacheLib = CacheLib.CONFIG) -> list[tuple[bytes | None, int | None]]:
+        return await self._run(self.sync_proxy.get_many_with_expire_at, names, lib=lib)
+
+    async def delete(self, names: list[str], lib: CacheLib = CacheLib.CONFIG):
+        await self._run(self.sync_proxy.delete, names, lib=lib)
+
+    async def list_all(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str]]:
+        return await self._run(self.sync_proxy.list_all, lib=lib)
+
+    async def list_all_2(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str, str, str]]:
+        return await self._run(self.sync_proxy.list_all_2, lib=lib)
+
+    async def close(self):
+        self.executor.shutdown(wait=True)
+        self.sync_proxy.close()
+
+
+class AsyncRedisCacheProxy(AbsAsyncCacheProxy):
+    """
+    Async twin of RedisCacheProxy, same key layout.
+    """
+
+    SCAN_BATCH_SIZE = RedisCacheProxy.SCAN_BATCH_SIZE
+
+    def __init__(self, pool: aioredis.ConnectionPool | None = None):
+        if pool is None:
+            pool = aioredis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, max_connections=REDIS_MAX_CONNECTIONS)
+        self.redis_conn = aioredis.Redis(connection_pool=pool)
+
+    async def set(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        await self.redis_conn.set(redis_key(name, lib), value, ex=ex)
+
+    async def set_many(self, mapping: dict[str, str | bytes], ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        pipe = self.redis_conn.pipeline(transaction=True)
+        for name, value in mapping.items():
+            pipe.set(redis_key(name, lib), value, ex=ex)
+        await pipe.execute()
+
+    async def add(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG) -> bool:
+        return bool(await self.redis_conn.set(redis_key(name, lib), value, ex=ex, nx=True))
+
+    async def get(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> bytes | None:
+        return await self.redis_conn.get(redis_key(name, lib))
+
+    async def get_with_expire_at(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> tuple[bytes | None, int | None]:
+        key = redis_key(name, lib)
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.ttl(key)
+        value, ttl = await pipe.execute()
+        return value, int(time.time()) + ttl if value is not None and ttl >= 0 else None
+
+    async def get_many_with_expire_at(self, names: list[str], lib: CacheLib = CacheLib.CONFIG) -> list[tuple[bytes | None, int | None]]:
+        if not names:
+            return []
+        keys = [redis_key(name, lib) for name in names]
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.mget(keys)
+        for key in keys:
+            pipe.ttl(key)
+        values, *ttls = await pipe.execute()
+        now = int(time.time())
+        return [(v, now + ttl if v is not None and ttl >= 0 else None) for v, ttl in zip(values, ttls)]
+
+    async def delete(self, names: list[str], lib: CacheLib = CacheLib.CONFIG):
+        if names:
+            await self.redis_conn.delete(*[redis_key(name, lib) for name in names])
+
+    async def _scan(self, lib: CacheLib, with_ttl: bool) -> list[tuple[str, bytes, int | None]]:
+        prefix_len = len(redis_key('', lib))
+        now = int(time.time())
+        ret = []
+        batch: list[bytes] = []
+
+        async def flush():
+            pipe = self.redis_conn.pipeline(transaction=False)
+            pipe.mget(batch)
+            if with_ttl:
+                for k in batch:
+                    pipe.ttl(k)
+            values, *ttls = await pipe.execute()
+            for i, (k, v) in enumerate(zip(batch, values)):
+                if v is None:
+                    continue
+                ttl = ttls[i] if with_ttl else -1
+                ret.append((k[prefix_len:].decode(), v, now + ttl if ttl >= 0 else None))
+            batch.clear()
+
+        async for key in self.redis_conn.scan_iter(match=redis_pattern(lib), count=self.SCAN_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= self.SCAN_BATCH_SIZE:
+                await flush()
+        if batch:
+            await flush()
+        return ret
+
+    async def list_all(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str]]:
+        return [(k, v.decode()) for k, v, _ in await self._scan(lib, with_ttl=False)]
+
+    async def list_all_2(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str, str, str]]:
+        return [
+            (k, v.decode(), AbsCacheProxy.int_to_str(None), AbsCacheProxy.int_to_str(et))
+            for k, v, et in await self._scan(lib, with_ttl=True)
+        ]
+
+    async def close(self):
+        await self.redis_conn.aclose()
+        await self.redis_conn.connection_pool.disconnect()
+
+
+class AsyncTieredCacheProxy(AbsAsyncCacheProxy):
+    """
+    Async twin of TieredCacheProxy. Pass the same LRUTier to both so a write through either one invalidates the other.
+    """
+
+    def __init__(self, backend: AbsAsyncCacheProxy, tier: LRUTier):
+        self.backend = backend
+        self.tier = tier
+        self.backend_hits = 0
+        self.backend_misses = 0
+
+    async def set(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        value = encode_value(value)
+        self.tier.invalidate(name, lib)
+        await self.backend.set(name, value, ex=ex, lib=lib)
+        self.tier.put(name, value, int(time.time()) + ex if ex else None, lib)
+
+    async def add(self, name: str, value: str | bytes, ex: int | None = None, lib: CacheLib = CacheLib.CONFIG) -> bool:
+        self.tier.invalidate(name, lib)
+        return await self.backend.add(name, value, ex=ex, lib=lib)
+
+    async def get(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> bytes | None:
+        return (await self.get_with_expire_at(name, lib=lib))[0]
+
+    async def get_with_expire_at(self, name: str, lib: CacheLib = CacheLib.CONFIG) -> tuple[bytes | None, int | None]:
+        value, expire_at = self.tier.get(name, lib)
+        if value is not None:
+            return value, expire_at
+        generation = self.tier.generation
+        value, expire_at = await self.backend.get_with_expire_at(name, lib=lib)
+        if value is None:
+            self.backend_misses += 1
+        else:
+            self.backend_hits += 1
+            self.tier.fill(name, value, expire_at, lib, generation)
+        return value, expire_at
+
+    async def set_many(self, mapping: dict[str, str | bytes], ex: int | None = None, lib: CacheLib = CacheLib.CONFIG):
+        encoded = {name: encode_value(value) for name, value in mapping.items()}
+        for name in encoded:
+            self.tier.invalidate(name, lib)
+        await self.backend.set_many(encoded, ex=ex, lib=lib)
+        expire_at = int(time.time()) + ex if ex else None
+        for name, value in encoded.items():
+            self.tier.put(name, value, expire_at, lib)
+
+    async def get_many_with_expire_at(self, names: list[str], lib: CacheLib = CacheLib.CONFIG) -> list[tuple[bytes | None, int | None]]:
+        ret = [self.tier.get(name, lib) for name in names]
+        missing = [i for i, (value, _) in enumerate(ret) if value is None]
+        if not missing:
+            return ret
+        generation = self.tier.generation
+        fetched = await self.backend.get_many_with_expire_at([names[i] for i in missing], lib=lib)
+        for i, (value, expire_at) in zip(missing, fetched):
+            ret[i] = value, expire_at
+            if value is None:
+                self.backend_misses += 1
+            else:
+                self.backend_hits += 1
+                self.tier.fill(names[i], value, expire_at, lib, generation)
+        return ret
+
+    async def delete(self, names: list[str], lib: CacheLib = CacheLib.CONFIG):
+        for name in names:
+            self.tier.invalidate(name, lib)
+        await self.backend.delete(names, lib=lib)
+
+    async def list_all(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str]]:
+        return await self.backend.list_all(lib=lib)
+
+    async def list_all_2(self, lib: CacheLib = CacheLib.CONFIG) -> list[tuple[str, str, str, str]]:
+        return await self.backend.list_all_2(lib=lib)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            'memory': self.tier.stats(),
+            'backend': {'hits': self.backend_hits, 'misses': self.backend_misses},
+        }
+
+    async def close(self):
+        await self.backend.close()
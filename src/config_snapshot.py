@@ -0,0 +1,52 @@
+import time
+
+from cache_proxy import AbsAsyncCacheProxy, CacheLib
+
+
+CONFIG_VERSION_KEY = '[ConfigVersion]'
+
+
+def versioned(mapping: dict[str, str | bytes]) -> dict[str, str | bytes]:
+    """
+    Add a new config version to a set_many mapping, so every ConfigSnapshot reloads after the write.
+    """
+    return {**mapping, CONFIG_VERSION_KEY: str(time.time_ns())}
+
+
+class ConfigSnapshot:
+    """
+    In-memory copy of a fixed group of config keys.
+
+    Within check_interval seconds of the last check the copy is returned without touching the cache,
+    after that only the version key is read, and the values are reloaded (together with the version,
+    in one get_many) when it has changed. Writers must go through set_many(versioned(...)) so the
+    values and the version change atomically.
+    """
+
+    _UNLOADED = object()
+
+    def __init__(self, cache_proxy: AbsAsyncCacheProxy, names: tuple[str, ...], check_interval: float = 1.0):
+        self.cache_proxy = cache_proxy
+        self.names = names
+        self.check_interval = check_interval
+        self.version: bytes | None | object = self._UNLOADED
+        self.values: dict[str, bytes | None] = dict()
+        self.checked_at = 0.0
+
+    async def get(self) -> dict[str, bytes | None]:
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return self.values
+        if self.version is not self._UNLOADED:
+            version = await self.cache_proxy.get(CONFIG_VERSION_KEY, lib=CacheLib.CONFIG)
+            if version == self.version:
+                self.checked_at = now
+                return self.values
+        version, *values = await self.cache_proxy.get_many([CONFIG_VERSION_KEY, *self.names], lib=CacheLib.CONFIG)
+        self.values = dict(zip(self.names, values))
+        self.version = version
+        self.checked_at = now
+        return self.values
+
+    def invalidate(self):
+        self.checked_at = 0.0
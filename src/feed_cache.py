@@ -0,0 +1,416 @@
+import json
+import time
+import zlib
+import asyncio
+import hashlib
+from collections import deque
+from logging import Logger
+from email.utils import formatdate, parsedate_to_datetime
+from dataclasses import dataclass, asdict
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Iterator
+
+import brotli
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
+
+from cache_proxy import AbsAsyncCacheProxy, CacheLib
+from single_flight import SingleFlight
+
+
+# Preferred first when the client accepts several with the same q-value. Every one is stored.
+ENCODINGS = ('br', 'gzip', 'identity')
+
+
+# Builds a feed, returns the document piece by piece (rendered lazily), or None when upstream failed.
+FeedGenerator = Callable[[], Awaitable[Iterable[str] | None]]
+
+
+class FeedEncoder:
+    """
+    Hashes a feed body and compresses it into every representation in one pass over its pieces,
+    the rendered document never exists as a whole.
+    zlib writes a zero gzip mtime, so identical bodies compress to identical bytes.
+    """
+
+    def __init__(self):
+        self.sha = hashlib.sha256()
+        self.gzip = zlib.compressobj(9, zlib.DEFLATED, 31)
+        # quality 11 is ~50x slower for ~5% less output on multi-MB novel feeds
+        self.br = brotli.Compressor(quality=9)
+        self.parts: dict[str, list[bytes]] = {encoding: [] for encoding in ENCODINGS}
+
+    def encode(self, chunks: Iterable[str], encoding: str = 'identity') -> Iterator[bytes]:
+        """
+        Feed every chunk through, yields the output of `encoding` as it comes out.
+        """
+        for chunk in chunks:
+            raw = chunk.encode('utf-8')
+            self.sha.update(raw)
+            yield from self._collect({'identity': raw, 'gzip': self.gzip.compress(raw), 'br': self.br.process(raw)}, encoding)
+        yield from self._collect({'identity': b'', 'gzip': self.gzip.flush(), 'br': self.br.finish()}, encoding)
+
+    def _collect(self, pieces: dict[str, bytes], encoding: str) -> Iterator[bytes]:
+        for name in ENCODINGS:
+            if pieces[name]:
+                self.parts[name].append(pieces[name])
+        if pieces[encoding]:
+            yield pieces[encoding]
+
+    def consume(self, chunks: Iterable[str]):
+        deque(self.encode(chunks), maxlen=0)
+
+    @property
+    def version(self) -> str:
+        return self.sha.hexdigest()[:32]
+
+    def bodies(self) -> dict[str, bytes]:
+        return {encoding: b''.join(self.parts.pop(encoding)) for encoding in ENCODINGS}
+
+
+class FeedStream:
+    """
+    A feed being generated on a miss, handed from the refresh to the response that streams it to the
+    client in one content-coding while the refresh stores every representation.
+    The client is never waited for: when it reads slower than the feed renders the pieces queue up,
+    when it goes away they are dropped.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self.started: asyncio.Future[bool] = asyncio.get_running_loop().create_future()  # whether upstream answered
+        self.queue: asyncio.Queue[bytes | None] = asyncio.Queue()
+        self.error: BaseException | None = None
+        self.ended = False
+        self.closed = False
+
+    def start(self):
+        self.started.set_result(True)
+
+    def put(self, piece: bytes):
+        if not self.closed:
+            self.queue.put_nowait(piece)
+
+    def end(self, error: BaseException | None = None):
+        if self.ended:
+            return
+        self.ended = True
+        if not self.started.done():
+            self.started.set_result(False)
+        self.error = error
+        if not self.closed:
+            self.queue.put_nowait(None)
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            while (piece := await self.queue.get()) is not None:
+                yield piece
+            if self.error is not None:
+                # Abort the response, a truncated document must not look complete.
+                raise RuntimeError('feed generation failed') from self.error
+        finally:
+            self.closed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+
+
+@dataclass
+class FeedMeta:
+    version: str  # sha256 of the identity body, the ETag of each representation derives from it
+    generated_at: int
+    fresh_until: int
+    last_modified: int  # time the body last changed, regenerating an identical body keeps it
+    encodings: dict[str, int]  # content-coding -> stored length
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.version}"' if encoding == 'identity' else f'"{self.version}-{encoding}"'
+
+
+class FeedCache:
+    """
+    Stale-while-revalidate cache for generated feeds.
+
+    A feed is fresh for soft_ttl seconds. After that the stale copy is still returned at once and a
+    refresh runs in the background, and when upstream keeps failing the last good copy is served
+    until hard_ttl expires.
+
+    Each feed is stored as a small meta record plus a body under a versioned key, the meta points to
+    the body, so a reader never pairs the meta of one generation with the body of another, and
+    validators can be checked without reading the body at all.
+    """
+
+    def __init__(self, cache_proxy: AbsAsyncCacheProxy, flight: SingleFlight, logger: Logger):
+        self.cache_proxy = cache_proxy
+        self.flight = flight
+        self.logger = logger
+        self.background: set[asyncio.Task] = set()
+
+    @staticmethod
+    def meta_key(key: str) -> str:
+        return f'[FeedMeta]{key}'
+
+    @staticmethod
+    def body_key(key: str, version: str, encoding: str) -> str:
+        return f'[FeedBody]{key}@{version}/{encoding}'
+
+    async def get_meta(self, key: str) -> FeedMeta | None:
+        raw = await self.cache_proxy.get(self.meta_key(key), lib=CacheLib.RUNTIME)
+        if not raw:
+            return None
+        try:
+            return FeedMeta(**json.loads(raw))
+        except (TypeError, ValueError):  # written by an older layout
+            return None
+
+    async def get_body(self, key: str, meta: FeedMeta, encoding: str = 'identity') -> bytes | None:
+        return await self.cache_proxy.get(self.body_key(key, meta.version, encoding), lib=CacheLib.RUNTIME)
+
+    async def store(
+            self,
+            key: str,
+            chunks: Iterable[str],
+            soft_ttl: int,
+            hard_ttl: int,
+            stream: FeedStream | None = None,
+    ) -> tuple[FeedMeta, dict[str, bytes]]:
+        """
+        Encode the pieces of a feed and store every representation, passing the pieces of the stream's
+        content-coding on as they come out. Rendering and compressing run in worker threads.
+        """
+        encoder = FeedEncoder()
+        if stream is None:
+            await run_in_threadpool(encoder.consume, chunks)
+        else:
+            async for piece in iterate_in_threadpool(encoder.encode(chunks, stream.encoding)):
+                stream.put(piece)
+        now = int(time.time())
+        version = encoder.version
+        bodies = encoder.bodies()
+        previous = await self.get_meta(key)
+        last_modified = previous.last_modified if previous is not None and previous.version == version else now
+        meta = FeedMeta(
+            version=version,
+            generated_at=now,
+            fresh_until=now + soft_ttl,
+            last_modified=last_modified,
+            encodings={k: len(v) for k, v in bodies.items()}
+        )
+        # Bodies first, a meta record must never point to a body that isn't there yet.
+        for encoding, encoded in bodies.items():
+            await self.cache_proxy.set(self.body_key(key, version, encoding), encoded, ex=hard_ttl, lib=CacheLib.RUNTIME)
+        await self.cache_proxy.set(self.meta_key(key), json.dumps(asdict(meta)), ex=hard_ttl, lib=CacheLib.RUNTIME)
+        if previous is not None and previous.version != version:
+            # Nothing points to the previous bodies anymore, don't let them hold memory until hard_ttl.
+            await self.cache_proxy.delete(
+                [self.body_key(key, previous.version, encoding) for encoding in previous.encodings],
+                lib=CacheLib.RUNTIME
+            )
+        if stream is not None:
+            # Ended once stored, a client that got the whole feed finds it cached on its next request.
+            stream.end()
+        return meta, bodies
+
+    async def serve(
+            self,
+            key: str,
+            generate: FeedGenerator,
+            soft_ttl: int,
+            hard_ttl: int,
+            stream_encoding: str | None = None,
+    ) -> tuple[FeedMeta, dict[str, bytes]] | FeedStream | None:
+        """
+        :param generate: builds the feed, returns None when upstream failed
+        :param stream_encoding: on a miss, stream the feed in this content-coding while it is generated
+                                instead of waiting until it is stored
+        :return: meta and, when it had to be generated, the encoded bodies (otherwise empty, load the
+                 one needed with get_body); a FeedStream when it is being streamed; None when there is
+                 neither a cached copy nor a freshly generated one
+        """
+        meta = await self.get_meta(key)
+        if meta is not None:
+            if int(time.time()) >= meta.fresh_until:
+                self.logger.debug(f'Serve stale feed and revalidate in background, key: {key}')
+                self.revalidate(key, generate, soft_ttl, hard_ttl)
+            return meta, {}
+
+        if stream_encoding is not None:
+            return await self.stream(key, generate, soft_ttl, hard_ttl, stream_encoding)
+        return await self.refresh(key, generate, soft_ttl, hard_ttl)
+
+    async def refresh(
+            self,
+            key: str,
+            generate: FeedGenerator,
+            soft_ttl: int,
+            hard_ttl: int,
+    ) -> tuple[FeedMeta, dict[str, bytes]] | None:
+        """
+        Generate and store the feed now, joining a refresh of the same key already in flight.
+        """
+        return await self.flight.do(
+            key,
+            lambda: self._refresh(key, generate, soft_ttl, hard_ttl),
+            recheck=lambda: self._fresh(key)
+        )
+
+    async def stream(
+            self,
+            key: str,
+            generate: FeedGenerator,
+            soft_ttl: int,
+            hard_ttl: int,
+            encoding: str,
+    ) -> tuple[FeedMeta, dict[str, bytes]] | FeedStream | None:
+        """
+        Like refresh(), but when this call leads the refresh and upstream answers, returns as soon as
+        rendering starts with the stream of the feed. Callers joining it wait for the stored copy.
+        """
+        stream = FeedStream(encoding)
+        task, leader = self.flight.start(
+            key,
+            lambda: self._refresh(key, generate, soft_ttl, hard_ttl, stream),
+            recheck=lambda: self._fresh(key)
+        )
+        if leader:
+            await asyncio.wait([stream.started, task], return_when=asyncio.FIRST_COMPLETED)
+            if stream.started.done() and stream.started.result():
+                return stream
+        return await asyncio.shield(task)
+
+    def revalidate(self, key: str, generate: FeedGenerator, soft_ttl: int, hard_ttl: int):
+        if key in self.flight.calls:
+            return
+        task = asyncio.create_task(self.refresh(key, generate, soft_ttl, hard_ttl))
+        self.background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task):
+        self.background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.warning(f'Background feed refresh failed: {task.exception()!r}')
+
+    async def _refresh(
+            self,
+            key: str,
+            generate: FeedGenerator,
+            soft_ttl: int,
+            hard_ttl: int,
+            stream: FeedStream | None = None,
+    ) -> tuple[FeedMeta, dict[str, bytes]] | None:
+        try:
+            chunks = await generate()
+            if chunks is None:
+                self.logger.warning(f'Generate feed failed, keep serving last good copy if any, key: {key}')
+                if stream is not None:
+                    stream.end()
+                return None
+            if stream is not None:
+                stream.start()
+            return await self.store(key, chunks, soft_ttl, hard_ttl, stream)
+        except BaseException as e:
+            if stream is not None:
+                stream.end(e)
+            raise
+
+    async def _fresh(self, key: str) -> tuple[FeedMeta, dict[str, bytes]] | None:
+        meta = await self.get_meta(key)
+        if meta is None or int(time.time()) >= meta.fresh_until:
+            return None
+        return meta, {}
+
+
+def choose_encoding(accept_encoding: str | None, available: dict[str, int]) -> str:
+    if not accept_encoding:
+        return 'identity'
+    q_values: dict[str, float] = dict()
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        q_values[name.strip().lower()] = q
+    best, best_q = 'identity', 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        q = q_values.get(encoding, q_values.get('*', 1.0 if encoding == 'identity' else 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def not_modified(request: Request, meta: FeedMeta) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        # If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2), and uses weak comparison.
+        # Every representation carries the same content, so a tag of any of them matches.
+        tags = [e.strip().removeprefix('W/') for e in if_none_match.split(',')]
+        return '*' in tags or any(meta.etag(encoding) in tags for encoding in meta.encodings)
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            return meta.last_modified <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def feed_response(
+        request: Request,
+        feed_cache: FeedCache,
+        key: str,
+        generate: FeedGenerator,
+        soft_ttl: int,
+        hard_ttl: int,
+        media_type: str = 'application/xml',
+) -> Response:
+    """
+    Serve a cached feed with ETag / Last-Modified, in the best content-coding the client accepts.
+    Conditional requests that match and HEAD requests are answered from the meta record, without reading
+    the body, and bodies are sent exactly as stored.
+    A GET that misses the cache gets the feed streamed while it is generated, without validators,
+    they only exist once the whole body has been hashed.
+    """
+    stream_encoding = None
+    if request.method == 'GET':
+        stream_encoding = choose_encoding(request.headers.get('accept-encoding'), dict.fromkeys(ENCODINGS, 0))
+    served = await feed_cache.serve(key, generate, soft_ttl, hard_ttl, stream_encoding)
+    if served is None:
+        return Response(status_code=500)
+    if isinstance(served, FeedStream):
+        headers = {'Vary': 'Accept-Encoding'}
+        if served.encoding != 'identity':
+            headers['Content-Encoding'] = served.encoding
+        return StreamingResponse(served, headers=headers, media_type=media_type)
+    meta, bodies = served
+
+    encoding = choose_encoding(request.headers.get('accept-encoding'), meta.encodings)
+    headers = {
+        'ETag': meta.etag(encoding),
+        'Last-Modified': formatdate(meta.last_modified, usegmt=True),
+        'Vary': 'Accept-Encoding',
+    }
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    if not_modified(request, meta):
+        headers.pop('Content-Encoding', None)
+        return Response(status_code=304, headers=headers)
+    if request.method == 'HEAD':
+        headers['Content-Length'] = str(meta.encodings[encoding])
+        return Response(headers=headers, media_type=media_type)
+
+    body = bodies.get(encoding)
+    if body is None:
+        body = await feed_cache.get_body(key, meta, encoding)
+        if body is None:
+            current = await feed_cache.get_meta(key)
+            if current is None or current.version == meta.version:
+                # The meta outlived its body (evicted from a memory backend), fall back to a regular miss.
+                await feed_cache.cache_proxy.set(feed_cache.meta_key(key), b'', ex=1, lib=CacheLib.RUNTIME)
+            # Otherwise a newer generation replaced it, and its bodies, while this request read the meta.
+            return await feed_response(request, feed_cache, key, generate, soft_ttl, hard_ttl, media_type)
+    return Response(content=body, headers=headers, media_type=media_type)
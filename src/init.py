@@ -1,6 +1,7 @@
 import re
+import asyncio
 import secrets
-from typing import Annotated
+from typing import Annotated, Literal
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, APIRouter, Depends, HTTPException, status
@@ -12,17 +13,75 @@ from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from my_log import logging, get_or_create_logger
-from cache_proxy import AbsCacheProxy, SQLiteCacheProxy
+from blob_store import BlobStore
+from single_flight import SingleFlight
+from rate_limiter import RateLimiter
+from resilience import CircuitBreaker
+from feed_cache import FeedCache
+from prefetch import Prefetcher
+from cache_proxy import (
+    AbsCacheProxy, AbsAsyncCacheProxy,
+    MemoryCacheProxy, AsyncMemoryCacheProxy,
+    SQLiteCacheProxy, AsyncSQLiteCacheProxy,
+    RedisCacheProxy, AsyncRedisCacheProxy,
+    LRUTier, TieredCacheProxy, AsyncTieredCacheProxy,
+)
 
 
 class EnvSetting(EnvSettingModel):
     auth_user: str | None = Field(None, pattern=r'[a-zA-Z0-9]{1,50}')
     auth_pwd: str | None = Field(None, pattern=r'[a-zA-Z0-9!@#$%^&*()-_]{1,50}')
+    memory_cache_mb: int = Field(32, ge=0)
+    cache_backend: Literal['sqlite', 'memory', 'redis'] = Field('sqlite')
+    memory_backend_config_mb: int = Field(16, ge=1)
+    memory_backend_runtime_mb: int = Field(64, ge=1)
+    blob_store_mb: int = Field(512, ge=1)
+    single_flight_cross_process: bool = Field(False)
+    upstream_http2: bool = Field(True)
+    upstream_max_connections: int = Field(32, ge=1)
+    prefetch_enabled: bool = Field(True)
+    prefetch_idle_days: int = Field(3, ge=1)
+    bilibili_rate_per_s: float = Field(2.0, gt=0)
+    bilibili_max_concurrency: int = Field(4, ge=1)
+    bilibili_history_depth: int = Field(50, ge=1)
+    bilibili_dynamic_groups: dict[str, list[int]] = Field(default_factory=dict)
+    bilibili_merge_max_users: int = Field(50, ge=1)
+    bilibili_merge_concurrency: int = Field(4, ge=1)
+    pixiv_rate_per_s: float = Field(1.0, gt=0)
+    pixiv_max_concurrency: int = Field(2, ge=1)
+
+
+def create_cache_backend(setting: EnvSetting) -> tuple[AbsCacheProxy, AbsAsyncCacheProxy]:
+    if setting.cache_backend == 'memory':
+        memory_backend = MemoryCacheProxy(
+            config_max_bytes=setting.memory_backend_config_mb * 1024 * 1024,
+            runtime_max_bytes=setting.memory_backend_runtime_mb * 1024 * 1024,
+        )
+        return memory_backend, AsyncMemoryCacheProxy(memory_backend)
+    elif setting.cache_backend == 'redis':
+        return RedisCacheProxy(), AsyncRedisCacheProxy()
+    else:
+        sqlite_backend = SQLiteCacheProxy()
+        return sqlite_backend, AsyncSQLiteCacheProxy(sqlite_backend)
 
 
 UserEnvSetting = EnvSetting()
-_CacheProxy: AbsCacheProxy = SQLiteCacheProxy()
+_CacheBackend, _AsyncCacheBackend = create_cache_backend(UserEnvSetting)
+_CacheTier = LRUTier(max_bytes=UserEnvSetting.memory_cache_mb * 1024 * 1024)
+_CacheProxy: TieredCacheProxy = TieredCacheProxy(_CacheBackend, _CacheTier)
+_AsyncCacheProxy: AsyncTieredCacheProxy = AsyncTieredCacheProxy(_AsyncCacheBackend, _CacheTier)
+_SingleFlight = SingleFlight(_AsyncCacheProxy if UserEnvSetting.single_flight_cross_process else None)
+_RateLimiter = RateLimiter()
+_CircuitBreakers: dict[str, CircuitBreaker] = dict()
+_BlobStore = BlobStore(max_bytes=UserEnvSetting.blob_store_mb * 1024 * 1024)
 _Logger = get_or_create_logger('Main')
+_FeedCache = FeedCache(_AsyncCacheProxy, _SingleFlight, get_or_create_logger('Main.FeedCache'))
+_Prefetcher = Prefetcher(
+    _FeedCache,
+    _AsyncCacheProxy,
+    get_or_create_logger('Main.Prefetch'),
+    idle_s=UserEnvSetting.prefetch_idle_days * 86400
+)
 
 
 _Security = HTTPBasic()
@@ -57,12 +116,8 @@ def verify_user(
 
 
 def job_clear_expired_cache():
-    # todo: This is not a standardized practice, it's not good.
-    local_cache_proxy = SQLiteCacheProxy()
-    try:
-        local_cache_proxy.clear_expired_data()
-    finally:
-        local_cache_proxy.close()
+    removed, removed_bytes = _CacheBackend.clear_expired_data()
+    _Logger.info(f'Clear expired cache done, removed {removed} rows, {removed_bytes} bytes.')
 
 
 @asynccontextmanager
@@ -70,8 +125,14 @@ async def lifespan(_app: FastAPI):
     scheduler = BackgroundScheduler()
     scheduler.add_job(job_clear_expired_cache, IntervalTrigger(minutes=10), id="job_clear_expired_cache", name="job_clear_expired_cache")
     scheduler.start()
+    prefetch_task = asyncio.create_task(_Prefetcher.run()) if UserEnvSetting.prefetch_enabled else None
     yield
     scheduler.pause()
+    if prefetch_task is not None:
+        prefetch_task.cancel()
+        await _Prefetcher.close()
+    await _AsyncCacheProxy.close()
+    _BlobStore.close()
 
 
 if _AuthUser is not None:
@@ -112,10 +173,60 @@ def register_all():
         _App.include_router(router)
 
 
+def get_env_setting() -> EnvSetting:
+    return UserEnvSetting
+
+
 def get_cache_proxy() -> AbsCacheProxy:
     return _CacheProxy
 
 
+def get_async_cache_proxy() -> AbsAsyncCacheProxy:
+    return _AsyncCacheProxy
+
+
+def get_single_flight() -> SingleFlight:
+    return _SingleFlight
+
+
+def get_feed_cache() -> FeedCache:
+    return _FeedCache
+
+
+def get_rate_limiter() -> RateLimiter:
+    return _RateLimiter
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    if name not in _CircuitBreakers:
+        _CircuitBreakers[name] = CircuitBreaker(name)
+    return _CircuitBreakers[name]
+
+
+def get_upstream_stats() -> dict[str, dict[str, dict]]:
+    return {
+        'rate_limit': _RateLimiter.stats(),
+        'circuit': {name: breaker.stats() for name, breaker in _CircuitBreakers.items()},
+    }
+
+
+def get_prefetcher() -> Prefetcher:
+    return _Prefetcher
+
+
+def get_blob_store() -> BlobStore:
+    return _BlobStore
+
+
+def get_cache_stats() -> dict[str, dict[str, int]]:
+    sync_stats, async_stats = _CacheProxy.stats(), _AsyncCacheProxy.stats()
+    return {
+        'memory': async_stats['memory'],
+        'backend': {k: sync_stats['backend'][k] + async_stats['backend'][k] for k in ('hits', 'misses')},
+        'prefetch': _Prefetcher.stats(),
+    }
+
+
 def get_logger(module_name: str, root: bool = False) -> logging.Logger:
     if root:
         return _Logger
@@ -1,7 +1,9 @@
 import os
 import importlib
 from cache_proxy import CacheLib
-from init import get_app, register_all, get_logger, get_cache_proxy
+from config_snapshot import versioned
+from init import get_app, register_all, get_logger, get_async_cache_proxy, get_cache_stats, get_upstream_stats
+from routes.bilibili.convert_api.dynamic import Extractors
 
 from pydantic import BaseModel
 from fastapi.responses import HTMLResponse
@@ -89,7 +91,7 @@ Manager api
 
 @app.get("/api/setting/cookie/list")
 async def kv_list():
-    data = get_cache_proxy().list_all(lib=CacheLib.CONFIG)
+    data = await get_async_cache_proxy().list_all(lib=CacheLib.CONFIG)
     return {
         "status": 0,
         "msg": "",
@@ -99,7 +101,7 @@ async def kv_list():
 
 @app.get("/api/setting/cookie/list2")
 async def kv_list_2():
-    data = get_cache_proxy().list_all_2(lib=CacheLib.CONFIG)
+    data = await get_async_cache_proxy().list_all_2(lib=CacheLib.CONFIG)
     items = []
     for k, v, ut, et in data:
         items.append({
@@ -122,5 +124,20 @@ class KvUpdate(BaseModel):
 
 @app.post("/api/setting/cookie/update")
 async def kv_update(body: KvUpdate):
-    get_cache_proxy().set(body.key, body.value)
+    await get_async_cache_proxy().set_many(versioned({body.key: body.value}))
     return {"status": 0, "msg": ""}
+
+
+@app.get("/api/setting/cache/stats")
+async def cache_stats():
+    return {"status": 0, "msg": "", "data": get_cache_stats()}
+
+
+@app.get("/api/setting/upstream/stats")
+async def upstream_stats():
+    return {"status": 0, "msg": "", "data": get_upstream_stats()}
+
+
+@app.get("/api/setting/extractor/stats")
+async def extractor_stats():
+    return {"status": 0, "msg": "", "data": Extractors.stats()}
@@ -0,0 +1,175 @@
+import json
+import time
+import zlib
+import asyncio
+from logging import Logger
+from dataclasses import dataclass, asdict
+from typing import Awaitable, Callable, Iterable
+
+from cache_proxy import AbsAsyncCacheProxy, CacheLib
+from feed_cache import FeedCache
+
+
+@dataclass(frozen=True)
+class FeedSource:
+    name: str
+    key: Callable[[str], str]  # arg -> feed cache key
+    generate: Callable[[str], Awaitable[Iterable[str] | None]]  # arg -> feed body
+    soft_ttl: int
+    hard_ttl: int
+
+    @property
+    def lead_s(self) -> int:
+        # How long before the feed turns stale the prefetch runs.
+        return max(1, min(60, self.soft_ttl // 5))
+
+
+@dataclass
+class Subscription:
+    source: str
+    arg: str
+    last_polled: float
+    next_refresh: float = 0.0
+
+
+class Prefetcher:
+    """
+    Keeps the feeds readers poll fresh, so they are served from cache instead of waiting on upstream.
+
+    Route handlers touch() the feed they serve, which registers it as a subscription. A background loop
+    regenerates each subscribed feed shortly before it turns stale, at most `concurrency` at a time and
+    through the same rate limited clients as reader requests. Subscriptions nobody polled within idle_s
+    are dropped. The registry is saved to the cache backend so a restart keeps it, refreshes after a
+    restart are spread over the TTL window instead of all running at once.
+    """
+
+    STATE_KEY = '[Prefetch]subscriptions'
+    SAVE_INTERVAL_S = 60
+
+    def __init__(
+            self,
+            feed_cache: FeedCache,
+            cache_proxy: AbsAsyncCacheProxy,
+            logger: Logger,
+            idle_s: int = 3 * 86400,
+            concurrency: int = 2,
+            tick_s: float = 5,
+    ):
+        self.feed_cache = feed_cache
+        self.cache_proxy = cache_proxy
+        self.logger = logger
+        self.idle_s = idle_s
+        self.concurrency = concurrency
+        self.tick_s = tick_s
+        self.sources: dict[str, FeedSource] = dict()
+        self.subscriptions: dict[str, Subscription] = dict()
+        self.running: dict[str, asyncio.Task] = dict()
+        self.slots = asyncio.Semaphore(concurrency)
+        self.dirty = False
+        self.saved_at = 0.0
+        self.refreshed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def register_source(self, source: FeedSource):
+        self.sources[source.name] = source
+
+    def touch(self, source_name: str, arg: str | int):
+        arg = str(arg)
+        key = self.sources[source_name].key(arg)
+        subscription = self.subscriptions.get(key)
+        if subscription is None:
+            # Due at once: the first check only reads the meta and schedules the real refresh.
+            self.subscriptions[key] = Subscription(source=source_name, arg=arg, last_polled=time.time())
+        else:
+            subscription.last_polled = time.time()
+        self.dirty = True
+
+    async def load(self):
+        raw = await self.cache_proxy.get(self.STATE_KEY, lib=CacheLib.RUNTIME)
+        if not raw:
+            return
+        now = time.time()
+        try:
+            records = [Subscription(**e) for e in json.loads(raw)]
+        except (TypeError, ValueError):
+            return
+        for subscription in records:
+            source = self.sources.get(subscription.source)
+            if source is None:
+                continue
+            key = source.key(subscription.arg)
+            # A stable spot in the TTL window per feed, restarts don't regenerate everything in one burst.
+            phase = zlib.crc32(key.encode()) % 1000 / 1000
+            subscription.next_refresh = now + phase * source.soft_ttl
+            self.subscriptions.setdefault(key, subscription)
+
+    async def save(self):
+        records = [asdict(e) for e in self.subscriptions.values()]
+        await self.cache_proxy.set(self.STATE_KEY, json.dumps(records), ex=self.idle_s, lib=CacheLib.RUNTIME)
+        self.dirty = False
+        self.saved_at = time.time()
+
+    async def tick(self):
+        now = time.time()
+        for key in [k for k, e in self.subscriptions.items() if now - e.last_polled > self.idle_s]:
+            self.logger.info(f'Drop idle feed subscription, key: {key}')
+            del self.subscriptions[key]
+            self.dirty = True
+
+        for key, subscription in self.subscriptions.items():
+            if subscription.next_refresh <= now and key not in self.running:
+                task = asyncio.create_task(self._prefetch(key, subscription))
+                self.running[key] = task
+                task.add_done_callback(lambda _, k=key: self.running.pop(k, None))
+
+        if self.dirty and now - self.saved_at >= self.SAVE_INTERVAL_S:
+            await self.save()
+
+    async def _prefetch(self, key: str, subscription: Subscription):
+        source = self.sources[subscription.source]
+        async with self.slots:
+            meta = await self.feed_cache.get_meta(key)
+            now = time.time()
+            if meta is not None and meta.fresh_until - now > source.lead_s:
+                # Regenerated by a reader or another process meanwhile.
+                self.skipped += 1
+                subscription.next_refresh = meta.fresh_until - source.lead_s
+                return
+            try:
+                served = await self.feed_cache.refresh(key, lambda: source.generate(subscription.arg), source.soft_ttl, source.hard_ttl)
+            except Exception as e:
+                self.logger.warning(f'Prefetch feed failed, key: {key}, {e!r}')
+                served = None
+        if served is None:
+            self.failed += 1
+            # Upstream trouble, try again within the window but don't spin on it.
+            subscription.next_refresh = time.time() + max(source.lead_s, source.soft_ttl // 2)
+            return
+        self.refreshed += 1
+        subscription.next_refresh = served[0].fresh_until - source.lead_s
+
+    async def run(self):
+        await self.load()
+        while True:
+            # Sleep first, the routers' lifespans open their upstream clients after this task starts.
+            await asyncio.sleep(self.tick_s)
+            try:
+                await self.tick()
+            except Exception as e:
+                self.logger.warning(f'Prefetch tick failed: {e!r}')
+
+    async def close(self):
+        for task in list(self.running.values()):
+            task.cancel()
+        if self.dirty:
+            await self.save()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'subscriptions': len(self.subscriptions),
+            'running': len(self.running),
+            'refreshed': self.refreshed,
+            'skipped': self.skipped,
+            'failed': self.failed,
+        }
@@ -0,0 +1,203 @@
+import time
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from contextlib import asynccontextmanager, contextmanager
+from threading import Lock, BoundedSemaphore
+from typing import Callable
+
+
+def default_risk_control(status_code: int, body: bytes | None) -> bool:
+    return status_code == 429
+
+
+class RateLimitExceeded(Exception):
+    """
+    Sending now would mean waiting longer than the host's max_wait_s, it is paused after a risk-control
+    answer or too many callers queue for it.
+    """
+
+
+@dataclass(frozen=True)
+class HostPolicy:
+    rate: float  # requests per second while the upstream is happy
+    burst: int = 1
+    max_concurrency: int = 4
+    min_rate: float = 0.05
+    cooldown_s: float = 30  # pause after a risk-control response, doubles while they keep coming
+    max_cooldown_s: float = 600
+    # Longer waits for a token fail at once, a request must not hang through a cooldown outside every timeout.
+    max_wait_s: float = 10
+    # (status code, body or None when it was streamed) -> whether the upstream is telling us to slow down
+    risk_control: Callable[[int, bytes | None], bool] = default_risk_control
+
+
+class HostLimit:
+    """
+    Token bucket plus concurrency cap for one host. The refill rate is halved on each risk-control
+    response and the host is paused for a cooldown, then it climbs back by a small step per success.
+    """
+
+    WINDOW_S = 60  # observed rate is averaged over this
+
+    def __init__(self, policy: HostPolicy):
+        self.policy = policy
+        self.lock = Lock()
+        self.rate = policy.rate
+        self.tokens = float(policy.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.cooldown = policy.cooldown_s
+        self.sync_slots = BoundedSemaphore(policy.max_concurrency)
+        self.async_slots: asyncio.Semaphore | None = None
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.penalties = 0
+        self.rejected = 0
+        self.recent: deque[float] = deque()
+
+    def reserve(self, max_wait_s: float | None = None) -> float:
+        """
+        Take a token, returns how long the caller has to wait before sending.
+        Raises RateLimitExceeded, without taking the token, when that is longer than max_wait_s
+        (the policy's unless given).
+        """
+        if max_wait_s is None:
+            max_wait_s = self.policy.max_wait_s
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(float(self.policy.burst), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max((1 - self.tokens) / self.rate, self.blocked_until - now, 0.0)
+            if wait > max_wait_s:
+                self.rejected += 1
+                raise RateLimitExceeded(f'would wait {wait:.1f}s for a token')
+            self.tokens -= 1
+            self.requests += 1
+            if wait > 0:
+                self.throttled += 1
+            self.recent.append(now + wait)
+            while self.recent and self.recent[0] < now - self.WINDOW_S:
+                self.recent.popleft()
+            return wait
+
+    def blocked_for(self) -> float:
+        return max(self.blocked_until - time.monotonic(), 0.0)
+
+    def wait_blocked(self, max_wait_s: float | None = None) -> float:
+        """
+        How long a caller holding a token still has to wait, a risk-control answer may have arrived while it
+        waited for the token. Gives the token back and raises RateLimitExceeded when that is longer than max_wait_s.
+        """
+        blocked = self.blocked_for()
+        if blocked > (self.policy.max_wait_s if max_wait_s is None else max_wait_s):
+            with self.lock:
+                self.tokens += 1
+                self.rejected += 1
+            raise RateLimitExceeded(f'host paused for {blocked:.1f}s')
+        return blocked
+
+    def report(self, risk_control: bool):
+        with self.lock:
+            now = time.monotonic()
+            if risk_control:
+                self.penalties += 1
+                self.rate = max(self.policy.min_rate, self.rate / 2)
+                # A token debt worth the cooldown, so new callers queue behind it at the lowered rate
+                # instead of bursting when it ends.
+                self.tokens = min(self.tokens, 0.0) - self.cooldown * self.rate
+                self.updated = now
+                self.blocked_until = now + self.cooldown
+                self.cooldown = min(self.policy.max_cooldown_s, self.cooldown * 2)
+            elif now >= self.blocked_until:
+                self.rate = min(self.policy.rate, self.rate + self.policy.rate / 20)
+                if self.rate == self.policy.rate:
+                    self.cooldown = self.policy.cooldown_s
+
+    def stats(self) -> dict[str, float | int]:
+        now = time.monotonic()
+        with self.lock:
+            observed = sum(1 for t in self.recent if now - self.WINDOW_S <= t <= now)
+            return {
+                'rate': round(self.rate, 3),
+                'max_rate': self.policy.rate,
+                'observed_rate': round(observed / self.WINDOW_S, 3),
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'penalties': self.penalties,
+                'rejected': self.rejected,
+                'blocked_for_s': round(self.blocked_for(), 1),
+            }
+
+
+class RateLimiter:
+    """
+    Per-host limits in front of upstream calls, hosts without a policy are not limited.
+
+    Async callers use `async with limiter.limit(host)`, blocking clients running in worker threads
+    (pixivpy) use `with limiter.limit_sync(host)`. After the response arrives, call report() with the
+    status and body so risk-control answers slow the host down. Both raise RateLimitExceeded instead of
+    waiting longer than the host's max_wait_s, background jobs may pass a longer max_wait_s of their own.
+    The wait happens before a concurrency slot is taken, a caller sleeping through a cooldown holds none.
+    """
+
+    def __init__(self):
+        self.hosts: dict[str, HostLimit] = dict()
+
+    def configure(self, host: str, policy: HostPolicy):
+        self.hosts[host] = HostLimit(policy)
+
+    @asynccontextmanager
+    async def limit(self, host: str, max_wait_s: float | None = None):
+        host_limit = self.hosts.get(host)
+        if host_limit is None:
+            yield
+            return
+        if host_limit.async_slots is None:
+            host_limit.async_slots = asyncio.Semaphore(host_limit.policy.max_concurrency)
+        await asyncio.sleep(host_limit.reserve(max_wait_s))
+        while (blocked := host_limit.wait_blocked(max_wait_s)) > 0:
+            await asyncio.sleep(blocked)
+        async with host_limit.async_slots:
+            host_limit.in_flight += 1
+            try:
+                yield
+            finally:
+                host_limit.in_flight -= 1
+
+    @contextmanager
+    def limit_sync(self, host: str, max_wait_s: float | None = None):
+        host_limit = self.hosts.get(host)
+        if host_limit is None:
+            yield
+            return
+        time.sleep(host_limit.reserve(max_wait_s))
+        while (blocked := host_limit.wait_blocked(max_wait_s)) > 0:
+            time.sleep(blocked)
+        with host_limit.sync_slots:
+            with host_limit.lock:
+                host_limit.in_flight += 1
+            try:
+                yield
+            finally:
+                with host_limit.lock:
+                    host_limit.in_flight -= 1
+
+    def limited(self, host: str) -> bool:
+        return host in self.hosts
+
+    def report(self, host: str, status_code: int, body: bytes | None = None) -> bool:
+        """
+        :return: whether the response was a risk-control answer
+        """
+        host_limit = self.hosts.get(host)
+        if host_limit is None:
+            return False
+        risk_control = host_limit.policy.risk_control(status_code, body)
+        host_limit.report(risk_control)
+        return risk_control
+
+    def stats(self) -> dict[str, dict[str, float | int]]:
+        return {host: host_limit.stats() for host, host_limit in self.hosts.items()}
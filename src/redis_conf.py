@@ -1,3 +1,5 @@
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
 REDIS_DB = 0
+REDIS_KEY_PREFIX = 'brss'
+REDIS_MAX_CONNECTIONS = 32
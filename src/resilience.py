@@ -0,0 +1,117 @@
+import time
+import random
+import asyncio
+from threading import Lock
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Generic, TypeVar
+from pydantic import BaseModel, ConfigDict, Field
+
+
+T = TypeVar('T')
+
+
+class FetchResult(BaseModel, Generic[T]):
+    # data may be a msgspec struct (SpacePage), pydantic only checks it is an instance
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    ok: bool
+    data: T | None = Field(None)
+    msg: str = Field('')
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = 3
+    base_delay_s: float = 0.5
+    max_delay_s: float = 5.0
+
+    def delay(self, attempt: int) -> float:
+        # Full jitter, retries of many feeds failing together don't arrive together.
+        return random.uniform(0, min(self.max_delay_s, self.base_delay_s * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an upstream is down. After failure_threshold failures in a row the circuit opens
+    and allow() returns False for reset_timeout_s, then a single probe call is let through: its
+    success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout_s: float = 60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.lock = Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_at = 0.0
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            if self.state == 'open' and now >= self.opened_at + self.reset_timeout_s:
+                self.state = 'half_open'
+                self.probe_at = now
+                return True
+            if self.state == 'half_open' and now >= self.probe_at + self.reset_timeout_s:  # the probe never reported
+                self.probe_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.opens += 1
+
+    def stats(self) -> dict[str, str | int]:
+        return {'state': self.state, 'failures': self.failures, 'opens': self.opens, 'rejected': self.rejected}
+
+
+async def fetch_with_retry(
+        func: Callable[[], Awaitable[FetchResult[T]]],
+        breaker: CircuitBreaker,
+        policy: RetryPolicy = RetryPolicy(),
+        retryable: Callable[[FetchResult[T]], bool] = lambda result: True,
+        upstream_failure: Callable[[FetchResult[T]], bool] = lambda result: True,
+) -> FetchResult[T]:
+    """
+    Run an idempotent fetch with bounded jittered retries behind a circuit breaker.
+
+    :param retryable: whether a failed result is worth another attempt (transient errors)
+    :param upstream_failure: whether a failed result says the upstream is unhealthy, failures that
+                             only concern the requested item (no such user) don't count towards opening the circuit
+    :return: the first ok result, or a failed one whose msg records every attempt
+    """
+    if not breaker.allow():
+        return FetchResult(ok=False, msg=f'circuit {breaker.name} open')
+    reasons = []
+    result = None
+    for attempt in range(policy.attempts):
+        if attempt > 0:
+            await asyncio.sleep(policy.delay(attempt - 1))
+        result = await func()
+        if result.ok:
+            breaker.record_success()
+            return result
+        reasons.append(result.msg)
+        if not retryable(result):
+            break
+    if upstream_failure(result):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return FetchResult(ok=False, msg=f"{len(reasons)} attempt(s) failed: {'; '.join(reasons)}")
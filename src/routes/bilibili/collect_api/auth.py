@@ -1,20 +1,25 @@
 import time
 import hmac
+import asyncio
 import hashlib
 import urllib.parse
 from hashlib import md5
-from functools import reduce
+from typing import Awaitable, Callable
 
-import requests as rq
+import httpx
 
 from .conf import UNIVERSAL_UA, FetchResult
+from .client import MAX_WAIT_EXTENSION
+
+
+AUTH_STEP_TIMEOUT_S = 10.0  # per request, a hanging endpoint only fails its own part
 
 
 class InitializeDynamicCookieError(Exception):
     pass
 
 
-def check_resp_code(resp: rq.Response, hint: str) -> dict:
+def check_resp_code(resp: httpx.Response, hint: str) -> dict:
     if resp.status_code != 200:
         raise InitializeDynamicCookieError(hint)
     json_data = resp.json()
@@ -46,7 +51,7 @@ def hmac_sha256(key, message):
     return hash_hex
 
 
-def get_bili_ticket():
+async def get_bili_ticket(client: httpx.AsyncClient) -> str:
     o = hmac_sha256("XgwSnGZ1p", f"ts{int(time.time())}")
     url = "https://api.bilibili.com/bapis/bilibili.api.ticket.v1.Ticket/GenWebTicket"
     params = {
@@ -59,53 +64,98 @@ def get_bili_ticket():
     headers = {
         'user-agent': UNIVERSAL_UA
     }
-    resp = rq.post(url, params=params, headers=headers)
+    resp = await client.post(url, params=params, headers=headers)
     json_data = check_resp_code(resp, 'get bili_ticket failed')
     return json_data['data']['ticket']
 
 
+MIXIN_KEY_ENC_TAB = (
+    46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35, 27, 43, 5, 49,
+    33, 9, 42, 19, 29, 28, 14, 39, 12, 38, 41, 13, 37, 48, 7, 16, 24, 55, 40,
+    61, 26, 17, 0, 1, 60, 51, 30, 4, 22, 25, 54, 21, 56, 59, 6, 63, 57, 62, 11,
+    36, 20, 34, 44, 52
+)
+WBI_VALUE_FILTER = str.maketrans('', '', "!'()*")
+
+
 def getMixinKey(orig: str):
     """
     对 imgKey 和 subKey 进行字符顺序打乱编码
     """
-    mixinKeyEncTab = [
-        46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35, 27, 43, 5, 49,
-        33, 9, 42, 19, 29, 28, 14, 39, 12, 38, 41, 13, 37, 48, 7, 16, 24, 55, 40,
-        61, 26, 17, 0, 1, 60, 51, 30, 4, 22, 25, 54, 21, 56, 59, 6, 63, 57, 62, 11,
-        36, 20, 34, 44, 52
-    ]
-    return reduce(lambda s, i: s + orig[i], mixinKeyEncTab, '')[:32]
+    return ''.join([orig[i] for i in MIXIN_KEY_ENC_TAB[:32]])
+
+
+def wbiQuery(params: dict, mixin_key: str, wts: int | None = None) -> str:
+    """
+    签名并序列化参数，返回带 wts 与 w_rid 的 query string
+    """
+    items = [(k, str(v).translate(WBI_VALUE_FILTER)) for k, v in params.items()]  # 过滤 value 中的 "!'()*" 字符
+    items.append(('wts', str(round(time.time()) if wts is None else wts)))  # 添加 wts 字段
+    items.sort()  # 按照 key 重排参数
+    query = urllib.parse.urlencode(items)
+    return f'{query}&w_rid={md5((query + mixin_key).encode()).hexdigest()}'
 
 
 def encWbi(params: dict, img_key: str, sub_key: str):
     """
     为请求参数进行 wbi 签名
     """
-    mixin_key = getMixinKey(img_key + sub_key)
-    curr_time = round(time.time())
-    params['wts'] = curr_time  # 添加 wts 字段
-    params = dict(sorted(params.items()))  # 按照 key 重排参数
-    # 过滤 value 中的 "!'()*" 字符
-    params = {
-        k: ''.join(filter(lambda char: char not in "!'()*", str(v)))
-        for k, v
-        in params.items()
-    }
-    query = urllib.parse.urlencode(params)  # 序列化参数
-    wbi_sign = md5((query + mixin_key).encode()).hexdigest()  # 计算 w_rid
-    params['w_rid'] = wbi_sign
-    return params
+    return dict(urllib.parse.parse_qsl(wbiQuery(params, getMixinKey(img_key + sub_key)), keep_blank_values=True))
+
 
+class WbiSigner:
+    """
+    Signs wbi requests with a mixin key computed once per img_key / sub_key pair.
+
+    When an answer suggests the keys went stale, keys_stale() starts the refresh callback in the
+    background; concurrent reports share one refresh, and a successful refresh is not repeated within
+    min_refresh_interval_s (risk control answers look the same as stale keys). The callback returns
+    whether it got new keys, a failed refresh is retried on the next report.
+    """
 
-def getWbiKeys() -> tuple[str, str]:
+    def __init__(self, refresh: Callable[[], Awaitable[bool]], min_refresh_interval_s: float = 300):
+        self.refresh = refresh
+        self.min_refresh_interval_s = min_refresh_interval_s
+        self.keys: tuple[str, str] | None = None
+        self.mixin_key = ''
+        self.refreshing: asyncio.Task | None = None
+        self.refreshed_at = float('-inf')
+
+    def get_mixin_key(self, img_key: str, sub_key: str) -> str:
+        if self.keys != (img_key, sub_key):
+            self.mixin_key = getMixinKey(img_key + sub_key)
+            self.keys = (img_key, sub_key)
+        return self.mixin_key
+
+    def sign(self, params: dict, img_key: str, sub_key: str, wts: int | None = None) -> str:
+        return wbiQuery(params, self.get_mixin_key(img_key, sub_key), wts)
+
+    def keys_stale(self) -> asyncio.Task | None:
+        if self.refreshing is not None and not self.refreshing.done():
+            return self.refreshing
+        if time.monotonic() - self.refreshed_at < self.min_refresh_interval_s:
+            return None
+        self.refreshing = asyncio.create_task(self._refresh())
+        return self.refreshing
+
+    async def _refresh(self) -> bool:
+        refreshed = await self.refresh()
+        if refreshed:
+            self.refreshed_at = time.monotonic()
+        return refreshed
+
+
+async def getWbiKeys(client: httpx.AsyncClient, max_wait_s: float | None = None) -> tuple[str, str]:
     """
     获取最新的 img_key 和 sub_key
+    :param max_wait_s: 覆盖限流器的最长等待, 后台刷新可以等过风控冷却
     """
     headers = {
         'User-Agent': UNIVERSAL_UA,
         'Referer': 'https://www.bilibili.com/'
     }
-    resp = rq.get('https://api.bilibili.com/x/web-interface/nav', headers=headers)
+    extensions = {MAX_WAIT_EXTENSION: max_wait_s} if max_wait_s is not None else None
+    resp = await client.get('https://api.bilibili.com/x/web-interface/nav', headers=headers, extensions=extensions)
     json_content = check_resp_code(resp, "get wbi keys failed")
     img_url: str = json_content['data']['wbi_img']['img_url']
     sub_url: str = json_content['data']['wbi_img']['sub_url']
@@ -114,19 +164,24 @@ def getWbiKeys() -> tuple[str, str]:
     return img_key, sub_key
 
 
-def getCookies():
+async def getCookies(client: httpx.AsyncClient) -> tuple[str, str]:
     headers = {
         'User-Agent': UNIVERSAL_UA,
         'Referer': 'https://www.bilibili.com/'
     }
-    resp = rq.get('https://api.bilibili.com/x/frontend/finger/spi', headers=headers)
+    resp = await client.get('https://api.bilibili.com/x/frontend/finger/spi', headers=headers)
     json_content = check_resp_code(resp, "request cookie failed")
     buvid3 = json_content['data']['b_3']
     buvid4 = json_content['data']['b_4']
     return buvid3, buvid4
 
 
-def update() -> FetchResult[tuple[str, str, str, str, str]]:
+async def update(client: httpx.AsyncClient, timeout: float = AUTH_STEP_TIMEOUT_S) -> FetchResult[tuple[str | None, str | None, str | None, str | None, str | None]]:
+    """
+    Fetch a new anonymous credential set, the three requests are independent and run concurrently.
+    When some of them fail, ok is False and data still carries the parts that succeeded (None for the others),
+    so the caller can keep the old values for just the failed parts. msg names the failed parts.
+    """
     # API 收集来源于项目
     # https://github.com/SocialSisterYi/bilibili-API-collect
     #
@@ -141,13 +196,20 @@ def update() -> FetchResult[tuple[str, str, str, str, str]]:
     # https://github.com/SocialSisterYi/bilibili-API-collect/issues/868#issuecomment-1850110882
     # https://www.52pojie.cn/thread-1862056-1-1.html
 
-    try:
-        bili_ticket = get_bili_ticket()
-        img_key, sub_key = getWbiKeys()
-        buvid3, buvid4 = getCookies()
-        print('Sucessfully update bilibili anonymous cookie.')
-
-        return FetchResult(ok=True, data=(bili_ticket, img_key, sub_key, buvid3, buvid4))
-
-    except InitializeDynamicCookieError:
-        return FetchResult(ok=False)
+    ticket_result, wbi_result, cookie_result = await asyncio.gather(
+        asyncio.wait_for(get_bili_ticket(client), timeout),
+        asyncio.wait_for(getWbiKeys(client), timeout),
+        asyncio.wait_for(getCookies(client), timeout),
+        return_exceptions=True
+    )
+    failed = []
+    for name, result in (('bili_ticket', ticket_result), ('wbi_keys', wbi_result), ('buvid', cookie_result)):
+        if isinstance(result, BaseException):
+            if not isinstance(result, (InitializeDynamicCookieError, httpx.HTTPError, asyncio.TimeoutError, KeyError, ValueError)):
+                raise result
+            failed.append(f'{name}: {result!r}')
+
+    bili_ticket = None if isinstance(ticket_result, BaseException) else ticket_result
+    img_key, sub_key = (None, None) if isinstance(wbi_result, BaseException) else wbi_result
+    buvid3, buvid4 = (None, None) if isinstance(cookie_result, BaseException) else cookie_result
+    return FetchResult(ok=not failed, data=(bili_ticket, img_key, sub_key, buvid3, buvid4), msg='; '.join(failed))
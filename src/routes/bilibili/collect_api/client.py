@@ -0,0 +1,90 @@
+import re
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+
+import httpx
+
+from rate_limiter import RateLimiter, RateLimitExceeded
+from .conf import UNIVERSAL_UA
+
+
+CONNECT_TIMEOUT_S = 5.0
+READ_TIMEOUT_S = 10.0
+POOL_TIMEOUT_S = 5.0  # waiting for a free connection, every slot busy means upstream is already struggling
+KEEPALIVE_EXPIRY_S = 60.0
+
+# -352 风控校验失败, -412 请求被拦截; "code" is always the first field of an api.bilibili.com answer.
+RISK_CONTROL_CODE = re.compile(rb'\s*\{\s*"code"\s*:\s*(-352|-412)\b')
+
+# Request extension overriding the host's max_wait_s, for background requests that may wait out a cooldown.
+MAX_WAIT_EXTENSION = 'rate_limit_max_wait_s'
+
+
+def bilibili_risk_control(status_code: int, body: bytes | None) -> bool:
+    if status_code in (412, 429):
+        return True
+    return body is not None and RISK_CONTROL_CODE.match(body) is not None
+
+
+class RateLimitedError(httpx.TransportError):
+    """
+    The request was not sent, the rate limiter would have held it longer than the host's max wait.
+    """
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Puts every request of the client through the rate limiter of its host, and reports the answer back.
+    JSON answers of limited hosts are read here so risk-control codes can be seen, the client reads them anyway.
+    A request the limiter would hold too long fails with RateLimitedError, like any other transport error.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, limiter: RateLimiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if not self.limiter.limited(host):
+            return await self.transport.handle_async_request(request)
+        try:
+            async with self.limiter.limit(host, request.extensions.get(MAX_WAIT_EXTENSION)):
+                response = await self.transport.handle_async_request(request)
+                body = None
+                if 'json' in response.headers.get('content-type', ''):
+                    body = await response.aread()
+        except RateLimitExceeded as e:
+            raise RateLimitedError(f'{host}: {e}', request=request) from e
+        self.limiter.report(host, response.status_code, body)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def new_client(limiter: RateLimiter, http2: bool = True, max_connections: int = 32) -> httpx.AsyncClient:
+    """
+    The async client shared by every collect_api call, connections to api.bilibili.com are kept alive
+    and reused instead of paying TCP + TLS handshakes on each cache miss.
+    With HTTP/2 concurrent requests are multiplexed over a single connection. Falls back to
+    HTTP/1.1 when the h2 package is not installed.
+    """
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            http2 = False
+    transport = httpx.AsyncHTTPTransport(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=KEEPALIVE_EXPIRY_S,
+        ),
+    )
+    return httpx.AsyncClient(
+        transport=RateLimitedTransport(transport, limiter),
+        headers={'user-agent': UNIVERSAL_UA},
+        # Never stores Set-Cookie, every request carries exactly the cookies its caller passes.
+        cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+        timeout=httpx.Timeout(READ_TIMEOUT_S, connect=CONNECT_TIMEOUT_S, pool=POOL_TIMEOUT_S),
+    )
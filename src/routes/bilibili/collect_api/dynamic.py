@@ -1,16 +1,46 @@
-import urllib.parse
-
 from .conf import UNIVERSAL_UA, FetchResult
-from .auth import encWbi
+from .auth import WbiSigner
+from .space_model import SpacePage, decode_space
+from .client import RateLimitedError
 
 import httpx
 
 
-async def get_space_data(client: httpx.AsyncClient, bili_ticket: str, buvid3: str, buvid4: str, img_key: str, sub_key: str, user_id: int) -> FetchResult[dict]:
+# Prefixes of FetchResult.msg, the retry policy and circuit breaker classify failures by them.
+MSG_REQUEST_FAILED = 'request failed'
+MSG_HTTP_STATUS = 'http status'
+MSG_API_CODE = 'api code'
+MSG_BAD_PAYLOAD = 'bad payload'
+MSG_RATE_LIMITED = 'rate limited'
+RISK_CONTROL_CODES = (-352, -412)
+
+
+def is_transient(result: FetchResult) -> bool:
+    """
+    Network errors and 5xx answers, another attempt may well succeed.
+    """
+    if result.msg.startswith(MSG_REQUEST_FAILED):
+        return True
+    return result.msg.startswith(f'{MSG_HTTP_STATUS} 5')
+
+
+def is_upstream_failure(result: FetchResult) -> bool:
+    """
+    Failures that say the upstream is down or refusing us (risk control), not just that the requested space is unavailable.
+    """
+    if is_transient(result) or result.msg.startswith((MSG_HTTP_STATUS, MSG_RATE_LIMITED)):
+        return True
+    return any(result.msg.startswith(f'{MSG_API_CODE} {code}:') for code in RISK_CONTROL_CODES)
+
+
+async def get_space_data(client: httpx.AsyncClient, signer: WbiSigner, bili_ticket: str, buvid3: str, buvid4: str, img_key: str, sub_key: str, user_id: int, offset: str = '') -> FetchResult[SpacePage]:
+    """
+    One page of the space dynamics, newest first. Pass the offset of the previous page to get the next one.
+    """
     url = f'https://api.bilibili.com/x/polymer/web-dynamic/v1/feed/space'
     params = {
         'host_mid': user_id,
-        'offset': '',
+        'offset': offset,
         'timezone_offset': '-480',
         'platform': 'web',
         "features": "itemOpusStyle,listOnlyfans,opusBigCover",
@@ -22,24 +52,29 @@ async def get_space_data(client: httpx.AsyncClient, bili_ticket: str, buvid3: st
         "accept-language": "en,zh-CN;q=0.9,zh;q=0.8",
     }
     # 2024.11.21 时，buvid3 和 buvid4 的值为 "buvid3" 和 "buvid4" 也可用
-    cookies = {
-        'bili_ticket': bili_ticket,
-        'buvid3': buvid3,
-        'buvid4': buvid4,
-    }
-    signed_params = encWbi(
-        params=params,
-        img_key=img_key,
-        sub_key=sub_key
-    )
-    query = urllib.parse.urlencode(signed_params)
+    # Sent as a header, per-request cookies would be merged with the jar of the shared client.
+    headers['cookie'] = f'bili_ticket={bili_ticket}; buvid3={buvid3}; buvid4={buvid4}'
+    query = signer.sign(params, img_key=img_key, sub_key=sub_key)
     # full_url = f'{url}?{query}&{DM_APPEND}'
     full_url = f'{url}?{query}'
-    resp = await client.get(full_url, headers=headers, cookies=cookies)
+    try:
+        resp = await client.get(full_url, headers=headers)
+    except RateLimitedError as e:
+        # Not sent, retrying right away would be limited the same way.
+        return FetchResult(ok=False, msg=f'{MSG_RATE_LIMITED}: {e}')
+    except httpx.HTTPError as e:
+        return FetchResult(ok=False, msg=f'{MSG_REQUEST_FAILED}: {e!r}')
 
     if resp.status_code != 200:
-        return FetchResult(ok=False, msg='resp.status_code != 200')
-    json_data = resp.json()
-    if 'code' not in json_data and json_data['code'] != '0':
-        return FetchResult(ok=False, msg='code != 0')
-    return FetchResult(ok=True, data=json_data)
+        return FetchResult(ok=False, msg=f'{MSG_HTTP_STATUS} {resp.status_code}')
+    try:
+        code, message, page = decode_space(resp.content)
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        return FetchResult(ok=False, msg=f'{MSG_BAD_PAYLOAD}: {e!r}')
+    if code != 0:
+        # -352 / -412 are risk control, the rate limiter already slowed down on seeing them.
+        # Stale wbi keys get the same -352, so have them checked too.
+        if code == -352:
+            signer.keys_stale()
+        return FetchResult(ok=False, msg=f"{MSG_API_CODE} {code}: {message}")
+    return FetchResult(ok=True, data=page)
@@ -0,0 +1,92 @@
+import json
+from typing import Any, Callable
+from typing_extensions import Self
+
+try:
+    import orjson
+    loads: Callable[[bytes | str], Any] = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+class SpaceItem:
+    """
+    The parts of a feed/space item the extractors read. The rest of its module tree (stat, interaction,
+    more menu, fold, ...) is dropped as soon as the page is decoded.
+    """
+
+    __slots__ = ('id_str', 'type', 'author_name', 'pub_ts', 'desc_text', 'major', 'has_additional', 'orig')
+
+    def __init__(
+            self,
+            id_str: str | None,
+            type: str,
+            author_name: str | None,
+            pub_ts: int,
+            desc_text: str | None,
+            major: dict | None,
+            has_additional: bool,
+            orig: Self | None,
+    ):
+        self.id_str = id_str
+        self.type = type
+        self.author_name = author_name
+        self.pub_ts = pub_ts
+        self.desc_text = desc_text
+        self.major = major  # the major subtree, MajorExtractor dispatches on its type
+        self.has_additional = has_additional
+        self.orig = orig  # the forwarded dynamic
+
+    @classmethod
+    def decode(cls, raw: dict) -> Self:
+        modules = raw.get('modules') or {}
+        author = modules.get('module_author') or {}
+        dynamic = modules.get('module_dynamic') or {}
+        desc = dynamic.get('desc')
+        orig = raw.get('orig')
+        return cls(
+            id_str=raw.get('id_str'),
+            type=raw['type'],
+            author_name=author.get('name'),
+            pub_ts=int(author.get('pub_ts') or 0),
+            desc_text=desc.get('text') if desc is not None else None,
+            major=dynamic.get('major'),
+            has_additional=dynamic.get('additional') is not None,
+            orig=cls.decode(orig) if orig is not None else None,
+        )
+
+    def content_parts(self) -> list:
+        """
+        Every field the rendered entry depends on, counters like likes are not among them.
+        """
+        orig = None if self.orig is None else self.orig.content_parts() + [self.orig.author_name]
+        return [self.type, self.pub_ts, self.desc_text, self.major, self.has_additional, orig]
+
+
+class SpacePage:
+    __slots__ = ('items', 'offset', 'has_more')
+
+    def __init__(self, items: list[SpaceItem], offset: str, has_more: bool):
+        self.items = items
+        self.offset = offset  # pass it back to get the next page
+        self.has_more = has_more
+
+    @classmethod
+    def decode(cls, data: dict) -> Self:
+        return cls(
+            items=[SpaceItem.decode(e) for e in data.get('items') or []],
+            offset=str(data.get('offset') or ''),
+            has_more=bool(data.get('has_more')),
+        )
+
+
+def decode_space(body: bytes) -> tuple[int | None, str, SpacePage | None]:
+    """
+    Decode a feed/space answer into the typed page, the parsed JSON tree is released right after.
+    :return: api code, api message, and the page when the code is 0
+    """
+    json_data = loads(body)
+    code = json_data.get('code')
+    if code != 0:
+        return code, json_data.get('message', ''), None
+    return code, json_data.get('message', ''), SpacePage.decode(json_data.get('data') or {})
@@ -1,8 +1,20 @@
+import json
+import time
+import heapq
+import hashlib
+import threading
 from datetime import datetime
-from typing import Callable, Any
+from itertools import islice
+from typing import Callable, Any, Iterator
 from typing_extensions import Self
-from pydantic import BaseModel
-from rss_model import Media, Text, Image, Video, AtomEntry, AtomFeed
+from routes.bilibili.collect_api.space_model import SpaceItem, SpacePage
+from rss_model import text_html, image_html, video_html, LiteAtomEntry, AtomFeed, iter_feed, latest_time
+
+
+class DynamicType:
+    DYNAMIC_TYPE_FORWARD = 'DYNAMIC_TYPE_FORWARD'
+    DYNAMIC_TYPE_LIVE_RCMD = 'DYNAMIC_TYPE_LIVE_RCMD'
+    DYNAMIC_TYPE_DEFAULT = '*'  # every dynamic type without an extractor of its own
 
 
 class MajorType:
@@ -20,15 +32,6 @@ class MajorType:
     MAJOR_TYPE_UNKNOWN = 'MAJOR_TYPE_UNKNOWN'
 
 
-def enum_register(enum_value: str):
-    def wrapper(func):
-        def inner(*args, **kwargs):
-            return func(*args, **kwargs)
-        inner.enum_value = enum_value
-        return inner
-    return wrapper
-
-
 def get_chain_node(root: dict, *names) -> Any | None:
     ref = root
     for name in names:
@@ -39,10 +42,91 @@ def get_chain_node(root: dict, *names) -> Any | None:
     return ref
 
 
-class MajorExtractResult(BaseModel):
-    media_list: list[Media]
-    title: str | None = None
-    summary: str | None = None
+class MajorExtractResult:
+    """
+    :param media_list: rendered html of each media item
+    """
+
+    __slots__ = ('media_list', 'title', 'summary')
+
+    def __init__(self, media_list: list[str], title: str | None = None, summary: str | None = None):
+        self.media_list = media_list
+        self.title = title
+        self.summary = summary
+
+
+class ExtractorRegistry:
+    """
+    Extractors keyed by major type and by dynamic type. The decorators fill it while the module defining
+    the extractors is imported, so dispatching is a dict lookup. Other route packages can register their
+    own extractors the same way, a later registration of a type replaces the earlier one.
+
+    Each dispatch is counted and timed under the type found in the item, the time of a dynamic extractor
+    includes the major extractors it calls.
+    """
+
+    def __init__(self):
+        self.major_map: dict[str, Callable[[dict], MajorExtractResult]] = dict()
+        self.dynamic_map: dict[str, Callable[[SpaceItem], LiteAtomEntry | None]] = dict()
+        self.lock = threading.Lock()
+        self.timing: dict[str, dict[str, list[int]]] = {'major': dict(), 'dynamic': dict()}  # type -> [calls, total ns, max ns]
+
+    def major(self, major_type: str):
+        def wrapper(func: Callable[[dict], MajorExtractResult]):
+            self.major_map[major_type] = func
+            return func
+        return wrapper
+
+    def dynamic(self, dynamic_type: str):
+        def wrapper(func: Callable[[SpaceItem], LiteAtomEntry | None]):
+            self.dynamic_map[dynamic_type] = func
+            return func
+        return wrapper
+
+    def extract_major(self, major: dict) -> MajorExtractResult:
+        type_str = major.get('type')
+        func = self.major_map.get(type_str) or self.major_map[MajorType.MAJOR_TYPE_UNKNOWN]
+        st = time.perf_counter_ns()
+        try:
+            return func(major)
+        finally:
+            self.record('major', type_str, time.perf_counter_ns() - st)
+
+    def extract_dynamic(self, dynamic: SpaceItem) -> LiteAtomEntry | None:
+        func = self.dynamic_map.get(dynamic.type) or self.dynamic_map[DynamicType.DYNAMIC_TYPE_DEFAULT]
+        st = time.perf_counter_ns()
+        try:
+            return func(dynamic)
+        finally:
+            self.record('dynamic', dynamic.type, time.perf_counter_ns() - st)
+
+    def record(self, kind: str, type_str: str | None, cost_ns: int):
+        with self.lock:
+            timing = self.timing[kind].get(type_str)
+            if timing is None:
+                self.timing[kind][type_str] = [1, cost_ns, cost_ns]
+            else:
+                timing[0] += 1
+                timing[1] += cost_ns
+                timing[2] = max(timing[2], cost_ns)
+
+    def stats(self) -> dict[str, dict[str, dict[str, float | int]]]:
+        with self.lock:
+            return {
+                kind: {
+                    str(type_str): {
+                        'calls': calls,
+                        'total_ms': round(total_ns / 1e6, 3),
+                        'avg_us': round(total_ns / calls / 1e3, 1),
+                        'max_us': round(max_ns / 1e3, 1),
+                    }
+                    for type_str, (calls, total_ns, max_ns) in sorted(timing.items(), key=lambda x: -x[1][1])
+                }
+                for kind, timing in self.timing.items()
+            }
+
+
+Extractors = ExtractorRegistry()
 
 
 class MajorExtractor:
@@ -53,22 +137,12 @@ class MajorExtractor:
             cls._instance = super(MajorExtractor, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self):
-        self.type_map: dict[str, Callable[[dict], MajorExtractResult]] = dict()
-        for x in dir(self):
-            obj = getattr(self, x)
-            if 'enum_value' in dir(obj):
-                self.type_map[obj.enum_value] = obj
-
-    def extract(self, major: dict) -> MajorExtractResult:
-        type_str = major.get('type')
-        if type_str in self.type_map:
-            return self.type_map[type_str](major)
-        else:
-            return self.type_map[MajorType.MAJOR_TYPE_UNKNOWN](major)
+    @staticmethod
+    def extract(major: dict) -> MajorExtractResult:
+        return Extractors.extract_major(major)
 
     @staticmethod
-    @enum_register(MajorType.MAJOR_TYPE_NONE)
+    @Extractors.major(MajorType.MAJOR_TYPE_NONE)
     def _none_type(_major: dict) -> MajorExtractResult:
         """
         失效动态
@@ -76,11 +150,11 @@ class MajorExtractor:
         :return:
         """
         return MajorExtractResult(
-            media_list=[Text(text="动态已失效。")]
+            media_list=[text_html("动态已失效。")]
         )
 
     @staticmethod
-    @enum_register(MajorType.MAJOR_TYPE_UGC_SEASON)
+    @Extractors.major(MajorType.MAJOR_TYPE_UGC_SEASON)
     def _ugc_season(_major: dict) -> MajorExtractResult:
         """
         合集信息
@@ -88,11 +162,11 @@ class MajorExtractor:
         :return:
         """
         return MajorExtractResult(
-            media_list=[Text(text="暂未实现。（合集信息）")]
+            media_list=[text_html("暂未实现。（合集信息）")]
         )
 
     @staticmethod
-    @enum_register(MajorType.MAJOR_TYPE_ARTICLE)
+    @Extractors.major(MajorType.MAJOR_TYPE_ARTICLE)
     def _article(_major: dict) -> MajorExtractResult:
         """
         专栏类型
@@ -100,11 +174,11 @@ class MajorExtractor:
         :return:
         """
         return MajorExtractResult(
-            media_list=[Text(text="暂未实现。（专栏类型）")]
+            media_list=[text_html("暂未实现。（专栏类型）")]
         )
 
     @staticmethod
-    @enum_register(MajorType.MAJOR_TYPE_DRAW)
+    @Extractors.major(MajorType.MAJOR_TYPE_DRAW)
     def _draw(_major: dict) -> MajorExtractResult:
         """
         带图动态
@@ -112,11 +186,11 @@ class MajorExtractor:
         :return:
         """
         return MajorExtractResult(
-            media_list=[Text(text="暂未实现。（带图动态）")]
+            media_list=[text_html("暂未实现。（带图动态）")]
         )
 
     @staticmethod
-    @enum_register(MajorType.MAJOR_TYPE_ARCHIVE)
+    @Extractors.major(MajorType.MAJOR_TYPE_ARCHIVE)
     def _archive(_major: dict) -> MajorExtractResult:
         """
         视频信息
@@ -125,22 +199,14 @@ class MajorExtractor:
         """
         archive = _major['archive']
         video_title = archive['title']
-        video = Video(
-            aid=archive['aid'],
-            bid=archive['bvid'],
-            cover=archive['cover'],
-            desc=archive['desc'],
-            duration=archive['duration_text'],
-            jump_url=archive['jump_url'].replace('//www.bilibili.com', 'https://www.bilibili.com'),
-            title=video_title,
-        )
+        video = video_html(title=video_title, desc=archive['desc'], cover=archive['cover'])
         return MajorExtractResult(
             media_list=[video],
             title=f"投稿了视频：{video_title}"
         )
 
     @staticmethod
-    @enum_register(MajorType.MAJOR_TYPE_LIVE_RCMD)
+    @Extractors.major(MajorType.MAJOR_TYPE_LIVE_RCMD)
     def _live_rcmd(_major: dict) -> MajorExtractResult:
         """
         直播状态
@@ -148,11 +214,11 @@ class MajorExtractor:
         :return:
         """
         return MajorExtractResult(
-            media_list=[Text(text="暂未实现。（直播状态）")]
+            media_list=[text_html("暂未实现。（直播状态）")]
         )
 
     @staticmethod
-    @enum_register(MajorType.MAJOR_TYPE_COMMON)
+    @Extractors.major(MajorType.MAJOR_TYPE_COMMON)
     def _common(_major: dict) -> MajorExtractResult:
         """
         一般类型
@@ -160,11 +226,11 @@ class MajorExtractor:
         :return:
         """
         return MajorExtractResult(
-            media_list=[Text(text="暂未实现。（一般类型）")]
+            media_list=[text_html("暂未实现。（一般类型）")]
         )
 
     @staticmethod
-    @enum_register(MajorType.MAJOR_TYPE_PGC)
+    @Extractors.major(MajorType.MAJOR_TYPE_PGC)
     def _pgc(_major: dict) -> MajorExtractResult:
         """
         剧集信息
@@ -172,11 +238,11 @@ class MajorExtractor:
         :return:
         """
         return MajorExtractResult(
-            media_list=[Text(text="暂未实现。（剧集信息）")]
+            media_list=[text_html("暂未实现。（剧集信息）")]
         )
 
     @staticmethod
-    @enum_register(MajorType.MAJOR_TYPE_COURSES)
+    @Extractors.major(MajorType.MAJOR_TYPE_COURSES)
     def _courses(_major: dict) -> MajorExtractResult:
         """
         课程信息
@@ -184,11 +250,11 @@ class MajorExtractor:
         :return:
         """
         return MajorExtractResult(
-            media_list=[Text(text="暂未实现。（课程信息）")]
+            media_list=[text_html("暂未实现。（课程信息）")]
         )
 
     @staticmethod
-    @enum_register(MajorType.MAJOR_TYPE_MUSIC)
+    @Extractors.major(MajorType.MAJOR_TYPE_MUSIC)
     def _music(_major: dict) -> MajorExtractResult:
         """
         音频信息
@@ -196,11 +262,11 @@ class MajorExtractor:
         :return:
         """
         return MajorExtractResult(
-            media_list=[Text(text="暂未实现。（音频信息）")]
+            media_list=[text_html("暂未实现。（音频信息）")]
         )
 
     @staticmethod
-    @enum_register(MajorType.MAJOR_TYPE_OPUS)
+    @Extractors.major(MajorType.MAJOR_TYPE_OPUS)
     def _opus(major: dict) -> MajorExtractResult:
         """
         图文动态
@@ -209,16 +275,16 @@ class MajorExtractor:
         """
         opus = major['opus']
         title = opus.get('title')
-        media_list: list[Media] = []
+        media_list: list[str] = []
         if title is not None:
-            media_list.append(Text(text=title, bold=True))
+            media_list.append(text_html(title, bold=True))
         summary_text = get_chain_node(opus, 'summary', 'text')
         if summary_text is not None:
-            media_list.append(Text(text=summary_text))
+            media_list.append(text_html(summary_text))
         pics: dict | None = opus.get('pics')
         if pics is not None:
             for pic in pics:
-                media_list.append(Image(src=pic['url']))
+                media_list.append(image_html(pic['url']))
         return MajorExtractResult(
             media_list=media_list,
             title=title,
@@ -226,10 +292,10 @@ class MajorExtractor:
         )
 
     @staticmethod
-    @enum_register(MajorType.MAJOR_TYPE_UNKNOWN)
+    @Extractors.major(MajorType.MAJOR_TYPE_UNKNOWN)
     def _not_support(_major: dict) -> MajorExtractResult:
         return MajorExtractResult(
-            media_list=[Text(text="未知的动态内容类型。")]
+            media_list=[text_html("未知的动态内容类型。")]
         )
 
 
@@ -241,81 +307,154 @@ class DynamicExtractor:
             cls._instance = super(DynamicExtractor, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self):
-        self.major_extractor = MajorExtractor()
+    @staticmethod
+    def extract(dynamic: SpaceItem) -> LiteAtomEntry | None:
+        return Extractors.extract_dynamic(dynamic)
 
-    def extract(self, dynamic: dict) -> AtomEntry | None:
-        if dynamic['type'] == 'DYNAMIC_TYPE_LIVE_RCMD':
-            return None
+    @staticmethod
+    @Extractors.dynamic(DynamicType.DYNAMIC_TYPE_LIVE_RCMD)
+    def _live_rcmd(_dynamic: SpaceItem) -> None:
+        """
+        直播推荐，不生成条目
+        """
+        return None
 
-        dynamic_id = dynamic['id_str']
-        modules = dynamic['modules']
-        title = None
-        pub_timestamp = modules['module_author']['pub_ts']
-        pub_str = datetime.fromtimestamp(float(pub_timestamp)).strftime('%Y-%m-%dT%H:%M:%S+08:00')
-
-        media_list: list[Media] = []
-
-        desc = modules['module_dynamic']['desc']
-        if desc is not None:
-            media_list.append(Text(text=desc['text']))
-            title = desc['text'] if title is None else title
-
-        if dynamic['type'] == 'DYNAMIC_TYPE_FORWARD':
-            orig = dynamic['orig']
-            orig_author = orig['modules']['module_author']['name']
-            media_list.append(Text(text=f'转发自@{orig_author}'))
-            major_extract_result = self.major_extractor.extract(orig['modules']['module_dynamic']['major'])
-            media_list.extend(major_extract_result.media_list)
-            title = major_extract_result.title if title is None else title
-            title = major_extract_result.summary if title is None else title
-            title = '转发动态' if title is None else title if title == '转发动态' else f'{title} @转发动态'
-        else:
-            major = modules['module_dynamic']['major']
-            major_extract_result = self.major_extractor.extract(major)
-            media_list.extend(major_extract_result.media_list)
-            title = major_extract_result.title if title is None else title
-            title = major_extract_result.summary if title is None else title
+    @staticmethod
+    @Extractors.dynamic(DynamicType.DYNAMIC_TYPE_FORWARD)
+    def _forward(dynamic: SpaceItem) -> LiteAtomEntry:
+        """
+        转发动态
+        """
+        media_list: list[str] = []
+        title = dynamic.desc_text
+        if dynamic.desc_text is not None:
+            media_list.append(text_html(dynamic.desc_text))
+        orig = dynamic.orig
+        media_list.append(text_html(f'转发自@{orig.author_name}'))
+        major_extract_result = Extractors.extract_major(orig.major)
+        media_list.extend(major_extract_result.media_list)
+        title = major_extract_result.title if title is None else title
+        title = major_extract_result.summary if title is None else title
+        title = '转发动态' if title is None else title if title == '转发动态' else f'{title} @转发动态'
+        return DynamicExtractor.build_entry(dynamic, media_list, title)
 
-        # at bottom
-        if modules['module_dynamic']['additional'] is not None:
-            media_list.append(Text(text="卡片信息。（暂未实现）"))
+    @staticmethod
+    @Extractors.dynamic(DynamicType.DYNAMIC_TYPE_DEFAULT)
+    def _default(dynamic: SpaceItem) -> LiteAtomEntry:
+        """
+        文字、图文、视频等，内容都在 major 中
+        """
+        media_list: list[str] = []
+        title = dynamic.desc_text
+        if dynamic.desc_text is not None:
+            media_list.append(text_html(dynamic.desc_text))
+        major_extract_result = Extractors.extract_major(dynamic.major)
+        media_list.extend(major_extract_result.media_list)
+        title = major_extract_result.title if title is None else title
+        title = major_extract_result.summary if title is None else title
+        return DynamicExtractor.build_entry(dynamic, media_list, title)
 
-        content = ''.join([e.html() for e in media_list])
+    @staticmethod
+    def build_entry(dynamic: SpaceItem, media_list: list[str], title: str | None) -> LiteAtomEntry:
+        # at bottom
+        if dynamic.has_additional:
+            media_list.append(text_html("卡片信息。（暂未实现）"))
 
-        return AtomEntry(
-            title='未提取成功，若发现存在标题，请提issue反馈。' if title is None else title,
+        dynamic_id = dynamic.id_str
+        title = '未提取成功，若发现存在标题，请提issue反馈。' if title is None else title
+        return LiteAtomEntry(
+            title=title,
             link=f"https://t.bilibili.com/{dynamic_id}",
             eid=dynamic_id,
-            updated=pub_str,
-            summary='未提取成功，若发现存在标题，请提issue反馈。' if title is None else title,
-            content=content
+            updated=datetime.fromtimestamp(float(dynamic.pub_ts)).strftime('%Y-%m-%dT%H:%M:%S+08:00'),
+            summary=title,
+            content=''.join(media_list)
         )
 
 
-def extract_dynamic(user_id: int, json_resp: dict) -> AtomFeed:
-    data = json_resp['data']
-    # has_more = data['has_more']
-    # offset = data['offset']
-    # update_num = data['update_num']
-
-    dynamic_extractor = DynamicExtractor()
-    entr_list: list[AtomEntry] = []
-    for item in data['items']:
-        entry = dynamic_extractor.extract(item)
+def get_author_name(items: list[SpaceItem]) -> str | None:
+    if not items:
+        return None
+    return items[0].author_name
+
+
+# Part of every digest, bump it when a change to the extractors should re-render stored entries.
+EXTRACTOR_VERSION = 1
+
+
+def entry_digest(item: SpaceItem) -> str:
+    """
+    Digest of the parts of an item its entry is extracted from, only a real edit changes it.
+    """
+    raw = json.dumps([EXTRACTOR_VERSION, item.content_parts()], ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def extract_new_entries(items: list[SpaceItem], known_digests: dict[str, str]) -> list[tuple[str, int, str, LiteAtomEntry]]:
+    """
+    Extract the items that are not known yet or changed since they were extracted.
+    :param known_digests: id_str -> digest of the entries extracted before
+    :return: (id_str, pub_ts, digest, entry) of each extracted item
+    """
+    entry_list: list[tuple[str, int, str, LiteAtomEntry]] = []
+    for item in items:
+        digest = entry_digest(item)
+        if known_digests.get(item.id_str) == digest:
+            continue
+        entry = Extractors.extract_dynamic(item)
         if entry is None:
             continue
-        entr_list.append(entry)
+        entry_list.append((item.id_str, item.pub_ts, digest, entry))
+    return entry_list
 
-    author_name: str | None = None
-    if data['items']:
-        author_name = get_chain_node(data['items'][0], 'modules', 'module_author', 'name')
 
+def build_feed(user_id: int, author_name: str | None, fragment_list: list[tuple[str, str]]) -> Iterator[str]:
+    """
+    :param fragment_list: (updated, rendered <entry>) of each entry, newest first
+    """
+    author_name = f'用户{user_id}' if author_name is None else author_name
+    return iter_feed(
+        title=f'{author_name}的动态',
+        link=f'/bilibili/dynamic/{user_id}',
+        updated=latest_time([updated for updated, _ in fragment_list]),
+        authors=[author_name],
+        fid=f'brss/bilibili/dynamic/{user_id}',
+        entry_xml_iter=(fragment for _, fragment in fragment_list)
+    )
+
+
+def build_merged_feed(
+        query: str,
+        title: str,
+        author_names: list[str],
+        fragment_lists: list[list[tuple[str, str]]],
+        limit: int,
+) -> Iterator[str]:
+    """
+    One feed of the entries of several users, the newest `limit` of them.
+    :param query: query string of the merged feed, e.g. uids=1,2
+    :param fragment_lists: (updated, rendered <entry>) of each entry of each user, newest first
+    """
+    fragment_list = list(islice(heapq.merge(*fragment_lists, key=lambda e: datetime.fromisoformat(e[0]), reverse=True), limit))
+    return iter_feed(
+        title=title,
+        link=f'/bilibili/dynamic?{query}',
+        updated=latest_time([updated for updated, _ in fragment_list]),
+        authors=author_names,
+        fid=f'brss/bilibili/dynamic?{query}',
+        entry_xml_iter=(fragment for _, fragment in fragment_list)
+    )
+
+
+def extract_dynamic(user_id: int, json_resp: dict) -> AtomFeed:
+    items = SpacePage.decode(json_resp['data']).items
+    author_name = get_author_name(items)
     author_name = f'用户{user_id}' if author_name is None else author_name
+    entr_list = [entry.model() for _, _, _, entry in extract_new_entries(items, dict())]
     atom_feed = AtomFeed(
         title=f'{author_name}的动态',
         link=f'/bilibili/dynamic/{user_id}',
-        updated=datetime.now().strftime('%Y-%m-%dT%H:%M:%S+08:00'),
+        updated=latest_time([e.updated for e in entr_list]),
         authors=[author_name],
         fid=f'brss/bilibili/dynamic/{user_id}',
         entry_list=entr_list
@@ -0,0 +1,122 @@
+import os
+from threading import Lock
+
+from sqlalchemy import bindparam, create_engine, event, text
+
+from cache_proxy import LockWrapper, set_sqlite_pragmas
+from rss_model import LiteAtomEntry
+
+
+class DynamicEntryStore:
+    """
+    Extracted dynamics of each user, keyed by id_str, so a refresh only extracts the ids it hasn't seen
+    and feeds can reach further back than the single page the space API returns.
+
+    An entry is kept as its rendered <entry> fragment plus the digest of the upstream parts it was
+    extracted from, feeds are assembled from the fragments without building any model. An item whose
+    digest changed (an edited dynamic) is extracted again.
+
+    Per user it also keeps the author name and the backfill position (the space API offset to
+    continue paging from, and whether the history is exhausted).
+    """
+
+    def __init__(self, db_path: str = './data/BilibiliDynamic.db'):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.lock = Lock()
+        self.engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+        event.listen(self.engine, 'connect', set_sqlite_pragmas)
+        with self.engine.begin() as conn:
+            columns = {row[1] for row in conn.execute(text("PRAGMA table_info(dynamic_entry)")).all()}
+            rebuild = bool(columns) and 'fragment' not in columns
+            if rebuild:
+                # Entries are derived from upstream, a table of the old layout is simply rebuilt by later refreshes.
+                conn.execute(text("DROP TABLE dynamic_entry"))
+            conn.execute(text(
+                "CREATE TABLE if not exists dynamic_entry(user_id INTEGER, id_str TEXT, pub_ts INTEGER, digest TEXT, updated TEXT, fragment TEXT, "
+                "PRIMARY KEY (user_id, id_str))"
+            ))
+            conn.execute(text("CREATE INDEX if not exists dynamic_entry_user_pub ON dynamic_entry(user_id, pub_ts)"))
+            conn.execute(text(
+                "CREATE TABLE if not exists dynamic_user(user_id INTEGER PRIMARY KEY, author_name TEXT, backfill_offset TEXT, exhausted INTEGER)"
+            ))
+            if rebuild:
+                # The backfill positions describe the dropped entries, the history is paged through again from the top.
+                conn.execute(text("UPDATE dynamic_user SET backfill_offset = '', exhausted = 0"))
+
+    def known_digests(self, user_id: int, ids: list[str]) -> dict[str, str]:
+        """
+        :return: id_str -> digest of the stored ones among ids
+        """
+        if not ids:
+            return dict()
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                text("SELECT id_str, digest FROM dynamic_entry WHERE user_id = :user_id AND id_str IN :ids").bindparams(bindparam('ids', expanding=True)),
+                {'user_id': user_id, 'ids': ids}
+            ).all()
+        return {row[0]: row[1] for row in rows}
+
+    @LockWrapper
+    def merge(self, user_id: int, author_name: str | None, entries: list[tuple[str, int, str, LiteAtomEntry]], keep: int):
+        """
+        Store newly extracted entries (id_str, pub_ts, digest, entry), then drop everything older than the newest `keep`.
+        """
+        with self.engine.begin() as conn:
+            if entries:
+                conn.execute(
+                    text("INSERT OR REPLACE INTO dynamic_entry (user_id, id_str, pub_ts, digest, updated, fragment) "
+                         "VALUES (:user_id, :id_str, :pub_ts, :digest, :updated, :fragment)"),
+                    [
+                        {'user_id': user_id, 'id_str': i, 'pub_ts': ts, 'digest': d, 'updated': e.updated, 'fragment': e.xml()}
+                        for i, ts, d, e in entries
+                    ]
+                )
+            if author_name is not None:
+                conn.execute(
+                    text("INSERT INTO dynamic_user (user_id, author_name, backfill_offset, exhausted) VALUES (:user_id, :name, '', 0) "
+                         "ON CONFLICT(user_id) DO UPDATE SET author_name = :name"),
+                    {'user_id': user_id, 'name': author_name}
+                )
+            conn.execute(
+                text("DELETE FROM dynamic_entry WHERE user_id = :user_id AND id_str NOT IN "
+                     "(SELECT id_str FROM dynamic_entry WHERE user_id = :user_id ORDER BY pub_ts DESC LIMIT :keep)"),
+                {'user_id': user_id, 'keep': keep}
+            )
+
+    def latest(self, user_id: int, limit: int) -> tuple[str | None, list[tuple[str, str]]]:
+        """
+        :return: author name, and (updated, fragment) of the newest `limit` entries
+        """
+        with self.engine.connect() as conn:
+            author_name = conn.execute(text("SELECT author_name FROM dynamic_user WHERE user_id = :user_id"), {'user_id': user_id}).scalar()
+            rows = conn.execute(
+                text("SELECT updated, fragment FROM dynamic_entry WHERE user_id = :user_id ORDER BY pub_ts DESC LIMIT :limit"),
+                {'user_id': user_id, 'limit': limit}
+            ).all()
+        return author_name, [(row[0], row[1]) for row in rows]
+
+    def count(self, user_id: int) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(text("SELECT COUNT(*) FROM dynamic_entry WHERE user_id = :user_id"), {'user_id': user_id}).scalar()
+
+    def backfill_state(self, user_id: int) -> tuple[str, bool]:
+        """
+        :return: offset to continue from ('' when not started), and whether the history is exhausted
+        """
+        with self.engine.connect() as conn:
+            row = conn.execute(text("SELECT backfill_offset, exhausted FROM dynamic_user WHERE user_id = :user_id"), {'user_id': user_id}).first()
+        if row is None:
+            return '', False
+        return row[0] or '', bool(row[1])
+
+    @LockWrapper
+    def set_backfill_state(self, user_id: int, offset: str, exhausted: bool):
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO dynamic_user (user_id, author_name, backfill_offset, exhausted) VALUES (:user_id, NULL, :offset, :exhausted) "
+                     "ON CONFLICT(user_id) DO UPDATE SET backfill_offset = :offset, exhausted = :exhausted"),
+                {'user_id': user_id, 'offset': offset, 'exhausted': int(exhausted)}
+            )
+
+    def close(self):
+        self.engine.dispose()
@@ -1,51 +1,120 @@
+import time
+import asyncio
+from typing import Iterable
+from urllib.parse import urlencode, parse_qsl
 from contextlib import asynccontextmanager
 
-from cache_proxy import CacheLib, SQLiteCacheProxy
-from init import get_router, get_cache_proxy, get_logger
+from init import get_router, get_env_setting, get_rate_limiter, get_circuit_breaker, get_async_cache_proxy, get_feed_cache, get_prefetcher, get_logger
+from config_snapshot import ConfigSnapshot, versioned
 from .collect_api import auth as auth_api
+from .collect_api.client import new_client, bilibili_risk_control
 from .collect_api import dynamic as dynamic_collect_api
+from .collect_api.space_model import SpaceItem, SpacePage
 from .convert_api import dynamic as dynamic_convert_api
+from .entry_store import DynamicEntryStore
 
 import httpx
-from fastapi import APIRouter, Response
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from feed_cache import feed_response
+from rate_limiter import HostPolicy
+from resilience import RetryPolicy, fetch_with_retry
+from prefetch import FeedSource
 from apscheduler.triggers.cron import CronTrigger
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 
 RSS_CONTENT_CACHE_TIME_S = int(60 * 5)  # todo: read setting instead hard coding
-CacheProxy = get_cache_proxy()
+RSS_CONTENT_STALE_TIME_S = int(60 * 60 * 24)  # serve the last good feed this long when upstream fails
+COOKIE_RETRY_DELAYS_S = (10, 60, 300)
+CacheProxy = get_async_cache_proxy()
+FeedCache = get_feed_cache()
+Prefetcher = get_prefetcher()
 Logger = get_logger('bilibili')
+HttpClient: httpx.AsyncClient | None = None  # opened and closed by the router lifespan
+CookieTask: asyncio.Task | None = None  # the cookie bootstrap started by the lifespan
+EntryStore = DynamicEntryStore()
+HistoryDepth = get_env_setting().bilibili_history_depth
+BackfillTasks: dict[int, asyncio.Task] = dict()  # at most one backfill per user
+BackfillSlots = asyncio.Semaphore(1)  # backfills page through history one user at a time, reader requests go first
+DynamicGroups = get_env_setting().bilibili_dynamic_groups  # group name -> user ids of a merged feed
+MergeMaxUsers = get_env_setting().bilibili_merge_max_users
+MergeSlots = asyncio.Semaphore(get_env_setting().bilibili_merge_concurrency)  # member refreshes of merged feeds at once
+CookieSnapshot = ConfigSnapshot(CacheProxy, ('bili_ticket', 'img_key', 'sub_key', 'buvid3', 'buvid4'))
+SpaceRetry = RetryPolicy(attempts=3, base_delay_s=0.5, max_delay_s=4)
+SpaceBreaker = get_circuit_breaker('bilibili.space')
+RateLimiter = get_rate_limiter()
+ApiPolicy = HostPolicy(
+    rate=get_env_setting().bilibili_rate_per_s,
+    burst=4,
+    max_concurrency=get_env_setting().bilibili_max_concurrency,
+    risk_control=bilibili_risk_control,
+)
+RateLimiter.configure('api.bilibili.com', ApiPolicy)
+WbiRefreshMaxWait = ApiPolicy.max_cooldown_s + 60  # the longest cooldown plus the token debt left behind it
 
 
-def update_bilibili_cookie_job():
-    # todo: This is not a standardized practice, it's not good.
-    local_cache_proxy = SQLiteCacheProxy()
+async def refresh_wbi_keys() -> bool:
     try:
-        Logger.info('Start update cookie.')
-        fetch_result = auth_api.update()
-        if fetch_result.ok:
-            Logger.info('Successfully update cookie.')
-            bili_ticket, img_key, sub_key, buvid3, buvid4 = fetch_result.data
-            local_cache_proxy.set('bili_ticket', bili_ticket)
-            local_cache_proxy.set('img_key', img_key)
-            local_cache_proxy.set('sub_key', sub_key)
-            local_cache_proxy.set('buvid3', buvid3)
-            local_cache_proxy.set('buvid4', buvid4)
-        else:
-            Logger.warning('Update cookie failed.')
-    finally:
-        local_cache_proxy.close()
+        # Stale keys are reported together with a risk-control answer, which pauses the host. The refresh
+        # runs in the background, so it waits out the longest cooldown instead of failing behind it.
+        img_key, sub_key = await auth_api.getWbiKeys(HttpClient, max_wait_s=WbiRefreshMaxWait)
+    except (auth_api.InitializeDynamicCookieError, httpx.HTTPError, KeyError, ValueError) as e:
+        Logger.warning(f'Refresh wbi keys failed, {e!r}')
+        return False
+    await CacheProxy.set_many(versioned({'img_key': img_key, 'sub_key': sub_key}))
+    CookieSnapshot.invalidate()
+    Logger.info('Refreshed wbi keys.')
+    return True
+
+
+Signer = auth_api.WbiSigner(refresh_wbi_keys)
+
+
+async def update_bilibili_cookie() -> bool:
+    fetch_result = await auth_api.update(HttpClient)
+    names = ('bili_ticket', 'img_key', 'sub_key', 'buvid3', 'buvid4')
+    # Keep the old value of parts that failed, the parts are independent of each other.
+    mapping = {name: value for name, value in zip(names, fetch_result.data) if value is not None}
+    if mapping:
+        # One atomic write, a reader never pairs a new ticket with old buvid / wbi keys of the same update.
+        await CacheProxy.set_many(versioned(mapping))
+        CookieSnapshot.invalidate()
+    if fetch_result.ok:
+        Logger.info('Successfully update cookie.')
+    else:
+        Logger.warning(f'Update cookie failed, {fetch_result.msg}')
+    return fetch_result.ok
+
+
+async def update_bilibili_cookie_job():
+    Logger.info('Start update cookie.')
+    for delay in COOKIE_RETRY_DELAYS_S:
+        if await update_bilibili_cookie():
+            return
+        Logger.info(f'Retry update cookie in {delay}s.')
+        await asyncio.sleep(delay)
+    await update_bilibili_cookie()
 
 
 @asynccontextmanager
 async def lifespan(_app: APIRouter):
+    global HttpClient, CookieTask
     # file_wd = os.path.split(os.path.abspath(__file__))[0]
-    scheduler = BackgroundScheduler()
+    setting = get_env_setting()
+    HttpClient = new_client(RateLimiter, http2=setting.upstream_http2, max_connections=setting.upstream_max_connections)
+    scheduler = AsyncIOScheduler()
     scheduler.add_job(update_bilibili_cookie_job, CronTrigger(hour=1), id="job_id", name="My periodic task")
     scheduler.start()
-    update_bilibili_cookie_job()
+    # Startup doesn't wait for upstream, the first feed requests wait for this task instead.
+    CookieTask = asyncio.create_task(update_bilibili_cookie_job())
     yield
-    scheduler.pause()
+    scheduler.shutdown(wait=False)
+    CookieTask.cancel()
+    for task in list(BackfillTasks.values()):
+        task.cancel()
+    await HttpClient.aclose()
+    EntryStore.close()
 
 
 router = get_router('bilibili', lifespan=lifespan)
@@ -54,48 +123,207 @@ router = get_router('bilibili', lifespan=lifespan)
 StrOrNoneType = str | None
 
 
-def get_cookie() -> tuple[bool, StrOrNoneType, StrOrNoneType, StrOrNoneType, StrOrNoneType, StrOrNoneType]:
-    bili_ticket: bytes | None = CacheProxy.get('bili_ticket')
-    img_key: bytes | None = CacheProxy.get('img_key')
-    sub_key: bytes | None = CacheProxy.get('sub_key')
-    buvid3: bytes | None = CacheProxy.get('buvid3')
-    buvid4: bytes | None = CacheProxy.get('buvid4')
-
-    bili_ticket = bili_ticket.decode('utf-8') if bili_ticket is not None else None
-    img_key = img_key.decode('utf-8') if img_key is not None else None
-    sub_key = sub_key.decode('utf-8') if sub_key is not None else None
-    buvid3 = buvid3.decode('utf-8') if buvid3 is not None else None
-    buvid4 = buvid4.decode('utf-8') if buvid4 is not None else None
+async def get_cookie() -> tuple[bool, StrOrNoneType, StrOrNoneType, StrOrNoneType, StrOrNoneType, StrOrNoneType]:
+    values = await CookieSnapshot.get()
+    bili_ticket, img_key, sub_key, buvid3, buvid4 = (
+        values[name].decode('utf-8') if values[name] is not None else None for name in CookieSnapshot.names
+    )
 
     all_ok = all([e is not None for e in (bili_ticket, img_key, sub_key, buvid3, buvid4)])
 
     return all_ok, bili_ticket, img_key, sub_key, buvid3, buvid4
 
 
-@router.get("/dynamic/{user_id}")
-async def bili_dynamic(user_id: int):
-    Logger.debug(f'Accept dynamic request, user id: {user_id}')
-    all_ok, bili_ticket, img_key, sub_key, buvid3, buvid4 = get_cookie()
+async def get_cookie_or_wait() -> tuple[bool, StrOrNoneType, StrOrNoneType, StrOrNoneType, StrOrNoneType, StrOrNoneType]:
+    cookie = await get_cookie()
+    if cookie[0] is False and CookieTask is not None and not CookieTask.done():
+        Logger.debug('Cookie not ready, wait for the cookie bootstrap.')
+        await asyncio.wait([CookieTask], timeout=auth_api.AUTH_STEP_TIMEOUT_S)
+        cookie = await get_cookie()
+    return cookie
 
+
+async def fetch_space_page(user_id: int, offset: str = '') -> SpacePage | None:
+    all_ok, bili_ticket, img_key, sub_key, buvid3, buvid4 = await get_cookie_or_wait()
     if all_ok is False:
-        return Response(status_code=500)
+        return None
 
-    key = f'/rss/bilibili/dynamic/{user_id}'
-    cache = CacheProxy.get(key)
-    if cache is not None:
-        Logger.debug(f'Return cache to dynamic request, user id: {user_id}')
-        return Response(content=cache.decode('utf-8'), media_type="application/xml")
+    Logger.debug(f'Get cookie done, send dynamic request, user id: {user_id}, offset: {offset!r}')
+    fetch_result = await fetch_with_retry(
+        lambda: dynamic_collect_api.get_space_data(HttpClient, Signer, bili_ticket, buvid3, buvid4, img_key, sub_key, user_id, offset),
+        SpaceBreaker,
+        SpaceRetry,
+        retryable=dynamic_collect_api.is_transient,
+        upstream_failure=dynamic_collect_api.is_upstream_failure,
+    )
+    if fetch_result.ok is False:
+        Logger.warning(f'Fetch dynamic failed, user id: {user_id}, offset: {offset!r}, {fetch_result.msg}')
+        return None
+    return fetch_result.data
 
-    Logger.debug(f'Get cookie done, send dynamic request, user id: {user_id}')
-    async with httpx.AsyncClient() as client:
-        fetch_result = await dynamic_collect_api.get_space_data(client, bili_ticket, buvid3, buvid4, img_key, sub_key, user_id)
-        if fetch_result.ok is False:
-            return Response(status_code=500)
+
+def merge_page(user_id: int, items: list[SpaceItem]) -> int:
+    """
+    Extract the items of a page the store doesn't know yet or that changed, and merge them in. Runs in a worker thread.
+    :return: number of merged entries
+    """
+    known_digests = EntryStore.known_digests(user_id, [item.id_str for item in items])
+    entry_list = dynamic_convert_api.extract_new_entries(items, known_digests)
+    EntryStore.merge(user_id, dynamic_convert_api.get_author_name(items), entry_list, keep=HistoryDepth)
+    return len(entry_list)
+
+
+async def backfill_history(user_id: int, offset: str):
+    """
+    Page back through the space until the store holds HistoryDepth entries or the history ends.
+    Progress is saved after each page, an interrupted backfill continues where it stopped.
+    """
+    async with BackfillSlots:
+        saved_offset, exhausted = await run_in_threadpool(EntryStore.backfill_state, user_id)
+        offset = saved_offset or offset
+        while not exhausted and offset and await run_in_threadpool(EntryStore.count, user_id) < HistoryDepth:
+            page = await fetch_space_page(user_id, offset)
+            if page is None:
+                return  # try again on a later refresh
+            merged = await run_in_threadpool(merge_page, user_id, page.items)
+            offset, exhausted = page.offset, not page.has_more
+            await run_in_threadpool(EntryStore.set_backfill_state, user_id, offset, exhausted)
+            Logger.debug(f'Backfill dynamic, user id: {user_id}, merged: {merged}, exhausted: {exhausted}')
+
+
+def start_backfill(user_id: int, page: SpacePage):
+    if user_id in BackfillTasks or not page.has_more or not page.offset:
+        return
+    task = asyncio.create_task(backfill_history(user_id, page.offset))
+    BackfillTasks[user_id] = task
+    task.add_done_callback(lambda _: BackfillTasks.pop(user_id, None))
+
+
+async def generate_dynamic_feed(user_id: int) -> Iterable[str] | None:
+    page = await fetch_space_page(user_id)
+    if page is None:
+        return None
 
     Logger.debug(f'Get dynamic data done, start parse, user id: {user_id}')
-    feed = dynamic_convert_api.extract_dynamic(user_id, fetch_result.data)
-    content = feed.xml()
-    CacheProxy.set(key, content, ex=RSS_CONTENT_CACHE_TIME_S, lib=CacheLib.RUNTIME)
+    await run_in_threadpool(merge_page, user_id, page.items)
+    start_backfill(user_id, page)
+    author_name, fragment_list = await run_in_threadpool(EntryStore.latest, user_id, HistoryDepth)
+    return dynamic_convert_api.build_feed(user_id, author_name, fragment_list)
+
+
+@router.api_route("/dynamic/{user_id}", methods=["GET", "HEAD"])
+async def bili_dynamic(user_id: int, request: Request):
+    Logger.debug(f'Accept dynamic request, user id: {user_id}')
+
+    key = f'/rss/bilibili/dynamic/{user_id}'
+    response = await feed_response(
+        request,
+        FeedCache,
+        key,
+        lambda: generate_dynamic_feed(user_id),
+        soft_ttl=RSS_CONTENT_CACHE_TIME_S,
+        hard_ttl=RSS_CONTENT_STALE_TIME_S
+    )
+    if response.status_code in (200, 304):
+        Prefetcher.touch('bilibili.dynamic', user_id)
+    return response
+
+
+async def refresh_member(user_id: int) -> tuple[bool, str | None, list[tuple[str, str]]]:
+    """
+    Bring a member of a merged feed up to date through its own cached feed: a fresh copy is reused as it
+    is, otherwise it is regenerated (joining a refresh already in flight) and stored for its own readers too.
+    :return: whether the member is up to date, its author name and its latest entries
+    """
+    key = f'/rss/bilibili/dynamic/{user_id}'
+    async with MergeSlots:
+        meta = await FeedCache.get_meta(key)
+        ok = meta is not None and int(time.time()) < meta.fresh_until
+        if not ok:
+            ok = await FeedCache.refresh(
+                key,
+                lambda: generate_dynamic_feed(user_id),
+                soft_ttl=RSS_CONTENT_CACHE_TIME_S,
+                hard_ttl=RSS_CONTENT_STALE_TIME_S
+            ) is not None
+    # The entries stored before are still merged in when the refresh failed.
+    author_name, fragment_list = await run_in_threadpool(EntryStore.latest, user_id, HistoryDepth)
+    return ok, author_name, fragment_list
+
+
+async def generate_merged_feed(query: str) -> Iterable[str] | None:
+    """
+    :param query: uids=1,2,3 or group=name
+    """
+    params = dict(parse_qsl(query))
+    if 'group' in params:
+        # Deduplicated like uids, a member listed twice would have every entry merged in twice.
+        user_ids = sorted(set(DynamicGroups.get(params['group']) or []))
+        if not user_ids:
+            Logger.warning(f'Dynamic group not found, query: {query}')
+            return None
+    else:
+        user_ids = [int(e) for e in params['uids'].split(',')]
+
+    results = await asyncio.gather(*[refresh_member(user_id) for user_id in user_ids])
+    if not any(ok for ok, _, _ in results):
+        return None
+    author_names = [f'用户{user_id}' if author_name is None else author_name for user_id, (_, author_name, _) in zip(user_ids, results)]
+    if 'group' in params:
+        title = f'{params["group"]}分组的动态'
+    else:
+        title = f'{"、".join(author_names[:3])}{"等" if len(author_names) > 3 else ""}的动态'
+    return dynamic_convert_api.build_merged_feed(query, title, author_names, [fragment_list for _, _, fragment_list in results], HistoryDepth)
+
+
+def merged_query(uids: str | None, group: str | None) -> str:
+    if group is not None:
+        if group not in DynamicGroups:
+            raise HTTPException(status_code=404, detail="Group not found.")
+        return urlencode({'group': group})
+    try:
+        user_ids = sorted({int(e) for e in (uids or '').split(',') if e.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="uids must be comma separated user ids.")
+    if not user_ids:
+        raise HTTPException(status_code=400, detail="uids or group is required.")
+    if len(user_ids) > MergeMaxUsers:
+        raise HTTPException(status_code=400, detail=f"At most {MergeMaxUsers} users in one feed.")
+    # Sorted and deduplicated, every spelling of the same set shares one cached feed.
+    return urlencode({'uids': ','.join(map(str, user_ids))}, safe=',')
+
+
+@router.api_route("/dynamic", methods=["GET", "HEAD"])
+async def bili_merged_dynamic(request: Request, uids: str | None = None, group: str | None = None):
+    query = merged_query(uids, group)
+    Logger.debug(f'Accept merged dynamic request, {query}')
+
+    response = await feed_response(
+        request,
+        FeedCache,
+        f'/rss/bilibili/dynamic?{query}',
+        lambda: generate_merged_feed(query),
+        soft_ttl=RSS_CONTENT_CACHE_TIME_S,
+        hard_ttl=RSS_CONTENT_STALE_TIME_S
+    )
+    if response.status_code in (200, 304):
+        Prefetcher.touch('bilibili.dynamic_merged', query)
+    return response
+
+
+Prefetcher.register_source(FeedSource(
+    name='bilibili.dynamic',
+    key=lambda arg: f'/rss/bilibili/dynamic/{arg}',
+    generate=lambda arg: generate_dynamic_feed(int(arg)),
+    soft_ttl=RSS_CONTENT_CACHE_TIME_S,
+    hard_ttl=RSS_CONTENT_STALE_TIME_S,
+))
+
 
-    Logger.debug(f'Return dynamic data, user id: {user_id}')
-    return Response(content=content, media_type="application/xml")
+Prefetcher.register_source(FeedSource(
+    name='bilibili.dynamic_merged',
+    key=lambda arg: f'/rss/bilibili/dynamic?{arg}',
+    generate=generate_merged_feed,
+    soft_ttl=RSS_CONTENT_CACHE_TIME_S,
+    hard_ttl=RSS_CONTENT_STALE_TIME_S,
+))
@@ -1,6 +1,10 @@
+import time
+import urllib.parse
 from logging import Logger
 
-from init import AbsCacheProxy
+from init import AbsCacheProxy, get_env_setting, get_rate_limiter, get_circuit_breaker
+from rate_limiter import RateLimiter, RateLimitExceeded, HostPolicy
+from resilience import RetryPolicy
 from pixivpy3 import AppPixivAPI, PixivError
 
 _AApi: AppPixivAPI | None = None
@@ -10,6 +14,45 @@ class FetchError(Exception):
     pass
 
 
+def pixiv_risk_control(status_code: int, body: bytes | None) -> bool:
+    return status_code == 429 or (status_code == 403 and body is not None and b'Rate Limit' in body)
+
+
+_RateLimiter = get_rate_limiter()
+for _host in ('app-api.pixiv.net', 'oauth.secure.pixiv.net'):
+    _RateLimiter.configure(_host, HostPolicy(
+        rate=get_env_setting().pixiv_rate_per_s,
+        burst=2,
+        max_concurrency=get_env_setting().pixiv_max_concurrency,
+        risk_control=pixiv_risk_control,
+    ))
+_RateLimiter.configure('i.pximg.net', HostPolicy(rate=10, burst=10, max_concurrency=8))
+PixivRetry = RetryPolicy(attempts=3, base_delay_s=1, max_delay_s=8)
+PixivBreaker = get_circuit_breaker('pixiv')
+
+
+class LimitedAppPixivAPI(AppPixivAPI):
+    """
+    AppPixivAPI with every request, including auth and image downloads, going through the rate limiter.
+    """
+
+    def __init__(self, limiter: RateLimiter, **requests_kwargs):
+        super().__init__(**requests_kwargs)
+        self.limiter = limiter
+
+    def requests_call(self, method, url, headers=None, params=None, data=None, stream=False):
+        host = urllib.parse.urlsplit(url).hostname
+        try:
+            with self.limiter.limit_sync(host):
+                response = super().requests_call(method, url, headers=headers, params=params, data=data, stream=stream)
+        except RateLimitExceeded as e:
+            # Failed like a network error, so callers' retry and circuit handling applies.
+            raise PixivError(f'{host}: {e}') from e
+        # Streamed downloads are judged by status only, reading them here would buffer the whole image.
+        self.limiter.report(host, response.status_code, None if stream else response.content)
+        return response
+
+
 def update_aapi(logger: Logger, cache_proxy: AbsCacheProxy) -> AppPixivAPI | None:
 
     refresh_token = cache_proxy.get('pixiv_refresh_token')
@@ -24,11 +67,13 @@ def update_aapi(logger: Logger, cache_proxy: AbsCacheProxy) -> AppPixivAPI | Non
 
     logger.info(f'Start login to pixiv')
     # api = AppPixivAPI(proxies={'http': 'http://127.0.0.1:10809', 'https': 'http://127.0.0.1:10809'})
-    api = AppPixivAPI()
+    api = LimitedAppPixivAPI(_RateLimiter)
     try:
         api.auth(refresh_token=refresh_token.decode())
     except PixivError:
+        PixivBreaker.record_failure()
         return None
+    PixivBreaker.record_success()
     global _AApi
     _AApi = api
     logger.info('Successfully login to pixiv.')
@@ -37,3 +82,42 @@ def update_aapi(logger: Logger, cache_proxy: AbsCacheProxy) -> AppPixivAPI | Non
 
 def get_aapi():
     return _AApi
+
+
+def call_api(logger: Logger, cache_proxy: AbsCacheProxy, api: AppPixivAPI, method: str, arg, expect: str) -> tuple[AppPixivAPI, dict]:
+    """
+    Call an AppPixivAPI method behind the pixiv circuit breaker, retrying network errors with jitter.
+    Logs in again, once, only when the answer says the access token is no longer valid.
+    :param expect: field a successful answer has
+    :return: the api that answered (a new one after logging in again) and the answer
+    """
+    if not PixivBreaker.allow():
+        raise FetchError(f'circuit {PixivBreaker.name} open')
+    logged_in_again = False
+    attempt = 0
+    while True:
+        try:
+            jresp = getattr(api, method)(arg)
+        except PixivError as e:
+            attempt += 1
+            if attempt >= PixivRetry.attempts:
+                PixivBreaker.record_failure()
+                raise FetchError(f'{method}({arg}) failed after {attempt} attempts: {e}') from e
+            time.sleep(PixivRetry.delay(attempt - 1))
+            continue
+
+        if expect in jresp:
+            PixivBreaker.record_success()
+            return api, jresp
+        error = str(jresp.get('error', jresp))
+        if 'OAuth' in error and not logged_in_again:
+            logged_in_again = True
+            api = update_aapi(logger, cache_proxy)
+            if api is None:
+                raise FetchError('Update PixivAppApi failed.')
+            continue
+        if 'Rate Limit' in error:
+            PixivBreaker.record_failure()
+        else:  # pixiv answered, the item itself is unavailable
+            PixivBreaker.record_success()
+        raise FetchError(f'{method}({arg}) failed: {error}')
@@ -1,26 +1,47 @@
+import os
 import re
-from io import BytesIO
-from datetime import datetime
-from contextlib import asynccontextmanager, closing
-
-from init import get_router, get_cache_proxy, get_logger
+from typing import Iterable
+from contextlib import asynccontextmanager
 
 from cache_proxy import CacheLib
-from fastapi import APIRouter, Response, HTTPException, Depends
-from fastapi.responses import RedirectResponse
+from init import get_router, get_cache_proxy, get_blob_store, get_feed_cache, get_prefetcher, get_logger
+
+from fastapi import APIRouter, Request, Response, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse, FileResponse
+from blob_store import BlobInfo
 from . import novel
-from .base import get_aapi, update_aapi, FetchError
-from rss_model import AtomFeed
+from .base import get_aapi, update_aapi, FetchError, PixivBreaker
+from rss_model import iter_feed, latest_updated
+from feed_cache import feed_response
+from prefetch import FeedSource
 
 
 RSS_CONTENT_CACHE_TIME_S = int(60 * 5)  # todo: read setting instead hard coding
+RSS_CONTENT_STALE_TIME_S = int(60 * 60 * 24)  # serve the last good feed this long when upstream fails
 CacheProxy = get_cache_proxy()
+BlobStore = get_blob_store()
+FeedCache = get_feed_cache()
+Prefetcher = get_prefetcher()
 Logger = get_logger('pixiv')
 
 
+LEGACY_IMAGE_PREFIX = '/rss/pixiv/img_proxy/'  # images were kept in the runtime lib without expiry before the blob store
+LEGACY_IMAGE_PURGED_KEY = '[Migration]pixiv_img_proxy_purged'
+
+
+def purge_legacy_images():
+    if CacheProxy.get(LEGACY_IMAGE_PURGED_KEY, lib=CacheLib.RUNTIME) is not None:
+        return
+    removed = CacheProxy.delete_prefix(LEGACY_IMAGE_PREFIX, lib=CacheLib.RUNTIME)
+    CacheProxy.set(LEGACY_IMAGE_PURGED_KEY, '1', lib=CacheLib.RUNTIME)
+    Logger.info(f'Purged {removed} proxied images of the old layout from the cache, they are downloaded again on request.')
+
+
 @asynccontextmanager
 async def lifespan(_app: APIRouter):
     update_aapi(Logger, CacheProxy)
+    await run_in_threadpool(purge_legacy_images)
     yield
 
 
@@ -30,6 +51,8 @@ def check_init():
         refresh_token = CacheProxy.get('pixiv_refresh_token')
         if refresh_token is None or refresh_token == b'':
             raise HTTPException(status_code=400, detail="Not login.")
+        elif not PixivBreaker.allow():
+            raise HTTPException(status_code=503, detail="Pixiv unavailable, login paused.")
         else:
             aapi = update_aapi(Logger, CacheProxy)
             if aapi is None:
@@ -43,6 +66,18 @@ def check_init():
 router = get_router('pixiv', lifespan=lifespan, dependencies=[Depends(check_init)])
 
 
+def download_image(key: str, real_path: str, media_type: str) -> BlobInfo:
+    # Download straight into a file inside the blob store, the image never has to sit in memory.
+    with BlobStore.new_temp_file() as fn:
+        try:
+            get_aapi().download(real_path, fname=fn)
+        except BaseException:
+            fn.close()
+            os.remove(fn.name)
+            raise
+    return BlobStore.put_file(key, fn.name, media_type)
+
+
 @router.get("/img_proxy/{full_path:path}")
 async def image_proxy(full_path: str):
     img_type = re.findall(r'\.(jpg|png|jpeg|wbep).*$', full_path)
@@ -51,19 +86,14 @@ async def image_proxy(full_path: str):
     img_type = img_type[0]
 
     key = f'/rss/pixiv/img_proxy/{full_path}'
-    cache = CacheProxy.get(key)
-    if cache is not None:
+    blob = await run_in_threadpool(BlobStore.get, key)
+    if blob is not None:
         Logger.debug(f'Return cache to request, key: {key}')
-        return Response(content=cache, media_type=f"image/{img_type}")
+        return FileResponse(blob.path, media_type=blob.media_type)
 
     real_path = full_path.replace('https---', 'https://').replace('http---', 'http://')
-    bio: BytesIO
-    with closing(BytesIO()) as bio:
-        get_aapi().download(real_path, fname=bio)
-        bio.seek(0)
-        bc = bio.getvalue()
-    CacheProxy.set(key, bc, lib=CacheLib.RUNTIME)
-    return Response(content=bc, media_type=f"image/{img_type}")
+    blob = await run_in_threadpool(download_image, key, real_path, f"image/{img_type}")
+    return FileResponse(blob.path, media_type=blob.media_type)
 
 
 @router.get('/novel_redirect/{novel_id}')
@@ -71,32 +101,49 @@ async def novel_redirect(novel_id: str):
     return RedirectResponse(url=f'https://www.pixiv.net/novel/show.php?id={novel_id}')
 
 
-@router.get("/user_novels/{user_id}")
-async def user_novels(user_id: int):
-    Logger.debug(f'Accept user_novels request, user id: {user_id}')
-
-    key = f'/rss/pixiv/user_novels/{user_id}'
-    cache = CacheProxy.get(key)
-    if cache is not None:
-        Logger.debug(f'Return cache to request, key: {key}')
-        return Response(content=cache.decode('utf-8'), media_type="application/xml")
-
+async def generate_user_novels_feed(user_id: int) -> Iterable[str] | None:
     try:
-        author_name, entry_list = novel.user_novels(get_aapi(), user_id, CacheProxy)
-    except FetchError:
-        return HTTPException(status_code=500, detail="Fetch failed, maybe token expired or network error.")
+        # pixivpy is a blocking client, keep it off the event loop.
+        author_name, entry_list = await run_in_threadpool(novel.user_novels, get_aapi(), user_id, CacheProxy)
+    except FetchError as e:
+        Logger.warning(f'Fetch user novels failed, user id: {user_id}, {e}')
+        return None
 
     Logger.debug(f'Fetch user novel data done, user id: {user_id}')
 
-    feed = AtomFeed(
+    # Rendered entry by entry while it is sent and stored, a novel feed can be many MB.
+    return iter_feed(
         title=f'{author_name}的 Pixiv 小说列表',
         link=f'/rss/pixiv/user_novels/{user_id}',
-        updated=datetime.now().strftime('%Y-%m-%dT%H:%M:%S+08:00'),
+        updated=latest_updated(entry_list),
         authors=[author_name],
         fid=f'brss/pixiv/user_novels/{user_id}',
-        entry_list=entry_list
+        entry_xml_iter=(e.xml() for e in entry_list)
     )
-    CacheProxy.set(key, feed.xml(), ex=RSS_CONTENT_CACHE_TIME_S, lib=CacheLib.RUNTIME)
 
-    Logger.debug(f"Return pixiv user's novel data, user id: {user_id}")
-    return Response(content=feed.xml(), media_type="application/xml")
+
+@router.api_route("/user_novels/{user_id}", methods=["GET", "HEAD"])
+async def user_novels(user_id: int, request: Request):
+    Logger.debug(f'Accept user_novels request, user id: {user_id}')
+
+    key = f'/rss/pixiv/user_novels/{user_id}'
+    response = await feed_response(
+        request,
+        FeedCache,
+        key,
+        lambda: generate_user_novels_feed(user_id),
+        soft_ttl=RSS_CONTENT_CACHE_TIME_S,
+        hard_ttl=RSS_CONTENT_STALE_TIME_S
+    )
+    if response.status_code in (200, 304):
+        Prefetcher.touch('pixiv.user_novels', user_id)
+    return response
+
+
+Prefetcher.register_source(FeedSource(
+    name='pixiv.user_novels',
+    key=lambda arg: f'/rss/pixiv/user_novels/{arg}',
+    generate=lambda arg: generate_user_novels_feed(int(arg)),
+    soft_ttl=RSS_CONTENT_CACHE_TIME_S,
+    hard_ttl=RSS_CONTENT_STALE_TIME_S,
+))
@@ -4,7 +4,7 @@ from pixivpy3 import AppPixivAPI
 from rss_model import *
 from cache_proxy import CacheLib
 from init import AbsCacheProxy, get_logger
-from .base import update_aapi, FetchError
+from .base import call_api
 
 
 Logger = get_logger('pixiv')
@@ -16,26 +16,13 @@ def to_proxy_url(ori: str):
     return xx
 
 
-def user_novels(api: AppPixivAPI, user_id: int, cache_proxy: AbsCacheProxy) -> tuple[str, list[AtomEntry]]:
-    jresp = api.user_novels(user_id)
-
-    # todo: 手动重试太不优雅了，之后想个法子改了。
-    if 'user' not in jresp:
-        api = update_aapi(Logger, cache_proxy)
-        if api is None:
-            Logger.debug(f'Update PixivAppApi failed.')
-            raise FetchError
-
-        jresp = api.user_novels(user_id)
-
-        if 'user' not in jresp:
-            Logger.debug(f"Fetch user's novel failed. User id: {user_id}")
-            raise FetchError
+def user_novels(api: AppPixivAPI, user_id: int, cache_proxy: AbsCacheProxy) -> tuple[str, list[LiteAtomEntry]]:
+    api, jresp = call_api(Logger, cache_proxy, api, 'user_novels', user_id, expect='user')
 
     author_name: str = jresp['user']['name']
     Logger.info(f'Fetch user novels done, user id: {user_id}')
 
-    ret: list[AtomEntry] = []
+    ret: list[LiteAtomEntry] = []
     for n in jresp['novels']:
         novel_id = n['id']
         # series_id = n['series'].get('id', -1)
@@ -47,47 +34,36 @@ def user_novels(api: AppPixivAPI, user_id: int, cache_proxy: AbsCacheProxy) -> t
         pulib_time_str = n['create_date']  # 2024-12-02T01:17:58+09:00
 
         novel_content_cache_key = f'[Pixiv][NovelId][{novel_id}]'
-        content = cache_proxy.get(novel_content_cache_key)
+        content = cache_proxy.get(novel_content_cache_key, lib=CacheLib.RUNTIME)
         if content is not None:
             content_str = content.decode()
         else:
             content_str = novel_content(cache_proxy, api, novel_id)
             cache_proxy.set(novel_content_cache_key, content_str, lib=CacheLib.RUNTIME)
 
+        # Rendered straight to html, a novel has thousands of lines.
         media_list = []
         if cover != '':
-            media_list.append(Image(src=to_proxy_url(cover)))
-        media_list.append(Text(text=f'Tags: ' + ' '.join(tags)))
+            media_list.append(image_html(to_proxy_url(cover)))
+        media_list.append(text_html(f'Tags: ' + ' '.join(tags)))
         media_list.extend(
-            [Text(text=line) for line in content_str.split('\n')]
+            [text_html(line) for line in content_str.split('\n')]
         )
 
-        ret.append(AtomEntry(
+        ret.append(LiteAtomEntry(
             title=f'{author_name} 更新了小说: {title}',
             link=f'/rss/pixiv/novel_redirect/{novel_id}',
             eid=str(novel_id),
             updated=pulib_time_str,
             summary=summary,
-            content=''.join([e.html() for e in media_list])
+            content=''.join(media_list)
         ))
 
     return author_name, ret
 
 
 def novel_content(cache_proxy: AbsCacheProxy, api: AppPixivAPI, novel_id: str) -> str:
-    jresp2 = api.webview_novel(novel_id)
-
-    if 'text' not in jresp2:
-        api = update_aapi(Logger, cache_proxy)
-        if api is None:
-            Logger.debug(f'Update PixivAppApi failed.')
-            raise FetchError
-
-        jresp2 = api.webview_novel(novel_id)
-
-        if 'text' not in jresp2:
-            Logger.debug(f"Fetch novel content failed. Novel id: {novel_id}")
-            raise FetchError
+    api, jresp2 = call_api(Logger, cache_proxy, api, 'webview_novel', novel_id, expect='text')
 
     Logger.info(f'Fetch novel done, novel id: {novel_id}')
 
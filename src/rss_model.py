@@ -1,7 +1,38 @@
+from datetime import datetime
+from typing import Iterable, Iterator
 from xml.sax.saxutils import escape as xml_escape
 from pydantic import BaseModel, Field
 
 
+def text_html(text: str, bold: bool = False) -> str:
+    if bold:
+        return f'<p><b>{text}</b></p>'
+    return f'<p>{text}</p>'
+
+
+def image_html(src: str) -> str:
+    return f'<img src="{src}"/>'
+
+
+def video_html(title: str, desc: str, cover: str) -> str:
+    return f"""<p>投稿了视频</p>
+<p><b>{xml_escape(title)}</b></p>
+<p>{xml_escape(desc)}</p>
+<p>视频暂不支持直接播放。</p>
+<img src="{xml_escape(cover)}"/>"""
+
+
+def entry_xml(title: str, link: str, eid: str, updated: str, summary: str, content: str) -> str:
+    return f"""<entry>
+    <title>{xml_escape(title)}</title>
+    <link href="{xml_escape(link)}"/>
+    <id>https://t.bilibili.com/{xml_escape(eid)}</id>
+    <updated>{xml_escape(updated)}</updated>
+    <summary>{xml_escape(summary)}</summary>
+    <content type="html"><![CDATA[{content}]]></content>
+</entry>"""
+
+
 class Media(BaseModel):
     def html(self) -> str:
         pass
@@ -12,17 +43,14 @@ class Text(Media):
     bold: bool = Field(False, description="是否需要加粗文本")
 
     def html(self):
-        content = self.text
-        if self.bold:
-            content = f'<b>{content}</b>'
-        return f"<p>{content}</p>"
+        return text_html(self.text, self.bold)
 
 
 class Image(Media):
     src: str
 
     def html(self):
-        return f'<img src="{self.src}"/>'
+        return image_html(self.src)
 
 
 class Video(Media):
@@ -35,13 +63,7 @@ class Video(Media):
     title: str
 
     def html(self):
-        return f"""
-<p>投稿了视频</p>
-<p><b>{xml_escape(self.title)}</b></p>
-<p>{xml_escape(self.desc)}</p>
-<p>视频暂不支持直接播放。</p>
-<img src="{xml_escape(self.cover)}"/>
-""".strip()
+        return video_html(self.title, self.desc, self.cover)
 
 
 class AtomEntry(BaseModel):
@@ -53,16 +75,30 @@ class AtomEntry(BaseModel):
     content: str = Field(..., description='full content')
 
     def xml(self):
-        return f"""
-<entry>
-    <title>{xml_escape(self.title)}</title>
-    <link href="{xml_escape(self.link)}"/>
-    <id>https://t.bilibili.com/{xml_escape(self.eid)}</id>
-    <updated>{xml_escape(self.updated)}</updated>
-    <summary>{xml_escape(self.summary)}</summary>
-    <content type="html"><![CDATA[{self.content}]]></content>
-</entry>
-""".strip()
+        return entry_xml(self.title, self.link, self.eid, self.updated, self.summary, self.content)
+
+
+class LiteAtomEntry:
+    """
+    AtomEntry without validation, for the render path: extractors build one per item and render it
+    once. Renders the same bytes as the AtomEntry with the same fields.
+    """
+
+    __slots__ = ('title', 'link', 'eid', 'updated', 'summary', 'content')
+
+    def __init__(self, title: str, link: str, eid: str, updated: str, summary: str, content: str):
+        self.title = title
+        self.link = link
+        self.eid = eid
+        self.updated = updated
+        self.summary = summary
+        self.content = content
+
+    def xml(self) -> str:
+        return entry_xml(self.title, self.link, self.eid, self.updated, self.summary, self.content)
+
+    def model(self) -> AtomEntry:
+        return AtomEntry(title=self.title, link=self.link, eid=self.eid, updated=self.updated, summary=self.summary, content=self.content)
 
 
 class AtomFeed(BaseModel):
@@ -74,16 +110,42 @@ class AtomFeed(BaseModel):
     entry_list: list[AtomEntry]
 
     def xml(self):
-        authors = '\n'.join([f'<name>{n}</name>' for n in self.authors])
-        entry_list = '\n'.join([e.xml() for e in self.entry_list])
-        return f"""
-<?xml version="1.0" encoding="UTF-8"?>
+        return ''.join(self.iter_xml())
+
+    def iter_xml(self) -> Iterator[str]:
+        return iter_feed(self.title, self.link, self.updated, self.authors, self.fid, (e.xml() for e in self.entry_list))
+
+
+def iter_feed(title: str, link: str, updated: str, authors: list[str], fid: str, entry_xml_iter: Iterable[str]) -> Iterator[str]:
+    """
+    The feed document around already rendered <entry> fragments, piece by piece: the header, each
+    entry, the footer. Only one entry is rendered at a time when entry_xml_iter is lazy.
+    """
+    authors = '\n'.join([f'<name>{n}</name>' for n in authors])
+    yield f"""<?xml version="1.0" encoding="UTF-8"?>
 <feed xmlns="http://www.w3.org/2005/Atom">
-  <title>{xml_escape(self.title)}</title>
-  <link href="{xml_escape(self.link)}" />
-  <updated>{xml_escape(self.updated)}</updated>
+  <title>{xml_escape(title)}</title>
+  <link href="{xml_escape(link)}" />
+  <updated>{xml_escape(updated)}</updated>
   <author>{xml_escape(authors)}</author>
-  <id>{xml_escape(self.fid)}</id>
-  {entry_list}
-</feed>
-""".strip()
+  <id>{xml_escape(fid)}</id>
+  """
+    for i, entry_xml in enumerate(entry_xml_iter):
+        if i > 0:
+            yield '\n'
+        yield entry_xml
+    yield '\n</feed>'
+
+
+def latest_updated(entry_list: list[AtomEntry] | list[LiteAtomEntry]) -> str:
+    """
+    Feed level <updated>: the newest entry's time, so regenerating an unchanged feed yields the same document.
+    Falls back to now when there is no entry.
+    """
+    return latest_time([e.updated for e in entry_list])
+
+
+def latest_time(updated_list: list[str]) -> str:
+    if not updated_list:
+        return datetime.now().strftime('%Y-%m-%dT%H:%M:%S+08:00')
+    return max(updated_list, key=datetime.fromisoformat)
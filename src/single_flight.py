@@ -0,0 +1,92 @@
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+from cache_proxy import AbsAsyncCacheProxy, CacheLib
+
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key: the first caller runs the function, everyone else
+    arriving before it finishes awaits the same task and gets the same result (or exception).
+
+    With a cache_proxy the coalescing also spans processes sharing that backend: the leader takes a
+    short-lived lock key, the leaders of other processes poll `recheck` until the result shows up in
+    the cache, and only run the function themselves when it doesn't show up within lock_ttl seconds or
+    the lock is released without it.
+    """
+
+    def __init__(self, cache_proxy: AbsAsyncCacheProxy | None = None, lock_ttl: int = 10, poll_interval: float = 0.2):
+        self.cache_proxy = cache_proxy
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.calls: dict[str, asyncio.Task] = dict()
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]], recheck: Callable[[], Awaitable[T | None]] | None = None) -> T:
+        task, _ = self.start(key, func, recheck)
+        # A cancelled caller (client went away) must not cancel the fetch other callers are waiting on.
+        return await asyncio.shield(task)
+
+    def start(self, key: str, func: Callable[[], Awaitable[T]], recheck: Callable[[], Awaitable[T | None]] | None = None) -> tuple[asyncio.Task, bool]:
+        """
+        Join or start the call without awaiting it.
+        :return: the task of the call, and whether this caller started it (its func is the one that runs)
+        """
+        task = self.calls.get(key)
+        if task is not None:
+            return task, False
+        task = asyncio.create_task(self._lead(key, func, recheck))
+        task.add_done_callback(self._retrieve)
+        self.calls[key] = task
+        return task, True
+
+    async def _lead(self, key: str, func: Callable[[], Awaitable[T]], recheck: Callable[[], Awaitable[T | None]] | None) -> T:
+        lock_key = f'[SingleFlight]{key}'
+        token = os.urandom(16)  # tells this holder's lock apart from one another process took after it expired
+        acquired = False
+        acquired_at = 0.0
+        try:
+            if self.cache_proxy is not None and recheck is not None:
+                acquired_at = time.monotonic()
+                acquired = await self.cache_proxy.add(lock_key, token, ex=self.lock_ttl, lib=CacheLib.RUNTIME)
+                if not acquired:
+                    deadline = time.monotonic() + self.lock_ttl
+                    while time.monotonic() < deadline:
+                        await asyncio.sleep(self.poll_interval)
+                        result = await recheck()
+                        if result is not None:
+                            return result
+                        # Released without a result (the other leader failed), take over.
+                        acquired_at = time.monotonic()
+                        acquired = await self.cache_proxy.add(lock_key, token, ex=self.lock_ttl, lib=CacheLib.RUNTIME)
+                        if acquired:
+                            break
+            return await func()
+        finally:
+            del self.calls[key]
+            if acquired:
+                await self._release(lock_key, token, acquired_at)
+
+    async def _release(self, lock_key: str, token: bytes, acquired_at: float):
+        """
+        Released as soon as the call completes, after a failure another process takes over at its next poll
+        instead of waiting out lock_ttl. A lock that expired meanwhile may belong to another process now and is
+        left alone; the margin keeps it from expiring and being taken between the check and the delete.
+        """
+        if time.monotonic() - acquired_at >= self.lock_ttl - self.poll_interval:
+            return
+        if await self.cache_proxy.get(lock_key, lib=CacheLib.RUNTIME) == token:
+            await self.cache_proxy.delete([lock_key], lib=CacheLib.RUNTIME)
+
+    @staticmethod
+    def _retrieve(task: asyncio.Task):
+        # Mark the exception as retrieved when every waiter was cancelled, avoids "exception was never retrieved".
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self.calls)
@@ -0,0 +1,53 @@
+import os
+
+from blob_store import BlobStore
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=1024)
+    first = store.put('a', b'x' * 100, 'image/png')
+    second = store.put('b', b'x' * 100, 'image/png')
+    assert first.path == second.path
+    assert store.stats() == {'keys': 2, 'bytes': 100, 'max_bytes': 1024}
+    with open(store.get('b').path, 'rb') as fn:
+        assert fn.read() == b'x' * 100
+
+
+def test_least_recently_used_keys_are_evicted(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=250)
+    old = store.put('old', b'a' * 100, 'image/png')
+    store.put('mid', b'b' * 100, 'image/png')
+    store.put('new', b'c' * 100, 'image/png')
+    assert store.get('old') is None
+    assert not os.path.exists(old.path)
+    assert store.get('mid') is not None and store.get('new') is not None
+    assert store.stats()['bytes'] == 200
+
+
+def test_replacing_a_key_drops_its_old_content(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=1024)
+    old = store.put('a', b'a' * 100, 'image/png')
+    store.put('a', b'b' * 50, 'image/png')
+    assert not os.path.exists(old.path)
+    assert store.stats() == {'keys': 1, 'bytes': 50, 'max_bytes': 1024}
+
+
+def test_missing_file_is_forgotten_with_its_size(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=1024)
+    info = store.put('a', b'a' * 100, 'image/png')
+    store.put('b', b'b' * 60, 'image/png')
+    os.remove(info.path)
+    assert store.get('a') is None
+    assert store.stats() == {'keys': 1, 'bytes': 60, 'max_bytes': 1024}
+    # Stored again, counted once.
+    store.put('a', b'a' * 100, 'image/png')
+    assert store.stats()['bytes'] == 160
+
+
+def test_total_size_survives_a_restart(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=1024)
+    store.put('a', b'a' * 100, 'image/png')
+    store.put('b', b'a' * 100, 'image/png')
+    store.put('c', b'c' * 30, 'image/png')
+    store.close()
+    assert BlobStore(str(tmp_path), max_bytes=1024).stats()['bytes'] == 130
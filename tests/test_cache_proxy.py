@@ -0,0 +1,213 @@
+import sqlite3
+
+import pytest
+
+import cache_proxy as cache_proxy_module
+from cache_proxy import CacheLib, LRUTier, MemoryCacheProxy, MemoryStore, SQLiteCacheProxy, TieredCacheProxy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(cache_proxy_module.time, 'time', fake.time)
+    return fake
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'tiered'])
+def cache_proxy(request, tmp_path):
+    if request.param == 'memory':
+        proxy = MemoryCacheProxy()
+    elif request.param == 'sqlite':
+        proxy = SQLiteCacheProxy(str(tmp_path / 'cache.db'))
+    else:
+        proxy = TieredCacheProxy(SQLiteCacheProxy(str(tmp_path / 'cache.db')), LRUTier())
+    yield proxy
+    backend = getattr(proxy, 'backend', proxy)
+    if hasattr(backend, 'close'):
+        backend.close()
+
+
+def test_memory_store_evicts_least_recently_used(clock):
+    store = MemoryStore(max_bytes=10)
+    store.set('a', b'aaaa', None)
+    store.set('b', b'bbbb', None)
+    store.get('a')
+    store.set('c', b'cccc', None)
+    assert store.get('b') == (None, None)
+    assert store.get('a') == (b'aaaa', None)
+    assert store.size == 8
+
+
+def test_memory_store_skips_values_larger_than_the_store(clock):
+    store = MemoryStore(max_bytes=10)
+    store.set('a', b'aaaa', None)
+    store.set('a', b'x' * 11, None)
+    assert store.get('a') == (None, None)
+    assert store.size == 0
+
+
+def test_memory_store_sweeps_expired_entries(clock):
+    store = MemoryStore(max_bytes=100)
+    store.set('short', b'1', 10)
+    store.set('long', b'22', 100)
+    store.set('short', b'333', 50)  # overwritten, its first deadline must not drop it
+    clock.now += 20
+    assert store.sweep(int(clock.now)) == (0, 0)
+    clock.now += 40
+    assert store.sweep(int(clock.now)) == (1, 3)
+    assert store.get('short') == (None, None)
+    assert store.get('long') == (b'22', int(clock.now) - 60 + 100)
+
+
+def test_lru_tier_bounds_staleness_by_max_ttl(clock):
+    tier = LRUTier(max_ttl=60)
+    tier.put('a', b'1', None, CacheLib.CONFIG)
+    tier.put('b', b'2', int(clock.now) + 10, CacheLib.CONFIG)
+    clock.now += 30
+    assert tier.get('a', CacheLib.CONFIG) == (b'1', None)
+    assert tier.get('b', CacheLib.CONFIG) == (None, None)
+    clock.now += 30
+    assert tier.get('a', CacheLib.CONFIG) == (None, None)
+
+
+def test_lru_tier_drops_a_fill_older_than_a_write(clock):
+    tier = LRUTier()
+    generation = tier.generation
+    tier.invalidate('a', CacheLib.CONFIG)  # a write lands while the fill was read from the backend
+    tier.fill('a', b'old', None, CacheLib.CONFIG, generation)
+    assert tier.get('a', CacheLib.CONFIG) == (None, None)
+    tier.fill('a', b'new', None, CacheLib.CONFIG, tier.generation)
+    assert tier.get('a', CacheLib.CONFIG) == (b'new', None)
+
+
+def test_lru_tier_size_limits(clock):
+    tier = LRUTier(max_bytes=10, max_item_bytes=6)
+    tier.put('big', b'x' * 7, None, CacheLib.CONFIG)
+    tier.put('a', b'a' * 6, None, CacheLib.CONFIG)
+    tier.put('b', b'b' * 6, None, CacheLib.CONFIG)
+    assert tier.get('big', CacheLib.CONFIG) == (None, None)
+    assert tier.get('a', CacheLib.CONFIG) == (None, None)
+    assert tier.get('b', CacheLib.CONFIG) == (b'b' * 6, None)
+    assert tier.stats()['bytes'] == 6
+
+
+def test_lru_tier_invalidate_prefix_keeps_other_libs(clock):
+    tier = LRUTier()
+    tier.put('[Old]a', b'1', None, CacheLib.RUNTIME)
+    tier.put('[Old]a', b'2', None, CacheLib.CONFIG)
+    tier.put('[New]a', b'3', None, CacheLib.RUNTIME)
+    tier.invalidate_prefix('[Old]', CacheLib.RUNTIME)
+    assert tier.get('[Old]a', CacheLib.RUNTIME) == (None, None)
+    assert tier.get('[Old]a', CacheLib.CONFIG) == (b'2', None)
+    assert tier.get('[New]a', CacheLib.RUNTIME) == (b'3', None)
+
+
+def test_tiered_proxy_reads_through_and_writes_through(tmp_path):
+    backend = MemoryCacheProxy()
+    proxy = TieredCacheProxy(backend, LRUTier())
+    backend.set('a', b'1')
+    assert proxy.get('a') == b'1'
+    assert proxy.get('a') == b'1'
+    assert (proxy.backend_hits, proxy.tier.hits) == (1, 1)
+    proxy.set('a', b'2')
+    assert backend.get('a') == b'2'
+    assert proxy.get('a') == b'2'
+    proxy.delete(['a'])
+    assert backend.get('a') is None and proxy.get('a') is None
+
+
+def test_tiered_proxy_add_does_not_serve_a_stale_copy():
+    backend = MemoryCacheProxy()
+    proxy = TieredCacheProxy(backend, LRUTier())
+    proxy.set('lock', b'mine', ex=10)
+    backend.delete(['lock'])  # expired or released by another process
+    assert proxy.add('lock', b'other', ex=10)
+    assert proxy.get('lock') == b'other'
+
+
+def test_set_get_many_keep_order_and_libs(cache_proxy):
+    cache_proxy.set_many({'a': 'x', 'b': b'y'})
+    cache_proxy.set('a', b'runtime', lib=CacheLib.RUNTIME)
+    assert cache_proxy.get_many(['b', 'missing', 'a']) == [b'y', None, b'x']
+    assert cache_proxy.get('a', lib=CacheLib.RUNTIME) == b'runtime'
+    assert cache_proxy.get_many([]) == []
+
+
+def test_set_many_applies_the_expiry_to_every_value(cache_proxy, clock):
+    cache_proxy.set_many({'a': b'1', 'b': b'2'}, ex=10)
+    expire_at = int(clock.now) + 10
+    assert cache_proxy.get_many_with_expire_at(['a', 'b']) == [(b'1', expire_at), (b'2', expire_at)]
+    clock.now += 11
+    assert cache_proxy.get_many(['a', 'b']) == [None, None]
+
+
+def test_add_only_sets_a_missing_or_expired_name(cache_proxy, clock):
+    assert cache_proxy.add('lock', b'first', ex=10)
+    assert not cache_proxy.add('lock', b'second', ex=10)
+    assert cache_proxy.get('lock') == b'first'
+    clock.now += 11
+    assert cache_proxy.add('lock', b'third', ex=10)
+    assert cache_proxy.get('lock') == b'third'
+
+
+def test_delete_skips_missing_names(cache_proxy):
+    cache_proxy.set_many({'a': b'1', 'b': b'2'})
+    cache_proxy.delete(['a', 'missing'])
+    cache_proxy.delete([])
+    assert cache_proxy.get_many(['a', 'b']) == [None, b'2']
+
+
+def test_clear_expired_data_counts_removed_values(cache_proxy, clock):
+    cache_proxy.set('a', b'123', ex=10, lib=CacheLib.RUNTIME)
+    cache_proxy.set('b', b'45', ex=100)
+    cache_proxy.set('c', b'6')
+    clock.now += 11
+    # The tiered proxy leaves it to its backend, like the cleanup job does.
+    assert getattr(cache_proxy, 'backend', cache_proxy).clear_expired_data() == (1, 3)
+    assert cache_proxy.get_many(['b', 'c']) == [b'45', b'6']
+
+
+def test_delete_prefix_removes_only_matching_names(cache_proxy):
+    cache_proxy.set_many({'[Old]a': b'1', '[Old]b': b'2', '[Olc]c': b'3', '[New]a': b'4'}, lib=CacheLib.RUNTIME)
+    cache_proxy.set('[Old]a', b'config', lib=CacheLib.CONFIG)
+    assert cache_proxy.delete_prefix('[Old]', lib=CacheLib.RUNTIME) == 2
+    assert cache_proxy.get_many(['[Old]a', '[Old]b', '[Olc]c', '[New]a'], lib=CacheLib.RUNTIME) == [None, None, b'3', b'4']
+    assert cache_proxy.get('[Old]a', lib=CacheLib.CONFIG) == b'config'
+
+
+def test_delete_prefix_rejects_an_empty_prefix(cache_proxy):
+    cache_proxy.set('a', b'1')
+    with pytest.raises(ValueError):
+        cache_proxy.delete_prefix('')
+    assert cache_proxy.get('a') == b'1'
+
+
+def test_switch_to_incremental_vacuum_waits_for_the_cleanup_job(tmp_path):
+    db_path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE runtime_cache(key TEXT PRIMARY KEY, value BLOB, set_time INTEGER, exp_time INTEGER)')
+    conn.executemany('INSERT INTO runtime_cache VALUES (?, ?, 0, 0)', [(f'[Img]{i}', b'x' * 8192) for i in range(200)])
+    conn.commit()
+    conn.close()
+
+    def pragma(name: str) -> int:
+        with sqlite3.connect(db_path) as check:
+            return check.execute(f'PRAGMA {name}').fetchone()[0]
+
+    proxy = SQLiteCacheProxy(db_path)
+    assert pragma('auto_vacuum') == 0
+    proxy.delete_prefix('[Img]', lib=CacheLib.RUNTIME)
+    pages = pragma('page_count')
+    proxy.clear_expired_data()
+    assert pragma('auto_vacuum') == 2
+    # The VACUUM ran after the purge, the pages of the deleted rows are gone too.
+    assert pragma('page_count') < pages / 10
+    proxy.close()
@@ -0,0 +1,104 @@
+import gzip
+import json
+import asyncio
+import logging
+from dataclasses import asdict, replace
+
+import brotli
+
+from cache_proxy import AsyncMemoryCacheProxy, CacheLib
+from single_flight import SingleFlight
+from feed_cache import ENCODINGS, FeedCache, FeedEncoder, choose_encoding
+
+CHUNKS = ['<rss>', '<item>一</item>' * 50, '</rss>']
+DOCUMENT = ''.join(CHUNKS).encode('utf-8')
+
+
+def new_feed_cache() -> FeedCache:
+    cache_proxy = AsyncMemoryCacheProxy()
+    return FeedCache(cache_proxy, SingleFlight(), logging.getLogger(__name__))
+
+
+def test_encoder_produces_every_representation():
+    encoder = FeedEncoder()
+    streamed = b''.join(encoder.encode(CHUNKS, 'gzip'))
+    bodies = encoder.bodies()
+    assert set(bodies) == set(ENCODINGS)
+    assert bodies['identity'] == DOCUMENT
+    assert streamed == bodies['gzip']
+    assert gzip.decompress(bodies['gzip']) == DOCUMENT
+    assert brotli.decompress(bodies['br']) == DOCUMENT
+
+
+def test_identical_bodies_keep_version():
+    first, second = FeedEncoder(), FeedEncoder()
+    first.consume(CHUNKS)
+    second.consume(CHUNKS)
+    assert first.version == second.version
+    assert first.bodies() == second.bodies()
+
+
+def test_identity_body_is_stored_and_served_as_is():
+    async def main():
+        feed_cache = new_feed_cache()
+        meta, _ = await feed_cache.store('feed', CHUNKS, soft_ttl=60, hard_ttl=600)
+        assert meta.encodings['identity'] == len(DOCUMENT)
+        stored = await feed_cache.cache_proxy.get(feed_cache.body_key('feed', meta.version, 'identity'), lib=CacheLib.RUNTIME)
+        assert stored == DOCUMENT
+        assert await feed_cache.get_body('feed', meta) == DOCUMENT
+
+    asyncio.run(main())
+
+
+def test_new_version_deletes_every_previous_body():
+    async def main():
+        feed_cache = new_feed_cache()
+        old, _ = await feed_cache.store('feed', CHUNKS, soft_ttl=60, hard_ttl=600)
+        new, _ = await feed_cache.store('feed', ['<rss/>'], soft_ttl=60, hard_ttl=600)
+        assert new.version != old.version
+        for encoding in ENCODINGS:
+            assert await feed_cache.get_body('feed', old, encoding) is None
+            assert await feed_cache.get_body('feed', new, encoding) is not None
+        assert (await feed_cache.get_meta('feed')).version == new.version
+
+    asyncio.run(main())
+
+
+def test_regenerating_an_identical_body_keeps_last_modified():
+    async def main():
+        feed_cache = new_feed_cache()
+        first, _ = await feed_cache.store('feed', CHUNKS, soft_ttl=60, hard_ttl=600)
+        await feed_cache.cache_proxy.set(feed_cache.meta_key('feed'), json.dumps(asdict(replace(first, last_modified=1))), lib=CacheLib.RUNTIME)
+        second, _ = await feed_cache.store('feed', CHUNKS, soft_ttl=60, hard_ttl=600)
+        assert second.last_modified == 1
+        assert await feed_cache.get_body('feed', second, 'br') is not None
+
+    asyncio.run(main())
+
+
+def test_serve_returns_stale_copy_and_revalidates():
+    generated = []
+
+    async def generate():
+        generated.append(None)
+        return [f'<rss>{len(generated)}</rss>']
+
+    async def main():
+        feed_cache = new_feed_cache()
+        meta, bodies = await feed_cache.serve('feed', generate, soft_ttl=0, hard_ttl=600)
+        assert bodies['identity'] == b'<rss>1</rss>'
+        stale, bodies = await feed_cache.serve('feed', generate, soft_ttl=0, hard_ttl=600)
+        assert stale.version == meta.version and bodies == {}
+        await asyncio.gather(*feed_cache.background)
+        assert await feed_cache.get_body('feed', await feed_cache.get_meta('feed')) == b'<rss>2</rss>'
+
+    asyncio.run(main())
+
+
+def test_choose_encoding():
+    available = dict.fromkeys(ENCODINGS, 0)
+    assert choose_encoding(None, available) == 'identity'
+    assert choose_encoding('gzip, deflate, br', available) == 'br'
+    assert choose_encoding('gzip;q=1, br;q=0.5', available) == 'gzip'
+    assert choose_encoding('br;q=0, gzip;q=0', available) == 'identity'
+    assert choose_encoding('*', {'gzip': 0, 'identity': 0}) == 'gzip'
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from rate_limiter import HostLimit, HostPolicy, RateLimiter, RateLimitExceeded
+
+
+def test_burst_then_waits_at_the_rate():
+    host_limit = HostLimit(HostPolicy(rate=10, burst=2))
+    assert host_limit.reserve() == 0
+    assert host_limit.reserve() == 0
+    assert host_limit.reserve() == pytest.approx(0.1, abs=0.01)
+    assert host_limit.stats()['throttled'] == 1
+
+
+def test_reserve_rejects_without_taking_the_token():
+    host_limit = HostLimit(HostPolicy(rate=1, burst=1, max_wait_s=0.5))
+    host_limit.reserve()
+    tokens = host_limit.tokens
+    with pytest.raises(RateLimitExceeded):
+        host_limit.reserve()
+    assert host_limit.tokens == pytest.approx(tokens, abs=0.01)
+    assert host_limit.reserve(max_wait_s=2) == pytest.approx(1, abs=0.01)
+    assert host_limit.stats()['rejected'] == 1
+
+
+def test_risk_control_halves_the_rate_and_pauses():
+    host_limit = HostLimit(HostPolicy(rate=8, burst=4, cooldown_s=30, max_wait_s=10))
+    host_limit.report(risk_control=True)
+    assert host_limit.rate == 4
+    assert host_limit.blocked_for() == pytest.approx(30, abs=0.1)
+    assert host_limit.cooldown == 60
+    with pytest.raises(RateLimitExceeded):
+        host_limit.reserve()
+    # A caller allowed to wait queues behind the cooldown and the token debt it left.
+    assert host_limit.reserve(max_wait_s=60) > 30
+
+
+def test_rate_recovers_after_the_cooldown():
+    host_limit = HostLimit(HostPolicy(rate=20, cooldown_s=0, min_rate=1))
+    host_limit.report(risk_control=True)
+    assert host_limit.rate == 10
+    for _ in range(10):
+        host_limit.report(risk_control=False)
+    assert host_limit.rate == 20
+    assert host_limit.cooldown == 0
+
+
+def test_rate_never_drops_below_min_rate():
+    host_limit = HostLimit(HostPolicy(rate=1, min_rate=0.25, cooldown_s=0))
+    for _ in range(5):
+        host_limit.report(risk_control=True)
+    assert host_limit.rate == 0.25
+
+
+def test_wait_blocked_gives_the_token_back():
+    host_limit = HostLimit(HostPolicy(rate=100, burst=1, cooldown_s=30, max_wait_s=10))
+    assert host_limit.reserve() == 0
+    host_limit.report(risk_control=True)  # arrived while the caller held its token
+    tokens = host_limit.tokens
+    with pytest.raises(RateLimitExceeded):
+        host_limit.wait_blocked()
+    assert host_limit.tokens == tokens + 1
+
+
+def test_limit_caps_concurrency():
+    limiter = RateLimiter()
+    limiter.configure('api.example.com', HostPolicy(rate=1000, burst=100, max_concurrency=2))
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with limiter.limit('api.example.com'):
+            peak = max(peak, limiter.hosts['api.example.com'].in_flight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*[call() for _ in range(10)])
+
+    asyncio.run(main())
+    assert peak == 2
+    assert limiter.stats()['api.example.com']['requests'] == 10
+
+
+def test_limit_sync_rejects_a_paused_host():
+    limiter = RateLimiter()
+    limiter.configure('api.example.com', HostPolicy(rate=10, cooldown_s=30))
+    assert limiter.report('api.example.com', 429)
+    with pytest.raises(RateLimitExceeded):
+        with limiter.limit_sync('api.example.com'):
+            pass
+
+
+def test_hosts_without_a_policy_are_not_limited():
+    limiter = RateLimiter()
+    assert not limiter.limited('example.com')
+    assert not limiter.report('example.com', 429)
+    with limiter.limit_sync('example.com'):
+        pass
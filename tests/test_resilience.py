@@ -0,0 +1,89 @@
+import time
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+from resilience import CircuitBreaker, FetchResult, RetryPolicy, fetch_with_retry
+
+
+def test_retry_delay_is_bounded_full_jitter():
+    policy = RetryPolicy(base_delay_s=0.5, max_delay_s=2)
+    for attempt in range(6):
+        for _ in range(50):
+            assert 0 <= policy.delay(attempt) <= min(2, 0.5 * 2 ** attempt)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout_s=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    assert breaker.stats() == {'state': 'open', 'failures': 3, 'opens': 1, 'rejected': 1}
+
+
+def test_breaker_lets_one_probe_through_after_the_timeout():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout_s=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()  # only the probe
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
+
+
+def run_fetch(results: list[FetchResult], breaker: CircuitBreaker, **kwargs) -> tuple[FetchResult, int]:
+    calls = 0
+
+    async def func() -> FetchResult:
+        nonlocal calls
+        calls += 1
+        return results[calls - 1]
+
+    result = asyncio.run(fetch_with_retry(func, breaker, RetryPolicy(attempts=3, base_delay_s=0.001, max_delay_s=0.001), **kwargs))
+    return result, calls
+
+
+def test_fetch_retries_until_success():
+    breaker = CircuitBreaker('test', failure_threshold=1)
+    result, calls = run_fetch([FetchResult(ok=False, msg='timeout'), FetchResult(ok=True, data=1)], breaker)
+    assert result.ok and result.data == 1
+    assert calls == 2
+    assert breaker.state == 'closed'
+
+
+def test_fetch_stops_at_a_result_not_worth_retrying():
+    breaker = CircuitBreaker('test', failure_threshold=1)
+    result, calls = run_fetch(
+        [FetchResult(ok=False, msg='no such user')], breaker,
+        retryable=lambda r: False, upstream_failure=lambda r: False,
+    )
+    assert not result.ok and result.msg == '1 attempt(s) failed: no such user'
+    assert calls == 1
+    assert breaker.state == 'closed'
+
+
+def test_fetch_fails_fast_while_the_circuit_is_open():
+    breaker = CircuitBreaker('test', failure_threshold=1)
+    result, calls = run_fetch([FetchResult(ok=False, msg=str(i)) for i in range(3)], breaker)
+    assert result.msg == '3 attempt(s) failed: 0; 1; 2'
+    assert breaker.state == 'open'
+    result, calls = run_fetch([], breaker)
+    assert not result.ok and result.msg == 'circuit test open'
+    assert calls == 0
+
+
+def test_fetch_result_is_generic():
+    assert FetchResult[int](ok=True, data=1).data == 1
+    with pytest.raises(ValidationError):
+        FetchResult[int](ok=True, data='not a number')
@@ -0,0 +1,116 @@
+import asyncio
+
+from cache_proxy import AsyncMemoryCacheProxy, CacheLib
+from single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    runs = []
+
+    async def func():
+        runs.append(None)
+        await asyncio.sleep(0.05)
+        return len(runs)
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*[flight.do('k', func) for _ in range(5)])
+        assert results == [1] * 5
+        assert flight.in_flight() == 0
+        assert await flight.do('k', func) == 2
+
+    asyncio.run(main())
+
+
+def test_exception_reaches_every_caller():
+    async def func():
+        await asyncio.sleep(0.01)
+        raise ValueError('down')
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*[flight.do('k', func) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(e, ValueError) for e in results)
+
+    asyncio.run(main())
+
+
+def test_other_process_waits_for_the_result():
+    async def main():
+        cache_proxy = AsyncMemoryCacheProxy()
+        first, second = SingleFlight(cache_proxy, poll_interval=0.01), SingleFlight(cache_proxy, poll_interval=0.01)
+        runs = []
+
+        async def func():
+            runs.append(None)
+            await asyncio.sleep(0.05)
+            await cache_proxy.set('result', b'done', lib=CacheLib.RUNTIME)
+            return b'done'
+
+        async def recheck():
+            return await cache_proxy.get('result', lib=CacheLib.RUNTIME)
+
+        results = await asyncio.gather(first.do('k', func, recheck), second.do('k', func, recheck))
+        assert results == [b'done', b'done']
+        assert len(runs) == 1
+        assert await cache_proxy.get('[SingleFlight]k', lib=CacheLib.RUNTIME) is None
+
+    asyncio.run(main())
+
+
+def test_failed_leader_releases_the_lock():
+    async def main():
+        cache_proxy = AsyncMemoryCacheProxy()
+        flight = SingleFlight(cache_proxy, lock_ttl=10)
+
+        async def func():
+            raise ValueError('down')
+
+        async def recheck():
+            return None
+
+        try:
+            await flight.do('k', func, recheck)
+        except ValueError:
+            pass
+        assert await cache_proxy.get('[SingleFlight]k', lib=CacheLib.RUNTIME) is None
+
+    asyncio.run(main())
+
+
+def test_lock_taken_over_after_expiry_is_not_released():
+    async def main():
+        cache_proxy = AsyncMemoryCacheProxy()
+        flight = SingleFlight(cache_proxy, lock_ttl=1, poll_interval=0.01)
+
+        async def func():
+            await asyncio.sleep(1.1)
+            # lock_ttl passed, another process took the lock
+            assert await cache_proxy.add('[SingleFlight]k', b'other', ex=10, lib=CacheLib.RUNTIME)
+            return b'done'
+
+        async def recheck():
+            return None
+
+        assert await flight.do('k', func, recheck) == b'done'
+        assert await cache_proxy.get('[SingleFlight]k', lib=CacheLib.RUNTIME) == b'other'
+
+    asyncio.run(main())
+
+
+def test_lock_held_by_another_token_is_not_released():
+    async def main():
+        cache_proxy = AsyncMemoryCacheProxy()
+        flight = SingleFlight(cache_proxy, lock_ttl=10)
+
+        async def func():
+            await cache_proxy.set('[SingleFlight]k', b'other', ex=10, lib=CacheLib.RUNTIME)
+            return b'done'
+
+        async def recheck():
+            return None
+
+        await flight.do('k', func, recheck)
+        assert await cache_proxy.get('[SingleFlight]k', lib=CacheLib.RUNTIME) == b'other'
+
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+import json
+import asyncio
+
+import httpx
+
+from rate_limiter import RateLimiter, HostPolicy
+from routes.bilibili.collect_api import auth
+from routes.bilibili.collect_api.client import RateLimitedTransport, RateLimitedError, bilibili_risk_control
+
+NAV = {'code': 0, 'data': {'wbi_img': {
+    'img_url': 'https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png',
+    'sub_url': 'https://i0.hdslb.com/bfs/wbi/4932caff0ff746eab6f01bf08b70ac45.png',
+}}}
+
+
+def new_client(limiter: RateLimiter) -> httpx.AsyncClient:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == '/x/web-interface/nav':
+            return httpx.Response(200, json=NAV)
+        return httpx.Response(200, json={'code': -352, 'message': '-352'})
+    return httpx.AsyncClient(transport=RateLimitedTransport(httpx.MockTransport(handler), limiter))
+
+
+def new_limiter() -> RateLimiter:
+    limiter = RateLimiter()
+    limiter.configure('api.bilibili.com', HostPolicy(
+        rate=100, burst=4, cooldown_s=0.3, max_wait_s=0.05, risk_control=bilibili_risk_control,
+    ))
+    return limiter
+
+
+def test_get_mixin_key_is_cached_per_key_pair():
+    signer = auth.WbiSigner(None)
+    mixin_key = signer.get_mixin_key('a' * 32, 'b' * 32)
+    assert mixin_key == auth.getMixinKey('a' * 32 + 'b' * 32)
+    assert signer.sign({'foo': 'bar'}, 'a' * 32, 'b' * 32, wts=1) == auth.wbiQuery({'foo': 'bar'}, mixin_key, 1)
+
+
+def test_key_refresh_waits_out_the_risk_control_cooldown():
+    async def main():
+        limiter = new_limiter()
+        async with new_client(limiter) as client:
+            await client.get('https://api.bilibili.com/x/space/wbi/arc/search')
+            assert limiter.hosts['api.bilibili.com'].blocked_for() > 0.05
+            try:
+                await auth.getWbiKeys(client)
+            except RateLimitedError:
+                pass
+            else:
+                raise AssertionError('a plain request must not wait through the cooldown')
+            return await auth.getWbiKeys(client, max_wait_s=1)
+
+    assert asyncio.run(main()) == ('7cd084941338484aae1ad9425b84077c', '4932caff0ff746eab6f01bf08b70ac45')
+
+
+def test_failed_refresh_is_retried_on_the_next_report():
+    results = [False, True]
+    calls = []
+
+    async def refresh() -> bool:
+        calls.append(None)
+        return results[len(calls) - 1]
+
+    async def main():
+        signer = auth.WbiSigner(refresh, min_refresh_interval_s=300)
+        tasks = [signer.keys_stale() for _ in range(3)]
+        assert tasks[0] is tasks[1] is tasks[2]
+        assert await tasks[0] is False
+        assert await signer.keys_stale() is True
+        assert signer.keys_stale() is None
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+def test_refresh_after_risk_control_answer():
+    async def main():
+        limiter = new_limiter()
+        async with new_client(limiter) as client:
+            keys = []
+
+            async def refresh() -> bool:
+                keys.append(await auth.getWbiKeys(client, max_wait_s=1))
+                return True
+
+            signer = auth.WbiSigner(refresh)
+            body = json.loads((await client.get('https://api.bilibili.com/x/space/wbi/arc/search')).content)
+            assert body['code'] == -352
+            assert await signer.keys_stale() is True
+            return keys
+
+    assert asyncio.run(main()) == [('7cd084941338484aae1ad9425b84077c', '4932caff0ff746eab6f01bf08b70ac45')]